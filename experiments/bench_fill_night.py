@@ -0,0 +1,103 @@
+#
+# bench_fill_night.py -- time Scheduler.fill_night_schedule() on one night
+#
+"""
+Benchmark of Scheduler.fill_night_schedule() on a realistic night: a
+ten hour HSC night with four filters installed, and a queue of random
+OBs (targets all over the sky, a mix of filters, exposure times,
+seeing, transparency and moon constraints, and calibration targets)
+from a handful of programs.  The night is filled several times and
+the best time is reported, along with the number of slots.
+
+Usage: python bench_fill_night.py [num_obs] [num_runs]
+"""
+from __future__ import print_function
+import sys
+import time
+import random
+import logging
+
+from ginga.misc import Bunch
+from ginga.util import wcs
+
+from qplan import entity, Scheduler
+from qplan.util import site
+
+
+def make_obs(num_obs, seed=1):
+    rnd = random.Random(seed)
+    programs = {}
+    for i in range(8):
+        pgm = entity.Program('S17A-%03d' % i, rank=rnd.uniform(1, 10),
+                             category='open', hours=rnd.uniform(2, 12))
+        programs[str(pgm)] = pgm
+    pgms = list(programs.values())
+
+    oblist = []
+    for i in range(num_obs):
+        tgt = entity.HSCTarget(name='t%d' % i,
+                               ra=wcs.raDegToString(rnd.uniform(0, 360)),
+                               dec=wcs.decDegToString(rnd.uniform(-20, 60)))
+        inscfg = entity.HSCConfiguration(filter=rnd.choice('grizy'),
+                                         num_exp=rnd.randint(1, 6),
+                                         exp_time=rnd.choice([60, 120, 300]))
+        telcfg = entity.TelescopeConfiguration(focus='P_OPT2')
+        envcfg = entity.EnvironmentConfiguration(
+            seeing=rnd.choice([0.8, 1.0, 1.5]),
+            airmass=rnd.choice([1.5, 2.0, None]),
+            moon=rnd.choice(['dark', 'any']),
+            transparency=rnd.choice([0.5, 0.7, 0.9]),
+            moon_sep=rnd.choice([30.0, 45.0]))
+        calib = rnd.choice([None, 'default', None])
+        total_time = inscfg.exp_time * inscfg.num_exp + 60
+        ob = entity.OB(program=pgms[i % len(pgms)], target=tgt,
+                       telcfg=telcfg, inscfg=inscfg, envcfg=envcfg,
+                       total_time=total_time, acct_time=total_time,
+                       priority=rnd.choice([1.0, 2.0]), name='ob%d' % i,
+                       calib_tgtcfg=calib,
+                       calib_inscfg=('default' if calib else None))
+        oblist.append(ob)
+    return programs, oblist
+
+def fill_night(sdlr, observer, programs, oblist):
+    data = Bunch.Bunch(filters=['g', 'r', 'i', 'z'], instruments=['HSC'],
+                       categories=['open'], dome='open', seeing=1.0,
+                       transparency=0.8, cur_filter='g', cur_az=-90.0,
+                       cur_el=89.0)
+    start_time = observer.get_date("2017-04-10 19:30")
+    stop_time = observer.get_date("2017-04-11 05:30")
+    schedule = entity.Schedule(start_time, stop_time, data=data)
+
+    props = {}
+    for key, pgm in programs.items():
+        props[key] = Bunch.Bunch(pgm=pgm, obs=[], obcount=0,
+                                 sched_time=0.0, total_time=pgm.total_time)
+
+    t1 = time.time()
+    sdlr.fill_night_schedule(schedule, observer, oblist, props)
+    return time.time() - t1, schedule
+
+def main(num_obs, num_runs):
+    logger = logging.getLogger('bench')
+    observer = site.get_site('subaru')
+    sdlr = Scheduler.Scheduler(logger, observer)
+    programs, oblist = make_obs(num_obs)
+
+    times = []
+    for i in range(num_runs):
+        elapsed, schedule = fill_night(sdlr, observer, programs, oblist)
+        times.append(elapsed)
+
+    print("%d OBs, %d slots: best %.3f sec, mean %.3f sec (%d runs)" % (
+        num_obs, schedule.num_slots(), min(times),
+        sum(times) / len(times), num_runs))
+
+if __name__ == '__main__':
+    num_obs, num_runs = 1000, 5
+    if len(sys.argv) > 1:
+        num_obs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_runs = int(sys.argv[2])
+    main(num_obs, num_runs)
+
+# END
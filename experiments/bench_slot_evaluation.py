@@ -0,0 +1,88 @@
+#
+# bench_slot_evaluation.py -- compare result records of check_slot()
+#
+"""
+Microbenchmark of the result records of check_slot(): the Bunch that
+used to be returned (and filled in with setvals()) against the
+fixed-layout qsim.SlotEvaluation.  Creates as many records as a night
+of OBs x slots would, and reports the time taken and the memory held.
+
+Usage: python bench_slot_evaluation.py [num_records]
+"""
+from __future__ import print_function
+import sys
+import time
+import gc
+import tracemalloc
+
+from ginga.misc import Bunch
+
+from qplan import qsim
+
+
+def make_bunch(ob):
+    res = Bunch.Bunch(ob=ob, obs_ok=False, reason=qsim.no_reason)
+    res.setvals(obs_ok=True, prev_ob=None,
+                prep_sec=10.0, slew_sec=60.0,
+                slew2_sec=0.0,
+                filterchange=False,
+                filterchange_sec=0.0,
+                calibration_sec=0.0,
+                start_time=None, stop_time=None,
+                delay_sec=0.0)
+    return res
+
+def make_record(ob):
+    res = qsim.SlotEvaluation(ob)
+    res.set_result(obs_ok=True, prev_ob=None,
+                   prep_sec=10.0, slew_sec=60.0,
+                   slew2_sec=0.0,
+                   filterchange=False,
+                   filterchange_sec=0.0,
+                   calibration_sec=0.0,
+                   start_epoch=None, stop_epoch=None,
+                   delay_sec=0.0)
+    return res
+
+def measure(fn, num):
+    ob = object()
+    gc.collect()
+    t1 = time.time()
+    results = [fn(ob) for i in range(num)]
+    elapsed = time.time() - t1
+
+    # memory held by the records
+    results = None
+    gc.collect()
+    tracemalloc.start()
+    results = [fn(ob) for i in range(num)]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # read the fields, as Scheduler.cmp_res() does
+    t1 = time.time()
+    total = 0.0
+    for res in results:
+        total += res.slew_sec + res.delay_sec + res.filterchange_sec
+    elapsed_read = time.time() - t1
+    return elapsed, elapsed_read, size
+
+def main(num):
+    print("%d records" % (num))
+    base = None
+    for name, fn in (('Bunch', make_bunch),
+                     ('SlotEvaluation', make_record)):
+        elapsed, elapsed_read, size = measure(fn, num)
+        if base is None:
+            base = size
+        print("%-16s create %6.3f sec  read %6.3f sec  %8.1f KiB (%3.0f%%)" % (
+            name, elapsed, elapsed_read, size / 1024.0,
+            size * 100.0 / base))
+
+if __name__ == '__main__':
+    num = 200000
+    if len(sys.argv) > 1:
+        num = int(sys.argv[1])
+    main(num)
+
+# END
@@ -6,7 +6,10 @@
 #
 import os
 import time
+import logging
+import heapq
 from datetime import timedelta
+from collections import Counter
 import pytz
 import numpy
 from io import BytesIO, StringIO
@@ -21,7 +24,6 @@ from . import misc
 from . import entity
 from . import common
 from . import qsim
-from .util import qsort
 
 # maximum rank for a program
 max_rank = 10.0
@@ -42,6 +44,7 @@ class Scheduler(Callback.Callbacks):
 
         # these are the main data structures used to schedule
         self.oblist = []
+        self.invariant_table = None
         self.schedule_recs = []
         self.programs = dict()
         self.apriori_info = dict()
@@ -66,6 +69,14 @@ class Scheduler(Callback.Callbacks):
         # and they may be rescheduled
         self.remove_scheduled_obs = True
 
+        # number of processes to use for checking the feasibility of
+        # OBs on all nights before scheduling
+        self.num_procs = 1
+
+        # counts of the reason codes of rejected OBs, one Counter per
+        # scheduled night (see schedule_all())
+        self.rejection_counts = []
+
     def set_weights(self, weights):
         self.weights = weights
 
@@ -82,6 +93,8 @@ class Scheduler(Callback.Callbacks):
 
     def set_oblist_info(self, info):
         self.oblist = info
+        # encode instruments, filters and categories for fast checks
+        self.invariant_table = qsim.InvariantTable(info)
 
     def set_schedule_info(self, info):
         # Set our schedule_recs attribute to the supplied data
@@ -104,7 +117,7 @@ class Scheduler(Callback.Callbacks):
 
     def cmp_res(self, res1, res2):
         """
-        Compare two results from check_slot.
+        Compare two results (qsim.SlotEvaluation) from check_slot.
 
         Calculate a number based on the
         - slew time to target (weight: w_slew)
@@ -146,50 +159,202 @@ class Scheduler(Callback.Callbacks):
         ##     self._ob_code(res1.ob), t1, self._ob_code(res2.ob), t2))
         return res
 
+    def score_results(self, results):
+        """
+        Calculate scores for a list of results from check_slot, with
+        the same terms and weights as cmp_res(), for all results at
+        once.  The priority of the OB is always added in, so that the
+        scores order OBs of the same program as cmp_res() does.
+
+        LOWER NUMBERS ARE BETTER!
+        """
+        wts = self.weights
+
+        slew = numpy.array([res.slew_sec for res in results], dtype=float)
+        delay = numpy.array([res.delay_sec for res in results], dtype=float)
+        filterchange = numpy.array([res.filterchange_sec for res in results],
+                                   dtype=float)
+        rank = numpy.array([res.ob.program.rank for res in results],
+                           dtype=float)
+        priority = numpy.array([res.ob.priority for res in results],
+                               dtype=float)
+
+        r_slew = numpy.minimum(slew, self.max_slew) / self.max_slew
+        r_delay = numpy.minimum(delay, self.max_delay) / self.max_delay
+        r_filter = (numpy.minimum(filterchange, self.max_filterchange) /
+                    self.max_filterchange)
+        # invert because higher rank should make a lower number
+        r_rank = 1.0 - numpy.minimum(rank, self.max_rank) / self.max_rank
+
+        return ((wts.w_slew * r_slew) + (wts.w_delay * r_delay) +
+                (wts.w_filterchange * r_filter) + (wts.w_rank * r_rank) +
+                (wts.w_priority * priority))
+
+    def score_result(self, res):
+        """
+        Score of one result from check_slot; the same as
+        score_results() would give for it.
+        """
+        wts = self.weights
+
+        r_slew = min(res.slew_sec, self.max_slew) / self.max_slew
+        r_delay = min(res.delay_sec, self.max_delay) / self.max_delay
+        r_filter = (min(res.filterchange_sec, self.max_filterchange) /
+                    self.max_filterchange)
+        r_rank = 1.0 - min(res.ob.program.rank, self.max_rank) / self.max_rank
+
+        return ((wts.w_slew * r_slew) + (wts.w_delay * r_delay) +
+                (wts.w_filterchange * r_filter) + (wts.w_rank * r_rank) +
+                (wts.w_priority * res.ob.priority))
 
-    def eval_slot(self, prev_slot, slot, site, oblist):
+    def score_bounds(self, oblist):
+        """
+        Lower bounds of the scores of the OBs in `oblist` in any slot:
+        the rank and priority terms of the score.  The slew, delay and
+        filter change terms can only add to these.
+        """
+        wts = self.weights
 
-        # evaluate each OB against this slot
-        results = map(lambda ob: qsim.check_slot(site, prev_slot, slot, ob),
-                           oblist)
+        rank = numpy.array([ob.program.rank for ob in oblist], dtype=float)
+        priority = numpy.array([ob.priority for ob in oblist], dtype=float)
+        r_rank = 1.0 - numpy.minimum(rank, self.max_rank) / self.max_rank
 
-        # filter out unobservable OBs
-        good = list(filter(lambda res: res.obs_ok, results))
-        bad = list(filter(lambda res: not res.obs_ok, results))
+        return (wts.w_rank * r_rank) + (wts.w_priority * priority)
 
-        # sort according to desired criteria
-        # NOTE: we cannot use python's built in sort with this comparison
-        # function, even using functools.cmp_to_key (!) It does not give
-        # correct results!!
-        good = qsort.qsort(good, cmp_fn=self.cmp_res)
+    def eval_slot(self, prev_slot, slot, site, oblist, night=None):
+        """
+        Evaluate the OBs in `oblist` for `slot` following `prev_slot`.
+
+        Returns a tuple (good, bad).  `good` generates the results of
+        the OBs that can be observed in the slot, best (lowest score)
+        first.  `bad` is a list of the results of the OBs that cannot.
 
+        The OBs are evaluated lazily, in order of the lower bounds of
+        their scores, and a result is generated as soon as no OB left
+        to evaluate can beat it.  So OBs that cannot win the slot are
+        never evaluated, and `bad` only grows while `good` is consumed.
+        """
+        oblist = list(oblist)
+        bad = []
+        if (night is not None) and (night.obtable is not None):
+            # do the cheap checks for all OBs at once; only those that
+            # pass need the full evaluation
+            mask = night.obtable.prefilter(slot, oblist)
+            candidates, prefiltered = [], []
+            for i, (ob, ok) in enumerate(zip(oblist, mask)):
+                if not ok:
+                    res = qsim.check_slot_gates(slot, ob, night=night)
+                    if res is not None:
+                        bad.append(res)
+                        continue
+                candidates.append(i)
+                prefiltered.append(bool(ok))
+
+        else:
+            candidates = list(range(len(oblist)))
+            prefiltered = [False] * len(oblist)
+
+        bounds = self.score_bounds([oblist[i] for i in candidates])
+        # stable, so that ties are evaluated in their original order
+        order = numpy.argsort(bounds, kind='mergesort')
+
+        candidates = [(candidates[k], oblist[candidates[k]], prefiltered[k])
+                      for k in order]
+        good = self._iter_bounded(prev_slot, slot, site, candidates,
+                                  bounds[order], night, bad)
         return good, bad
 
-    def fill_night_schedule(self, schedule, site, oblist, props):
+    def _iter_bounded(self, prev_slot, slot, site, candidates, bounds,
+                      night, bad):
+        # branch and bound over the (index, OB, prefiltered) `candidates`,
+        # sorted by the lower `bounds` of their scores; results of equal
+        # score come out in the order of their indexes.  No score can be
+        # below its bound, so once one candidate of a run of equal bounds
+        # is evaluated, all of them are; they are evaluated, and scored,
+        # as one batch
+        heap = []
+        num = len(candidates)
+        k = 0
+        while k < num:
+            end = int(numpy.searchsorted(bounds, bounds[k], side='right'))
+
+            results = []
+            for i, ob, ok in candidates[k:end]:
+                res = qsim.check_slot(site, prev_slot, slot, ob,
+                                      night=night, prefiltered=ok)
+                if res.obs_ok:
+                    results.append((i, res))
+                else:
+                    bad.append(res)
+            k = end
+
+            if len(results) > 0:
+                scores = self.score_results([res for i, res in results])
+                for (i, res), score in zip(results, scores):
+                    heapq.heappush(heap, (score, i, res))
+
+            while (len(heap) > 0) and ((k == num) or
+                                       (heap[0][0] < bounds[k])):
+                yield heapq.heappop(heap)[2]
+
+    def _reject(self, ob, reason, rejections, debug):
+        # note the rejection of `ob` for `reason` (a qsim.Reason)
+        if rejections is not None:
+            rejections[reason.code] += 1
+        if debug:
+            ob_id = self._ob_code(ob)
+            self.logger.debug("rejected %s (%s) because: %s" % (
+                ob, ob_id, reason))
+
+    def fill_night_schedule(self, schedule, site, oblist, props,
+                            visible=None, rejections=None, night=None):
         """Fill the schedule `schedule` for observations from site `site` using
         observation blocks from `oblist` with OB<->proposal index `props`.
+        If given, `visible` maps every OB to None if it is visible during
+        this night, or else to the reason why not.  If `rejections` (a
+        Counter) is given, the reason codes of the rejected OBs are
+        counted in it.  `night` has the precomputed tables for the night
+        (see qsim.prepare_night()), if they were built already.
         """
+        # the messages of rejected OBs are only formatted for debugging
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+
         # check all available OBs against this slot and remove those
         # that cannot be used in this schedule a priori (e.g. wrong instrument, etc.)
-        usable, cantuse, results = qsim.check_schedule_invariant(site, schedule, oblist)
-        for ob in cantuse:
-            res = results[ob]
-            ob_id = self._ob_code(res.ob)
-            self.logger.debug("rejected %s (%s) because: %s" % (
-                res.ob, ob_id, res.reason))
+        usable, cantuse, results = qsim.check_schedule_invariant(
+            site, schedule, oblist, table=self.invariant_table)
+        if debug or (rejections is not None):
+            for ob in cantuse:
+                self._reject(ob, results[ob].reason, rejections, debug)
+
+        # precompute tables (visibility, etc.) for this night
+        if night is None:
+            night = qsim.prepare_night(site, schedule.start_time,
+                                       schedule.stop_time, oblist=usable)
+        else:
+            night.obtable = qsim.OBTable(usable, vis=night.vis)
 
         # make a visibility map, and reject OBs that are not visible
         # during this night for long enough to meet the exposure times
-        usable, bad, obmap = qsim.check_night_visibility(site, schedule, usable)
+        if visible is None:
+            usable, bad, obmap = qsim.check_night_visibility(site, schedule,
+                                                             usable,
+                                                             night=night)
+        else:
+            # visibility was already checked for all nights
+            qsim.precompute_night_visibility(night, usable)
+            bad = [ob for ob in usable if visible[ob] is not None]
+            usable = [ob for ob in usable if visible[ob] is None]
+            obmap = dict((str(ob), Bunch.Bunch(ob=ob, obs_ok=False,
+                                               reason=visible[ob]))
+                         for ob in bad)
         cantuse.extend(bad)
         for ob in bad:
-            res = obmap[str(ob)]
-            ob_id = self._ob_code(res.ob)
-            self.logger.debug("rejected %s (%s) because: %s" % (
-                res.ob, ob_id, res.reason))
+            self._reject(ob, obmap[str(ob)].reason, rejections, debug)
 
-        # reassign usable OBs
-        oblist = usable
+        # reassign usable OBs; they are removed from the pool as they
+        # are scheduled or rejected
+        oblist = qsim.OBPool(usable)
 
         done = False
         while not done:
@@ -215,23 +380,15 @@ class Scheduler(Callback.Callbacks):
 
             # evaluate this slot against the available OBs
             # with knowledge of the previous slot
-            self.logger.debug("considering slot %s" % (slot))
-            good, bad = self.eval_slot(prev_slot, slot, site, oblist)
-
-            # remove OBs that can't work in the slot and explain why
-            for res in bad:
-                ob = res.ob
-                ob_id = self._ob_code(ob)
-                self.logger.debug("rejected %s (%s) because: %s" % (
-                    ob, ob_id, res.reason))
-                cantuse.append(ob)
-                oblist.remove(ob)
+            if debug:
+                self.logger.debug("considering slot %s" % (slot))
+            good, bad = self.eval_slot(prev_slot, slot, site, oblist,
+                                       night=night)
 
             # insert top slot/ob into the schedule
             found_one = False
             for idx, res in enumerate(good):
                 ob = res.ob
-                ob_id = self._ob_code(ob)
                 # check whether this proposal has exceeded its allotted time
                 # if we schedule this OB
                 # NOTE: charge them for any delay time, filter exch time, etc?
@@ -241,8 +398,8 @@ class Scheduler(Callback.Callbacks):
                 acct_time = ob.acct_time
                 prop_total = props[str(ob.program)].sched_time + acct_time
                 if prop_total > props[str(ob.program)].total_time:
-                    self.logger.debug("rejected %s (%s) because it would exceed program allotted time" % (
-                        ob, ob_id))
+                    self._reject(ob, qsim.Reason(qsim.R_PROGRAM_TIME),
+                                 rejections, debug)
                     cantuse.append(ob)
                     oblist.remove(ob)
                     continue
@@ -250,10 +407,18 @@ class Scheduler(Callback.Callbacks):
                 found_one = True
                 break
 
+            # remove OBs that can't work in the slot and explain why
+            # (only those that had to be evaluated to find the top one)
+            for bad_res in bad:
+                self._reject(bad_res.ob, bad_res.reason, rejections, debug)
+                cantuse.append(bad_res.ob)
+                oblist.remove(bad_res.ob)
+
             # no OBs fit the slot?
             if not found_one:
-                self.logger.debug("can't find any OBs to fit slot %s" % (
-                    slot))
+                if debug:
+                    self.logger.debug("can't find any OBs to fit slot %s" % (
+                        slot))
                 # insert empty time
                 schedule.insert_slot(slot)
                 continue
@@ -262,38 +427,42 @@ class Scheduler(Callback.Callbacks):
             props[str(ob.program)].sched_time += acct_time
             dur = ob.total_time / 60.0
 
+            # the OB and the derived OBs that serve it are inserted
+            # into the schedule together
+            bundle = []
+
             # a derived ob to setup the overall OB
             ob_change_sec = 1.0
-            _xx, s_slot, slot = slot.split(slot.start_time, ob_change_sec)
-            new_ob = qsim.setup_ob(ob, ob_change_sec)
+            _xx, s_slot, slot = slot.split(slot.start_epoch, ob_change_sec)
+            new_ob = qsim.DerivedOB(qsim.D_SETUP, ob, ob_change_sec)
             s_slot.set_ob(new_ob)
-            schedule.insert_slot(s_slot)
+            bundle.append(s_slot)
 
             # if a filter change is required, insert a separate OB for that
             if res.filterchange:
-                _xx, f_slot, slot = slot.split(slot.start_time,
+                _xx, f_slot, slot = slot.split(slot.start_epoch,
                                                res.filterchange_sec)
-                new_ob = qsim.filterchange_ob(ob, res.filterchange_sec)
+                new_ob = qsim.DerivedOB(qsim.D_FILTERCHANGE, ob, res.filterchange_sec)
                 f_slot.set_ob(new_ob)
-                schedule.insert_slot(f_slot)
+                bundle.append(f_slot)
 
             # if a delay is required, insert a separate OB for that
             if res.delay_sec > 0.0:
-                _xx, d_slot, slot = slot.split(slot.start_time,
+                _xx, d_slot, slot = slot.split(slot.start_epoch,
                                                res.delay_sec)
-                new_ob = qsim.delay_ob(ob, res.delay_sec)
+                new_ob = qsim.DerivedOB(qsim.D_DELAY, ob, res.delay_sec)
                 d_slot.set_ob(new_ob)
-                schedule.insert_slot(d_slot)
+                bundle.append(d_slot)
 
             # is there a calibration target?
             if ob.calib_tgtcfg is not None:
                 # TODO: add overhead?
                 time_add_sec = res.calibration_sec + res.slew_sec
-                _xx, c_slot, slot = slot.split(slot.start_time,
+                _xx, c_slot, slot = slot.split(slot.start_epoch,
                                                time_add_sec)
-                new_ob = qsim.calibration_ob(ob, time_add_sec)
+                new_ob = qsim.DerivedOB(qsim.D_CALIBRATION, ob, time_add_sec)
                 c_slot.set_ob(new_ob)
-                schedule.insert_slot(c_slot)
+                bundle.append(c_slot)
 
                 slew_sec = res.slew2_sec
 
@@ -304,11 +473,13 @@ class Scheduler(Callback.Callbacks):
                 obj2 = (tgt_cal.ra, tgt_cal.dec, tgt_cal.equinox)
                 if obj2 != obj1:
                     time_add_sec = 30.0 + slew_sec
-                    _xx, c_slot, slot = slot.split(slot.start_time,
+                    _xx, c_slot, slot = slot.split(slot.start_epoch,
                                                    time_add_sec)
-                    new_ob = qsim.calibration30_ob(ob, time_add_sec)
+                    inscfg = qsim.calibration30_inscfg(ob, night=night)
+                    new_ob = qsim.DerivedOB(qsim.D_CALIBRATION30, ob,
+                                            time_add_sec, inscfg=inscfg)
                     c_slot.set_ob(new_ob)
-                    schedule.insert_slot(c_slot)
+                    bundle.append(c_slot)
 
                     # we're already at the target
                     slew_sec = 0.0
@@ -319,32 +490,39 @@ class Scheduler(Callback.Callbacks):
             ## self.logger.debug("slew time for selected object is %.1f sec (deltas: %f, %f)" % (
             ##     res.slew_sec, res.delta_az, res.delta_alt))
             ## if res.slew_sec > slew_breakout_limit:
-            ##     _xx, s_slot, slot = slot.split(slot.start_time,
+            ##     _xx, s_slot, slot = slot.split(slot.start_epoch,
             ##                                    res.slew_sec)
             ##     new_ob = qsim.longslew_ob(res.prev_ob, ob, res.slew_sec)
             ##     s_slot.set_ob(new_ob)
             ##     schedule.insert_slot(s_slot)
 
             # this is the actual science target ob
-            self.logger.debug("assigning %s(%.2fm) to %s" % (
-                self._ob_code(ob), dur, slot))
-            _xx, a_slot, slot = slot.split(slot.start_time, ob.total_time)
+            if debug:
+                self.logger.debug("assigning %s(%.2fm) to %s" % (
+                    self._ob_code(ob), dur, slot))
+            _xx, a_slot, slot = slot.split(slot.start_epoch, ob.total_time)
             a_slot.set_ob(ob)
-            schedule.insert_slot(a_slot)
+            bundle.append(a_slot)
 
             # a derived ob to shutdown the overall OB
             ob_stop_sec = 1.0
-            _xx, q_slot, slot = slot.split(slot.start_time, ob_stop_sec)
-            new_ob = qsim.teardown_ob(ob, ob_stop_sec)
+            _xx, q_slot, slot = slot.split(slot.start_epoch, ob_stop_sec)
+            new_ob = qsim.DerivedOB(qsim.D_TEARDOWN, ob, ob_stop_sec)
             q_slot.set_ob(new_ob)
-            schedule.insert_slot(q_slot)
+            if res.az_wrap is not None:
+                # where the cable wrap is left for the next OB
+                q_slot.az_wrap = qsim.calc_tracked_az_wrap(
+                    site, ob.target, res.az_wrap, res.stop_epoch,
+                    night=night)
+            bundle.append(q_slot)
+
+            schedule.insert_bundle(bundle)
 
             # finally, remove this OB from the list
             oblist.remove(ob)
 
         # return list of unused OBs
-        oblist.extend(cantuse)
-        return oblist
+        return list(oblist) + cantuse
 
 
     def schedule_all(self):
@@ -379,27 +557,53 @@ class Scheduler(Callback.Callbacks):
             night_slots.append(entity.Slot(night_start, delta,
                                            data=rec.data))
 
+        # the visibility windows of the targets on each night are solved
+        # by the checks below, and kept to be reused when the night is
+        # filled
+        vis = [site.get_visibility_index(slot.start_time, slot.stop_time)
+               for slot in night_slots]
+
         # check whether there are some OBs that cannot be scheduled
         self.logger.info("checking for unschedulable OBs on these nights from %d OBs" % (len(self.oblist)))
-        obmap = qsim.obs_to_slots(self.logger, night_slots, site,
-                                  self.oblist)
-
-        self.logger.debug('OB MAP')
-        for key in obmap:
-            self.logger.debug("-- %s --" % key)
-            self.logger.debug(str(obmap[key]))
-            self.logger.debug("--------")
-
-        schedulable = set([])
-        for obs in obmap.values():
-            schedulable = schedulable.union(set(obs))
-        unschedulable = set(self.oblist) - schedulable
-        unschedulable = list(unschedulable)
+        matrix, reasons = qsim.check_feasibility(site, night_slots,
+                                                 self.oblist, kind='slot',
+                                                 num_procs=self.num_procs,
+                                                 vis=vis)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('OB MAP')
+            for i, slot in enumerate(night_slots):
+                self.logger.debug("-- %s --" % slot)
+                self.logger.debug(str([ob for ob, ok in zip(self.oblist,
+                                                             matrix[i])
+                                       if ok]))
+                self.logger.debug("--------")
+
+        schedulable = matrix.any(axis=0)
+        oblist = [ob for ob, ok in zip(self.oblist, schedulable) if ok]
+        # OB -> reasons why it cannot be scheduled on any night
+        unschedulable = [(ob, [night_reasons[j]
+                               for night_reasons in reasons
+                               if j in night_reasons])
+                         for j, ob in enumerate(self.oblist)
+                         if not schedulable[j]]
         self.logger.info("there are %d unschedulable OBs" % (len(unschedulable)))
 
         self.logger.info("preparing to schedule")
-        oblist = list(schedulable)
         self.schedules = []
+        self.rejection_counts = []
+
+        visible = [None] * len(schedules)
+        if self.num_procs > 1:
+            # check visibility of OBs on all nights up front, in parallel
+            matrix, reasons = qsim.check_feasibility(site, night_slots,
+                                                     oblist,
+                                                     kind='visibility',
+                                                     num_procs=self.num_procs)
+            for i in range(len(schedules)):
+                visible[i] = dict((ob, None if matrix[i, j] else
+                                   reasons[i][j])
+                                  for j, ob in enumerate(oblist))
 
         # build a lookup table of programs -> OBs
         props = {}
@@ -419,8 +623,6 @@ class Scheduler(Callback.Callbacks):
         total_ob_time = 0
         for ob in self.oblist:
             pgmname = str(ob.program)
-            ob_key = (pgmname, ob.name)
-            props[pgmname].obs.append(ob_key)
             props[pgmname].obcount += 1
             # New policy is not to charge any overhead to the client,
             # including readout time
@@ -428,7 +630,11 @@ class Scheduler(Callback.Callbacks):
             obtime_no_overhead = ob.acct_time
             total_ob_time += obtime_no_overhead
 
-        unscheduled_obs = list(oblist)
+        # OBs of each program that are still to be scheduled
+        remaining = qsim.OBPool(self.oblist)
+        # sort to force deterministic scheduling if the same
+        # files are reloaded; the pool keeps this order
+        unscheduled_obs = qsim.OBPool(sorted(oblist, key=str))
         total_avail = 0.0
         total_waste = 0.0
 
@@ -446,7 +652,7 @@ class Scheduler(Callback.Callbacks):
         self.logger.info("scheduling %d OBs (from %d programs) for %d nights" % (
             len(unscheduled_obs), len(self.programs), len(schedules)))
 
-        for schedule in schedules:
+        for i, schedule in enumerate(schedules):
 
             start_time = schedule.start_time
             stop_time  = schedule.stop_time
@@ -462,13 +668,22 @@ class Scheduler(Callback.Callbacks):
 
             self.logger.info("scheduling night %s" % (ndate))
 
-            ## this_nights_obs = unscheduled_obs
-            # sort to force deterministic scheduling if the same
-            # files are reloaded
-            this_nights_obs = sorted(unscheduled_obs, key=str)
-
             # optomize and rank schedules
-            self.fill_night_schedule(schedule, site, this_nights_obs, props)
+            # the rest of the night's tables are only built now, and
+            # are not kept once the night is scheduled
+            night = qsim.prepare_night(site, start_time, stop_time,
+                                       vis=vis[i])
+            vis[i] = None
+
+            rejections = Counter()
+            self.fill_night_schedule(schedule, site, unscheduled_obs, props,
+                                     visible=visible[i],
+                                     rejections=rejections,
+                                     night=night)
+            night = None
+            self.rejection_counts.append(rejections)
+            self.logger.info("rejections: %s" % (
+                self._format_rejections(rejections)))
 
             res = qsim.eval_schedule(schedule)
 
@@ -488,8 +703,7 @@ class Scheduler(Callback.Callbacks):
                         targets[key] = ob.target
                         if self.remove_scheduled_obs:
                             unscheduled_obs.remove(ob)
-                        ob_key = (str(ob.program), ob.name)
-                        props[str(ob.program)].obs.remove(ob_key)
+                        remaining.discard(ob)
 
             waste = res.time_waste_sec / 60.0
             total_waste += waste
@@ -516,13 +730,28 @@ class Scheduler(Callback.Callbacks):
             ## unschedulable.sort(cmp=lambda ob1, ob2: cmp(ob1.program.proposal,
             ##                                             ob2.program.proposal))
 
-            for ob in unschedulable:
-                out_f.write("%s (%s)\n" % (ob.name, ob.program.proposal))
+            for ob, ob_reasons in unschedulable:
+                # list each distinct reason once
+                messages = []
+                for reason in ob_reasons:
+                    message = str(reason)
+                    if message not in messages:
+                        messages.append(message)
+                out_f.write("%s (%s): %s\n" % (
+                    ob.name, ob.program.proposal, '; '.join(messages)))
             out_f.write("\n")
 
+        total_rejections = Counter()
+        for rejections in self.rejection_counts:
+            total_rejections.update(rejections)
+        out_f.write("Rejections: %s\n" % (
+            self._format_rejections(total_rejections)))
+        out_f.write("\n")
+
         completed, uncompleted = [], []
         for key in self.programs:
             bnch = props[key]
+            bnch.obs = [(key, ob.name) for ob in remaining.get_program(key)]
             if bnch.sched_time >= bnch.total_time:
                 completed.append(bnch)
             else:
@@ -568,6 +797,14 @@ class Scheduler(Callback.Callbacks):
         self.logger.info(self.summary_report)
 
 
+    def _format_rejections(self, rejections):
+        # render a Counter of reason codes, most common first
+        counts = Counter()
+        for code, count in rejections.items():
+            counts[qsim.reason_defs[code][0]] += count
+        return ', '.join(["%s=%d" % (name, count)
+                          for name, count in counts.most_common()])
+
     def select_schedule(self, schedule):
         self.selected_schedule = schedule
         self.make_callback('schedule-selected', schedule)
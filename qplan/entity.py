@@ -5,6 +5,7 @@
 #
 from datetime import timedelta, datetime
 import math
+import bisect
 import dateutil.parser
 import pytz
 
@@ -36,7 +37,8 @@ except ImportError:
 from ginga.misc import Bunch
 
 # local imports
-from qplan.util.calcpos import Body, Observer
+from qplan.util.calcpos import Body, Observer, get_body
+from qplan.util.calcpos import datetime_to_epoch, epoch_to_datetime
 
 
 class Program(PersistentEntity):
@@ -81,14 +83,45 @@ class Slot(object):
     """
     Slot -- a period of the night that can be scheduled.
     Defined by a start time and a duration in seconds.
+
+    The start time can be a (timezone-aware) datetime, or seconds since
+    the epoch with the timezone given in `tz`.  Internally the slot
+    works with seconds since the epoch (`start_epoch`, `stop_epoch`);
+    `start_time` and `stop_time` are the corresponding datetimes (in
+    the timezone of the slot), made when they are first asked for.
     """
 
-    def __init__(self, start_time, slot_len_sec, data=None):
+    def __init__(self, start_time, slot_len_sec, data=None, tz=None):
         super(Slot, self).__init__()
-        self.start_time = start_time
-        self.stop_time = start_time + timedelta(0, slot_len_sec)
+        if isinstance(start_time, datetime):
+            self.start_epoch = datetime_to_epoch(start_time)
+            tz = start_time.tzinfo
+            self._start_time = start_time
+        else:
+            self.start_epoch = start_time
+            self._start_time = None
+        if tz is None:
+            tz = pytz.utc
+        self.tz = tz
+        self.stop_epoch = self.start_epoch + slot_len_sec
+        self._stop_time = None
         self.data = data
         self.ob = None
+        # telescope azimuth (deg) within its cable wrap range, if known:
+        # a tuple (seconds since the epoch, azimuth)
+        self.az_wrap = None
+
+    @property
+    def start_time(self):
+        if self._start_time is None:
+            self._start_time = epoch_to_datetime(self.start_epoch, self.tz)
+        return self._start_time
+
+    @property
+    def stop_time(self):
+        if self._stop_time is None:
+            self._stop_time = epoch_to_datetime(self.stop_epoch, self.tz)
+        return self._stop_time
 
     def set_ob(self, ob):
         self.ob = ob
@@ -98,7 +131,8 @@ class Slot(object):
         Split a slot into three slots.
         Parameters
         ----------
-          start_time : a datetime compatible datetime object
+          start_time : a datetime compatible datetime object, or seconds
+              since the epoch
               The time at which to split the slot
           slot_len_sec : int
               The length of the slot being inserted
@@ -109,37 +143,40 @@ class Slot(object):
           Depending on the overlap, there will be 1, 2 or 3 slots in the
           return list.
         """
-        if start_time < self.start_time:
-            diff = (start_time - self.start_time).total_seconds()
+        if isinstance(start_time, datetime):
+            start_time = datetime_to_epoch(start_time)
+
+        if start_time < self.start_epoch:
+            diff = start_time - self.start_epoch
             if math.fabs(diff) < 5.0:
-                start_time = self.start_time
+                start_time = self.start_epoch
             else:
                 raise SlotError("Start time (%s) < slot start time (%s) diff=%f" % (
-                    start_time, self.start_time, diff))
+                    epoch_to_datetime(start_time, self.tz), self.start_time,
+                    diff))
 
-        stop_time = start_time + timedelta(0, slot_len_sec)
-        if stop_time > self.stop_time:
+        stop_time = start_time + slot_len_sec
+        if stop_time > self.stop_epoch:
             raise SlotError("Stop time (%s) > slot stop time (%s)" % (
-                stop_time, self.stop_time))
+                epoch_to_datetime(stop_time, self.tz), self.stop_time))
 
         # define before slot
         slot_b = None
-        diff = (start_time - self.start_time).total_seconds()
+        diff_sec = start_time - self.start_epoch
         # Don't create a slot for less than a minute in length
-        if diff > 1.0:
-            diff_sec = (start_time - self.start_time).total_seconds()
-            slot_b = Slot(self.start_time, diff_sec, data=self.data)
+        if diff_sec > 1.0:
+            slot_b = Slot(self.start_epoch, diff_sec, data=self.data,
+                          tz=self.tz)
 
         # define new displacing slot
-        slot_c = Slot(start_time, slot_len_sec, data=self.data)
+        slot_c = Slot(start_time, slot_len_sec, data=self.data, tz=self.tz)
 
         # define after slot
         slot_d = None
-        diff = (self.stop_time - stop_time).total_seconds()
+        diff_sec = self.stop_epoch - stop_time
         # Don't create a slot for less than a minute in length
-        if diff > 1.0:
-            diff_sec = (self.stop_time - stop_time).total_seconds()
-            slot_d = Slot(stop_time, diff_sec, data=self.data)
+        if diff_sec > 1.0:
+            slot_d = Slot(stop_time, diff_sec, data=self.data, tz=self.tz)
 
         return (slot_b, slot_c, slot_d)
 
@@ -147,8 +184,7 @@ class Slot(object):
         """
         Returns the length of the slot in seconds.
         """
-        diff_sec = (self.stop_time - self.start_time).total_seconds()
-        return diff_sec
+        return self.stop_epoch - self.start_epoch
 
     def __repr__(self):
         #s = self.start_time.strftime("%H:%M:%S")
@@ -159,87 +195,183 @@ class Slot(object):
     __str__ = __repr__
 
 
+class _SlotChunk(object):
+    """
+    A run of consecutive slots of a Schedule, with their start times.
+    Chunks are shared between snapshots of a schedule; a chunk may only
+    be modified by the schedule whose token is its `owner`.
+    """
+    __slots__ = ('owner', 'starts', 'slots')
+
+    def __init__(self, owner, starts, slots):
+        self.owner = owner
+        self.starts = starts
+        self.slots = slots
+
+
 class Schedule(object):
     """
     Schedule
     Defines a series of slots and operations on that series.
 
+    The slots are kept in order of their start times, in chunks with an
+    index of the start times, so that the slots around a given time are
+    found by bisection.  Like Slot, it works with seconds since the
+    epoch internally.
+
+    copy() takes a snapshot in constant time: the snapshot and the
+    original share their chunks, and each copies only the chunks it
+    modifies afterwards (copy-on-write).
     """
+    # chunks are split when they grow beyond twice this many slots
+    chunk_size = 32
+
     def __init__(self, start_time, stop_time, data=None):
         super(Schedule, self).__init__()
         self.start_time = start_time
         self.stop_time = stop_time
+        self.start_epoch = datetime_to_epoch(start_time)
+        self.stop_epoch = datetime_to_epoch(stop_time)
+        self.tz = start_time.tzinfo
         self.data = data
 
-        diff = (self.stop_time - self.start_time).total_seconds()
+        diff = self.stop_epoch - self.start_epoch
         self.waste = diff
-        self.slots = []
+        # chunks of slots, and the start time of the first slot of each
+        self._chunks = []
+        self._heads = []
+        self._num_slots = 0
+        # chunks (and the lists above) owned by this schedule carry
+        # this token
+        self._token = object()
+        self._owner = self._token
+
+    @property
+    def slots(self):
+        """The list of slots, in order."""
+        slots = []
+        for chunk in self._chunks:
+            slots.extend(chunk.slots)
+        return slots
 
     def num_slots(self):
-        return len(self.slots)
+        return self._num_slots
+
+    def _last(self):
+        if len(self._chunks) == 0:
+            return None
+        return self._chunks[-1].slots[-1]
 
     def get_free(self):
-        if len(self.slots) == 0:
+        last = self._last()
+        if last is None:
             return self.start_time, self.stop_time
 
-        last = self.slots[-1]
         return last.stop_time, self.stop_time
 
     def next_free_slot(self):
-        start_time, stop_time = self.get_free()
-        diff = (stop_time - start_time).total_seconds()
+        last = self._last()
+        if last is None:
+            start_epoch = self.start_epoch
+        else:
+            start_epoch = last.stop_epoch
+        diff = self.stop_epoch - start_epoch
         if diff <= 0.0:
             return None
-        return Slot(start_time, diff)
-
-    def _previous(self, slot):
-        if len(self.slots) == 0:
-            return -1, None
-
-        # TODO: in the typical insertion case, would the search
-        # be faster from the rear?
-        for i in range(len(self.slots)):
-            slot_i = self.slots[i]
-            if slot_i.start_time > slot.start_time:
-                if i == 0:
-                    return -1, None
-                return i-1, self.slots[i-1]
+        return Slot(start_epoch, diff, tz=self.tz)
 
-        return i, slot_i
+    def _find(self, slot):
+        # returns (k, j): the position in chunk k just after the last
+        # slot starting at or before `slot`; k is -1 if there is none
+        t = slot.start_epoch
+        k = bisect.bisect_right(self._heads, t) - 1
+        if k < 0:
+            return -1, 0
+        return k, bisect.bisect_right(self._chunks[k].starts, t)
 
     def get_previous(self, slot):
-        i, slot_i = self._previous(slot)
-        return slot_i
-
-    def _next(self, slot):
-        for i in range(len(self.slots)):
-            slot_i = self.slots[i]
-            if slot_i.start_time > slot.start_time:
-                return i, slot_i
-
-        return len(self.slots), None
+        k, j = self._find(slot)
+        if k < 0:
+            return None
+        return self._chunks[k].slots[j-1]
 
     def get_next(self, slot):
-        i, slot_i = self._next(slot)
-        return slot_i
+        k, j = self._find(slot)
+        if (k >= 0) and (j < len(self._chunks[k].slots)):
+            return self._chunks[k].slots[j]
+        if k+1 < len(self._chunks):
+            return self._chunks[k+1].slots[0]
+        return None
+
+    def _get_chunk(self, k):
+        # returns chunk k for modification, copying what is shared
+        if self._owner is not self._token:
+            self._chunks = list(self._chunks)
+            self._heads = list(self._heads)
+            self._owner = self._token
+        chunk = self._chunks[k]
+        if chunk.owner is not self._token:
+            chunk = _SlotChunk(self._token, list(chunk.starts),
+                               list(chunk.slots))
+            self._chunks[k] = chunk
+        return chunk
 
     def insert_slot(self, slot):
-        i, prev_slot = self._previous(slot)
-        if prev_slot != None:
-            interval = (slot.start_time - prev_slot.stop_time).total_seconds()
-            assert interval >= 0, \
-                   ValueError("Slot overlaps end of previous slot by %d sec" % (
-                -interval))
-
-        if i+1 < self.num_slots():
-            next_slot = self.slots[i]
-            interval = (next_slot.start_time - slot.stop_time).total_seconds()
-            ## assert interval >= 0, \
-            ##     ValueError("Slot overlaps start of next slot by %d sec" % (
-            ##     -interval))
-
-        self.slots.insert(i+1, slot)
-        self.waste -= slot.size()
+        self.insert_bundle([slot])
+
+    def insert_bundle(self, slots):
+        """
+        Insert a sequence of consecutive slots (e.g. an OB and the
+        derived OBs that serve it) at once.  The slots must be in order
+        of their start times and must not overlap each other or the end
+        of the slot preceding them.
+        """
+        if len(slots) == 0:
+            return
+        prev_slot = self.get_previous(slots[0])
+        for slot in slots:
+            if prev_slot != None:
+                interval = slot.start_epoch - prev_slot.stop_epoch
+                assert interval >= 0, \
+                       ValueError("Slot overlaps end of previous slot by %d sec" % (
+                    -interval))
+            prev_slot = slot
+
+        ## next_slot = self.get_next(slots[0])
+        ## if next_slot != None:
+        ##     interval = next_slot.start_epoch - prev_slot.stop_epoch
+        ##     assert interval >= 0, \
+        ##         ValueError("Slot overlaps start of next slot by %d sec" % (
+        ##         -interval))
+
+        starts = [slot.start_epoch for slot in slots]
+        if len(self._chunks) == 0:
+            if self._owner is not self._token:
+                self._chunks, self._heads = [], []
+                self._owner = self._token
+            self._chunks.append(_SlotChunk(self._token, starts, list(slots)))
+            self._heads.append(starts[0])
+        else:
+            k, j = self._find(slots[0])
+            if k < 0:
+                k = 0
+            chunk = self._get_chunk(k)
+            chunk.starts[j:j] = starts
+            chunk.slots[j:j] = slots
+            self._heads[k] = chunk.starts[0]
+            if len(chunk.slots) > 2 * self.chunk_size:
+                # split the chunk in two
+                n = len(chunk.slots) // 2
+                chunk2 = _SlotChunk(self._token, chunk.starts[n:],
+                                    chunk.slots[n:])
+                del chunk.starts[n:]
+                del chunk.slots[n:]
+                self._chunks.insert(k+1, chunk2)
+                self._heads.insert(k+1, chunk2.starts[0])
+
+        self._num_slots += len(slots)
+        for slot in slots:
+            self.waste -= slot.size()
 
     ## def append_slot(self, slot):
     ##     start_time, stop_time = self.get_free()
@@ -253,10 +385,19 @@ class Schedule(object):
     ##     self.waste -= slot.size()
 
     def copy(self):
-        newsch = Schedule(self.start_time, self.stop_time)
+        """
+        Returns a snapshot of this schedule.  This takes constant time:
+        the slots are shared until either schedule is modified.
+        """
+        newsch = Schedule(self.start_time, self.stop_time, data=self.data)
         newsch.waste = self.waste
-        newsch.data  = self.data
-        newsch.slots = list(self.slots)
+        newsch._chunks = self._chunks
+        newsch._heads = self._heads
+        newsch._num_slots = self._num_slots
+        # neither schedule owns the shared chunks anymore
+        self._token = object()
+        newsch._owner = None
+        return newsch
 
     def get_waste(self):
         ## start_time, stop_time = self.get_free()
@@ -358,11 +499,24 @@ class StaticTarget(BaseTarget):
         self.equinox = equinox
         self.comment = comment
 
-        if self.ra is not None:
-            self._recalc_body()
+        # built on first use
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None and self.ra is not None:
+            # shared with all targets at the same position
+            self._body = get_body(self.name, self.ra, self.dec,
+                                  self.equinox)
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
 
     def _recalc_body(self):
-        self.body = Body(self.name, self.ra, self.dec, self.equinox)
+        # position changed--body is looked up again on next use
+        self._body = None
 
     def import_record(self, rec):
         code = rec.code.strip()
@@ -391,12 +545,14 @@ class StaticTarget(BaseTarget):
     def __getstate__(self):
         d = self.__dict__.copy()
         # calcpos objects can't be pickled
-        d['body'] = None
+        d['_body'] = None
         return d
 
     def __setstate__(self, state):
+        # older pickles stored the body under this name
+        state.pop('body', None)
         self.__dict__.update(state)
-        self._recalc_body()
+        self._body = None
 
 
 class HSCTarget(StaticTarget):
@@ -691,7 +847,16 @@ def parse_date_time(dt_str, default_timezone):
         dt = None
     return dt
 
+# (ra_str, dec_str) -> normalized (ra, dec)
+_radec_cache = {}
+
 def normalize_radec_str(ra_str, dec_str):
+    key = (ra_str, dec_str)
+    try:
+        return _radec_cache[key]
+    except KeyError:
+        pass
+
     if ra_str is None or ra_str == '':
         ra = ra_str
     else:
@@ -700,6 +865,8 @@ def normalize_radec_str(ra_str, dec_str):
         dec = dec_str
     else:
         dec = wcs.decDegToString(wcs.dmsStrToDeg(dec_str))
+
+    _radec_cache[key] = (ra, dec)
     return (ra, dec)
 
 #END
@@ -6,6 +6,8 @@
 from datetime import timedelta
 import math
 
+import numpy as np
+
 # gen2 imports
 #from astro import radec
 
@@ -42,9 +44,10 @@ def make_slots(start_time, night_length_mn, min_slot_length_sc):
 
 def calc_slew_time(d_az, d_el, rate_az=0.5, rate_el=0.5):
     """Calculate slew time given a delta in azimuth aand elevation.
+    Works on scalars or arrays of deltas.
     """
-    time_sec = max(math.fabs(d_el) / rate_el,
-                   math.fabs(d_az) / rate_az)
+    time_sec = np.maximum(np.fabs(d_el) / rate_el,
+                          np.fabs(d_az) / rate_az)
     return time_sec
 
 
@@ -68,14 +68,14 @@ class AirMassPlot(plots.Plot):
 
         #lstyle = 'o'
         lstyle = '-'
-        lt_data = [info.ut.astimezone(tz) for info in tgt_data[0].history]
+        lt_data = [ut.astimezone(tz) for ut in tgt_data[0].history.ut]
         # sanity check on dates in preferred timezone
         ## for dt in lt_data[:10]:
         ##     print(dt.strftime("%Y-%m-%d %H:%M:%S"))
 
         # plot targets airmass vs. time
         for i, info in enumerate(tgt_data):
-            am_data = numpy.array([t.airmass for t in info.history])
+            am_data = info.history.airmass
             am_min = numpy.argmin(am_data)
             am_data_dots = am_data
             color = self.colors[i % len(self.colors)]
@@ -117,7 +117,7 @@ class AirMassPlot(plots.Plot):
 
         # Plot moon altitude and degree scale
         ax2 = ax1.twinx()
-        moon_data = numpy.array([t.moon_alt for t in tgt_data[0].history])
+        moon_data = tgt_data[0].history.moon_alt
         #moon_illum = site.moon_phase()
         ax2.plot_date(lt_data, moon_data, '#666666', linewidth=2.0,
                       alpha=0.5, aa=True, tz=tz)
@@ -165,14 +165,14 @@ class AirMassPlot(plots.Plot):
 
         #lstyle = 'o'
         lstyle = '-'
-        lt_data = [t.ut.astimezone(tz) for t in tgt_data[0].history]
+        lt_data = [ut.astimezone(tz) for ut in tgt_data[0].history.ut]
         # sanity check on dates in preferred timezone
         ## for dt in lt_data[:10]:
         ##     print(dt.strftime("%Y-%m-%d %H:%M:%S"))
 
         # plot targets elevation vs. time
         for i, info in enumerate(tgt_data):
-            alt_data = numpy.array([t.alt_deg for t in info.history])
+            alt_data = info.history.alt_deg
             alt_min = numpy.argmin(alt_data)
             alt_data_dots = alt_data
             color = self.colors[i % len(self.colors)]
@@ -205,7 +205,7 @@ class AirMassPlot(plots.Plot):
         ax1.set_ylabel('Altitude')
 
         # Plot moon trajectory and illumination
-        moon_data = numpy.array([t.moon_alt for t in tgt_data[0].history])
+        moon_data = tgt_data[0].history.moon_alt
         illum_time = lt_data[moon_data.argmax()]
         moon_illum = site.moon_phase(date=illum_time)
         moon_color = '#666666'
@@ -349,9 +349,9 @@ if __name__ == '__main__':
     lengths = []
     if num_tgts > 0:
         for tgt in targets:
-            info_list = site.get_target_info(tgt)
-            target_data.append(Bunch.Bunch(history=info_list, target=tgt))
-            lengths.append(len(info_list))
+            track = site.get_target_info(tgt)
+            target_data.append(Bunch.Bunch(history=track, target=tgt))
+            lengths.append(len(track))
 
     # clip all arrays to same length
     min_len = min(*lengths)
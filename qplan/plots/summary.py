@@ -74,11 +74,12 @@ class NightSumPlot(BaseSumPlot):
                     ob_type = 'Unscheduled'
                 else:
                     if ob.derived:
-                        if 'Long slew' in ob.comment:
+                        kind = qsim.derived_kind(ob)
+                        if kind == qsim.D_LONGSLEW:
                             ob_type = 'Long slew'
-                        elif 'Filter change' in ob.comment:
+                        elif kind == qsim.D_FILTERCHANGE:
                             ob_type = 'Filter change'
-                        elif 'Delay' in ob.comment:
+                        elif kind == qsim.D_DELAY:
                             ob_type = 'Delay'
                         else:
                             ob_type = 'Science'
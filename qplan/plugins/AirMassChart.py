@@ -108,9 +108,9 @@ class AirMassChart(PlBase.Plugin):
             for tgt in targets:
                 ## info_list = site.get_target_info(tgt,
                 ##                                  start_time=start_time)
-                info_list = site.get_target_info(tgt)
-                target_data.append(Bunch.Bunch(history=info_list, target=tgt))
-                lengths.append(len(info_list))
+                track = site.get_target_info(tgt)
+                target_data.append(Bunch.Bunch(history=track, target=tgt))
+                lengths.append(len(track))
 
         # clip all arrays to same length
         min_len = 0
@@ -6,6 +6,7 @@
 import time
 
 from ..q2ope import BaseConverter
+from .. import qsim
 
 # the set of OPE friendly characters--for mangling target names
 ope_friendly_chars = []
@@ -215,20 +216,21 @@ QUEUE_MODE $DEF_CMNTOOL OBSERVER=
 
         # special cases: filter change, long slew, calibrations, etc.
         if ob.derived:
-            if ob.comment.startswith('Setup OB'):
+            kind = qsim.derived_kind(ob)
+            if kind == qsim.D_SETUP:
                 self.out_setup_ob(ob, out_f)
                 return
 
-            elif ob.comment.startswith('Teardown for'):
+            elif kind == qsim.D_TEARDOWN:
                 self.out_teardown_ob(ob, out_f)
                 return
 
-            elif ob.comment.startswith('Filter change'):
+            elif kind == qsim.D_FILTERCHANGE:
                 self.out_filterchange(ob, out_f)
                 self.out_focusobe(ob, out_f)
                 return
 
-            elif ob.comment.startswith('Long slew'):
+            elif kind == qsim.D_LONGSLEW:
                 out("\n# %s" % (ob.comment))
                 d = {}
                 self._setup_target(d, ob)
@@ -236,20 +238,20 @@ QUEUE_MODE $DEF_CMNTOOL OBSERVER=
                 out(cmd_str)
                 return
 
-            elif ob.comment.startswith('Delay for'):
+            elif kind == qsim.D_DELAY:
                 out("\n# %s" % (ob.comment))
                 d = dict(sleep_time=int(ob.total_time))
                 cmd_str = '''EXEC OBS TIMER SLEEP_TIME=%(sleep_time)d''' % d
                 out(cmd_str)
                 return
 
-            elif ob.comment.startswith('Calibration for'):
+            elif kind == qsim.D_CALIBRATION:
                 # this should eventually be 'GetStandard'
                 #self.out_exp_ob(ob, out, gettype='GetStandard')
                 self.out_exp_ob(ob, out, gettype='GetObject')
                 return
 
-            elif ob.comment.startswith('30 sec calib shot'):
+            elif kind == qsim.D_CALIBRATION30:
                 self.out_exp_ob(ob, out, gettype='GetObject')
                 return
 
@@ -3,8 +3,13 @@
 #
 #  Eric Jeschke (eric@naoj.org)
 #
-from datetime import timedelta
+from collections import namedtuple, OrderedDict
 import time
+import bisect
+import logging
+import multiprocessing
+
+import numpy as np
 
 # Gen2 imports
 from ginga.misc import Bunch
@@ -13,6 +18,7 @@ from ginga.misc import Bunch
 from . import misc
 #import constraints
 from . import entity
+from .util import calcpos
 
 
 # maximum rank for a program
@@ -27,12 +33,85 @@ minimum_slot_size = 60.0
 parked_az_deg = 270.0
 parked_alt_deg = 90.0
 
+# azimuth range (deg) of the telescope's cable wrap
+az_wrap_min_deg = -270.0
+az_wrap_max_deg = 270.0
+
 # Subaru defines a dark night as one that is 2-3 days before or
 # after a new moon (0%).  Since a half moon (50%) occurs just 7 days
 # prior to a new moon, we can roughly calculate a dark night as
 # being < 25% illumination
 dark_night_moon_pct_limit = 0.25
 
+# the moon is considered down below this altitude (deg)
+moon_horizon_deg = 0.0   # change as necessary
+
+# reason codes for the results of the checks of OBs
+(R_NONE, R_INSTRUMENT, R_FILTER, R_CATEGORY, R_DOME_SCHEDULE,
+ R_DOME_CLOSED, R_VISIBILITY, R_CALIB_VISIBILITY, R_SEP_CALIB_VISIBILITY,
+ R_MOON_ILLUMINATION, R_MOON_SEPARATION, R_SLOT_DURATION,
+ R_LOWER_TIME_LIMIT, R_UPPER_TIME_LIMIT, R_DOME_SLOT, R_SEEING,
+ R_TRANSPARENCY, R_SLOT_TIME, R_SLOT_TIME_PREP,
+ R_PROGRAM_TIME) = range(20)
+
+# reason code -> (short name, message format)
+reason_defs = {
+    R_NONE: ('none', "No good reason!"),
+    R_INSTRUMENT: ('instrument', "Instrument '%s' not installed"),
+    R_FILTER: ('filter', "Filter '%s' not installed [%s]"),
+    R_CATEGORY: ('category', "Slot cannot take category '%s'"),
+    R_DOME_SCHEDULE: ('dome', "Dome status OB(%s) != schedule(%s)"),
+    R_DOME_CLOSED: ('dome closed', "Dome is closed and this matches OB"),
+    R_VISIBILITY: ('visibility', "Time or visibility of target"),
+    R_CALIB_VISIBILITY: ('calibration visibility',
+                         "Time or visibility of calibration target"),
+    R_SEP_CALIB_VISIBILITY: ('calibration visibility',
+                             "Time or visibility of separate calibration target"),
+    R_MOON_ILLUMINATION: ('moon illumination',
+                          "Moon illumination=%f not acceptable (alt 1=%.2f 2=%.2f"),
+    R_MOON_SEPARATION: ('moon separation',
+                        "Moon-target separation (%f < %f) not acceptable"),
+    R_SLOT_DURATION: ('slot duration',
+                      "Slot duration (%d) too short for OB (%d)"),
+    R_LOWER_TIME_LIMIT: ('time limit',
+                         "Slot end time is before OB lower time limit"),
+    R_UPPER_TIME_LIMIT: ('time limit',
+                         "Slot start time is after OB upper time limit"),
+    R_DOME_SLOT: ('dome', "Dome status OB(%s) != slot(%s)"),
+    R_SEEING: ('seeing', "Seeing (%f > %f) not acceptable"),
+    R_TRANSPARENCY: ('transparency',
+                     "Transparency (%f < %f) not acceptable"),
+    R_SLOT_TIME: ('slot time', "Not enough time in slot"),
+    R_SLOT_TIME_PREP: ('slot time',
+                       "Not enough time in slot after all prep/delay"),
+    R_PROGRAM_TIME: ('program time',
+                     "It would exceed program allotted time"),
+    }
+
+
+class Reason(namedtuple('Reason', ['code', 'args'])):
+    """
+    Reason for the result of a check of an OB: a reason code and the
+    values that go into its message.  The message is only formatted
+    when the reason is converted to a string (e.g. for logging).
+    """
+    __slots__ = ()
+
+    def __new__(cls, code, *args):
+        return super(Reason, cls).__new__(cls, code, args)
+
+    def __getnewargs__(self):
+        return (self.code,) + self.args
+
+    @property
+    def name(self):
+        return reason_defs[self.code][0]
+
+    def __str__(self):
+        return reason_defs[self.code][1] % self.args
+
+no_reason = Reason(R_NONE)
+
 
 def filterchange_ob(ob, total_time):
     new_ob = entity.OB(program=ob.program, target=ob.target,
@@ -67,13 +146,32 @@ def calibration_ob(ob, total_time):
     return new_ob
 
 
+def calibration30_inscfg(ob, night=None):
+    """Returns the instrument configuration of the 30 sec calibration
+    shot for `ob`.  With a `night` (see prepare_night()), it is shared
+    by all OBs with the same filter and position angle on that night.
+    """
+    key = (ob.inscfg.filter, ob.inscfg.pa)
+    if night is not None:
+        try:
+            return night.calibration30_inscfgs[key]
+
+        except KeyError:
+            pass
+
+    inscfg = entity.HSCConfiguration(filter=ob.inscfg.filter,
+                                     guiding=False, num_exp=1,
+                                     exp_time=30,
+                                     mode='IMAGE', dither='1',
+                                     pa=ob.inscfg.pa,
+                                     comment='30 sec calib shot')
+    if night is not None:
+        night.calibration30_inscfgs[key] = inscfg
+    return inscfg
+
+
 def calibration30_ob(ob, total_time):
-    calib_inscfg = entity.HSCConfiguration(filter=ob.inscfg.filter,
-                                           guiding=False, num_exp=1,
-                                           exp_time=30,
-                                           mode='IMAGE', dither='1',
-                                           pa=ob.inscfg.pa,
-                                           comment='30 sec calib shot')
+    calib_inscfg = calibration30_inscfg(ob)
     new_ob = entity.OB(program=ob.program, target=ob.target,
                        telcfg=ob.telcfg, inscfg=calib_inscfg,
                        envcfg=ob.envcfg,
@@ -116,29 +214,558 @@ def teardown_ob(ob, total_time):
     return new_ob
 
 
-def obs_to_slots(logger, slots, site, obs, check_moon=False, check_env=False):
+# kinds of derived OBs (steps generated to serve an OB)
+(D_SETUP, D_FILTERCHANGE, D_LONGSLEW, D_DELAY, D_CALIBRATION,
+ D_CALIBRATION30, D_TEARDOWN) = range(7)
+
+# kind -> (short name, comment prefix)
+derived_defs = {
+    D_SETUP: ('setup', "Setup OB"),
+    D_FILTERCHANGE: ('filterchange', "Filter change for"),
+    D_LONGSLEW: ('longslew', "Long slew for"),
+    D_DELAY: ('delay', "Delay for"),
+    D_CALIBRATION: ('calibration', "Calibration for"),
+    D_CALIBRATION30: ('calibration30', "30 sec calibration for"),
+    D_TEARDOWN: ('teardown', "Teardown for"),
+    }
+
+
+class DerivedOB(object):
+    """
+    Compact record of a derived OB: a step of `kind` (D_SETUP, D_DELAY,
+    etc.) taking `total_time` sec, generated to serve OB `parent`.
+    It stands in for the full OB made by setup_ob(), delay_ob(), etc.:
+    the attributes of that OB are worked out from the parent when they
+    are asked for.  `inscfg`, if given, is the instrument configuration
+    of the step (e.g. a shared one from calibration30_inscfg()).
+    """
+    __slots__ = ('kind', 'parent', 'total_time', '_inscfg')
+
+    derived = True
+    # no time is charged to the program for the step
+    acct_time = 0.0
+    calib_tgtcfg = None
+    calib_inscfg = None
+
+    def __init__(self, kind, parent, total_time, inscfg=None):
+        self.kind = kind
+        self.parent = parent
+        self.total_time = total_time
+        self._inscfg = inscfg
+
+    @property
+    def id(self):
+        return "%s-%s" % (self.parent, derived_defs[self.kind][0])
+
+    name = id
+
+    @property
+    def orig_ob(self):
+        return self.parent
+
+    @property
+    def program(self):
+        return self.parent.program
+
+    @property
+    def priority(self):
+        return self.parent.priority
+
+    @property
+    def target(self):
+        if self.kind == D_CALIBRATION:
+            return self.parent.calib_tgtcfg
+        return self.parent.target
+
+    @property
+    def telcfg(self):
+        return self.parent.telcfg
+
+    @property
+    def envcfg(self):
+        return self.parent.envcfg
+
+    @property
+    def inscfg(self):
+        if self._inscfg is not None:
+            return self._inscfg
+        if self.kind == D_CALIBRATION:
+            return self.parent.calib_inscfg
+        if self.kind == D_CALIBRATION30:
+            return calibration30_inscfg(self.parent)
+        return self.parent.inscfg
+
+    @property
+    def comment(self):
+        return derived_comment(self.kind, self.parent)
+
+    def __repr__(self):
+        return self.id
+
+    __str__ = __repr__
+
+
+def derived_comment(kind, ob):
+    # the comment of the derived OB of `kind` for `ob`
+    if kind == D_SETUP:
+        return "Setup OB: %s %s: %s" % (ob.program.proposal, ob.name,
+                                        ob.comment)
+    if kind == D_DELAY:
+        return "Delay for %s visibility" % (ob)
+    return "%s %s" % (derived_defs[kind][1], ob)
+
+
+def derived_kind(ob):
+    """Returns the kind (D_SETUP, D_DELAY, etc.) of derived OB `ob`,
+    which is a DerivedOB or a full OB made by setup_ob(), delay_ob(),
+    etc., or None if `ob` is not a derived OB of a known kind.
+    """
+    if isinstance(ob, DerivedOB):
+        return ob.kind
+    if not ob.derived:
+        return None
+    for kind, (name, prefix) in derived_defs.items():
+        if ob.comment.startswith(prefix):
+            return kind
+    return None
+
+
+def _to_epoch(dt, default):
+    # datetime -> seconds since the epoch (UTC) as a float
+    if dt is None:
+        return default
+    return (dt - calcpos.epoch_utc).total_seconds()
+
+
+class OBPool(object):
+    """
+    An ordered set of OBs, with per-program views.  OBs keep the order
+    in which they were added, and membership tests and removals take
+    constant time, so that OBs can be dropped from a large pool as they
+    are scheduled or rejected.
+    """
+
+    def __init__(self, oblist=None):
+        self.obs = OrderedDict()
+        # program name -> OrderedDict of its OBs
+        self.programs = {}
+        if oblist is not None:
+            for ob in oblist:
+                self.add(ob)
+
+    def add(self, ob):
+        """Adds `ob` at the end of the pool, if it is not there already."""
+        if ob in self.obs:
+            return
+        self.obs[ob] = True
+        pgmname = str(ob.program)
+        try:
+            self.programs[pgmname][ob] = True
+
+        except KeyError:
+            self.programs[pgmname] = OrderedDict([(ob, True)])
+
+    def extend(self, oblist):
+        for ob in oblist:
+            self.add(ob)
+
+    def remove(self, ob):
+        """Removes `ob` from the pool.  Raises KeyError if it is not in
+        the pool.
+        """
+        del self.obs[ob]
+        del self.programs[str(ob.program)][ob]
+
+    def discard(self, ob):
+        """Removes `ob` from the pool, if it is there."""
+        if ob in self.obs:
+            self.remove(ob)
+
+    def get_program(self, pgmname):
+        """Returns the list of OBs of program `pgmname`, in order."""
+        return list(self.programs.get(pgmname, ()))
+
+    def count(self, pgmname):
+        """Returns the number of OBs of program `pgmname`."""
+        return len(self.programs.get(pgmname, ()))
+
+    def copy(self):
+        return OBPool(self.obs)
+
+    def __contains__(self, ob):
+        return ob in self.obs
+
+    def __len__(self):
+        return len(self.obs)
+
+    def __iter__(self):
+        return iter(self.obs)
+
+
+class OBTable(object):
+    """
+    Columnar mirror of a list of OBs: the values used by the cheap
+    checks of check_slot() are kept in NumPy arrays (one element per
+    OB), so that those checks can be done for all OBs at once by
+    prefilter().  If the calcpos.VisibilityIndex `vis` of the night is
+    given, OBs whose targets are no longer within their elevation limits
+    for long enough are rejected as well.
+    """
+
+    def __init__(self, oblist, vis=None):
+        self.oblist = list(oblist)
+        self.vis = vis
+        # OB -> row
+        self.index = dict((ob, i) for i, ob in enumerate(self.oblist))
+
+        def column(fn, dtype=float):
+            return np.array([fn(ob) for ob in self.oblist], dtype=dtype)
+
+        inf = np.inf
+        self.total_time = column(lambda ob: ob.total_time)
+        # a missing constraint passes every check
+        self.seeing = column(lambda ob: (inf if ob.envcfg.seeing is None
+                                         else ob.envcfg.seeing))
+        self.transparency = column(lambda ob: (-inf
+                                               if ob.envcfg.transparency is None
+                                               else ob.envcfg.transparency))
+        self.lower_time_limit = column(
+            lambda ob: _to_epoch(ob.envcfg.lower_time_limit, -inf))
+        self.upper_time_limit = column(
+            lambda ob: _to_epoch(ob.envcfg.upper_time_limit, inf))
+        self.dome_open = column(lambda ob: ob.telcfg.dome == 'open',
+                                dtype=bool)
+        # elevation limits, with the minimum raised to meet the airmass
+        self.min_alt_deg = column(
+            lambda ob: calcpos.calc_min_alt_deg(ob.telcfg.get_el_minmax()[0],
+                                                airmass=ob.envcfg.airmass))
+        self.max_el = column(lambda ob: ob.telcfg.get_el_minmax()[1])
+        # end (ephem date) of the last window of the night during which
+        # each target is within its elevation limits; see vis_stop()
+        self._vis_stop = None
+
+    def __len__(self):
+        return len(self.oblist)
+
+    def get_rows(self, oblist):
+        """Returns the rows of the OBs in `oblist` as an array."""
+        return np.array([self.index[ob] for ob in oblist], dtype=int)
+
+    def vis_stop(self):
+        """Returns an array with the end (ephem date) of the last window
+        of the night during which the target of each OB is within its
+        elevation limits (-inf if there is none, inf for OBs with the
+        dome closed).  The windows of all targets are solved at once,
+        the first time this is called.
+        """
+        if self._vis_stop is None:
+            rows = np.flatnonzero(self.dome_open)
+            self.vis.precompute([self.oblist[i].target for i in rows],
+                                self.min_alt_deg[rows], self.max_el[rows])
+            vis_stop = np.full(len(self.oblist), np.inf)
+            for i in rows:
+                sets = self.vis.get_intervals(self.oblist[i].target,
+                                              self.min_alt_deg[i],
+                                              self.max_el[i])[1]
+                vis_stop[i] = sets[-1] if len(sets) > 0 else -np.inf
+            self._vis_stop = vis_stop
+        return self._vis_stop
+
+    def prefilter(self, slot, oblist, check_env=True):
+        """
+        Returns a boolean array with one element per OB in `oblist`,
+        True where the OB passes the checks of check_slot_gates()
+        for `slot`.  Only those OBs need the full check_slot().
+        """
+        rows = self.get_rows(oblist)
+        if len(rows) == 0:
+            return np.zeros(0, dtype=bool)
+
+        ok = self.total_time[rows] <= slot.size()
+        ok &= self.lower_time_limit[rows] <= slot.stop_epoch
+        ok &= self.upper_time_limit[rows] >= slot.start_epoch
+        slot_open = (slot.data.dome == 'open')
+        ok &= self.dome_open[rows] == slot_open
+
+        if check_env and slot_open:
+            ok &= self.seeing[rows] >= slot.data.seeing
+            ok &= self.transparency[rows] <= slot.data.transparency
+
+        if slot_open and (self.vis is not None):
+            # same test as calcpos.VisibilityIndex.is_past_windows()
+            djd_start = calcpos.epoch_to_djd(slot.start_epoch)
+            if self.vis.djd_start <= djd_start <= self.vis.djd_stop:
+                ok &= ((self.vis_stop()[rows] - djd_start) * 86400.0 >
+                       self.total_time[rows])
+
+        return ok
+
+
+class SlewCostTable(object):
+    """
+    Slew times between targets during a night, answered from the
+    positions of the targets tabulated in a calcpos.AltAzTable.  Times
+    outside the table period are passed on to the site.
+    """
+
+    def __init__(self, site, altaz):
+        self.site = site
+        self.altaz = altaz
+
+    def get_alt_az(self, target, t):
+        """Returns the altitude and azimuth (deg) of `target` at `t`
+        (seconds since the epoch).
+        """
+        res = self.altaz.calc_djd(target, calcpos.epoch_to_djd(t))
+        if res is None:
+            c = target.calc(self.site, calcpos.epoch_to_datetime(t))
+            res = (c.alt_deg, c.az_deg)
+        return res
+
+    def get_slew_time(self, from_target, to_target, t):
+        """Slew time (sec) from `from_target` to `to_target` at `t`
+        (seconds since the epoch).
+        """
+        alt1, az1 = self.get_alt_az(from_target, t)
+        alt2, az2 = self.get_alt_az(to_target, t)
+        return calc_slew_time(alt1, az1, alt2, az2)
+
+    def get_az_drift(self, target, t1, t2):
+        """Change (deg) in the azimuth of `target` from `t1` to `t2`
+        (seconds since the epoch) while it is tracked, i.e. without
+        jumps across north.
+        """
+        altaz = self.altaz
+        djd = calcpos.epoch_to_djd(np.array([t1, t2]))
+        if not altaz.covers(djd):
+            az1 = self.get_alt_az(target, t1)[1]
+            az2 = self.get_alt_az(target, t2)[1]
+            # assume the shorter way round
+            return float(np.mod(az2 - az1 + 180.0, 360.0) - 180.0)
+
+        az = altaz.alt_az(altaz.get_index([target])[0], djd, unwrap=True)[1]
+        return float(az[1] - az[0])
+
+    def get_slew_times(self, from_targets, to_targets, times):
+        """Slew times (sec) from `from_targets` to `to_targets` at
+        `times` (seconds since the epoch), pairwise.  A single target or
+        time is paired with all of the others.
+        """
+        altaz = self.altaz
+        djd = calcpos.epoch_to_djd(np.atleast_1d(np.asarray(times,
+                                                            dtype=float)))
+        if not altaz.covers(djd):
+            raise ValueError("times are outside of the table period")
+
+        idx1 = altaz.get_index(np.atleast_1d(from_targets))
+        idx2 = altaz.get_index(np.atleast_1d(to_targets))
+        alt1, az1 = altaz.alt_az(idx1, djd)
+        alt2, az2 = altaz.alt_az(idx2, djd)
+        return calc_slew_time(alt1, az1, alt2, az2)
+
+
+def prepare_night(site, start_time, stop_time, oblist=None, vis=None):
+    """Precompute the per-night tables used to speed up the checks of
+    OBs against a night running from `start_time` to `stop_time`.
+    The result is passed as the `night` parameter to the check functions.
+    If `oblist` is given, it is mirrored in an OBTable for the night.
+    If `vis` is given, it is the night's calcpos.VisibilityIndex, with
+    the visibility windows solved so far.
+    """
+    if vis is None:
+        vis = site.get_visibility_index(start_time, stop_time)
+    obtable = None
+    if oblist is not None:
+        obtable = OBTable(oblist, vis=vis)
+    night = Bunch.Bunch(site=site, start_time=start_time,
+                        stop_time=stop_time, vis=vis,
+                        moon=site.get_moon_table(start_time, stop_time),
+                        obtable=obtable, slot_static={},
+                        calibration30_inscfgs={})
+    night.slew = SlewCostTable(site, site.get_altaz_table(start_time,
+                                                          stop_time))
+    night.moon_calendar = MoonCalendar(night.moon)
+    return night
+
+
+def _get_alt_az(site, night, target, t):
+    # altitude and azimuth (deg) of `target` at `t` (seconds since the
+    # epoch), from the night's table if we have one
+    if night is None:
+        c = target.calc(site, calcpos.epoch_to_datetime(t))
+        return c.alt_deg, c.az_deg
+    return night.slew.get_alt_az(target, t)
+
+def _get_az_drift(site, night, target, t1, t2):
+    # change in the azimuth (deg) of `target` while it is tracked from
+    # `t1` to `t2` (seconds since the epoch)
+    if night is None:
+        az1 = target.calc(site, calcpos.epoch_to_datetime(t1)).az_deg
+        az2 = target.calc(site, calcpos.epoch_to_datetime(t2)).az_deg
+        # assume the shorter way round
+        return float(np.mod(az2 - az1 + 180.0, 360.0) - 180.0)
+    return night.slew.get_az_drift(target, t1, t2)
+
+def _get_vis(site, night):
+    # visibility queries are answered from the night's index, if we have one
+    if night is None:
+        return site
+    return night.vis
+
+
+def _check_feasibility_one(site, slot, obs, kind, check_moon, check_env,
+                           vis=None):
+    # check all `obs` against one night `slot`, keeping the visibility
+    # windows in the night's index `vis` if given; returns a boolean row
+    # and the reasons for the rejected OBs
+    row = np.zeros(len(obs), dtype=bool)
+    reasons = {}
+    if (kind == 'slot') and (slot.size() < minimum_slot_size):
+        return row, reasons
+
+    night = prepare_night(site, slot.start_time, slot.stop_time, vis=vis)
+    precompute_night_visibility(night, obs)
+
+    for i, ob in enumerate(obs):
+        if kind == 'visibility':
+            res = check_night_visibility_one(site, slot, ob, night=night)
+        else:
+            # this OB OK for this slot at this site?
+            res = check_slot(site, None, slot, ob,
+                             check_moon=check_moon, check_env=check_env,
+                             night=night)
+        row[i] = res.obs_ok
+        if not res.obs_ok:
+            reasons[i] = res.reason
+
+    return row, reasons
+
+# state of the worker processes of check_feasibility()
+_feasibility_args = None
+
+def _init_feasibility_worker(*args):
+    global _feasibility_args
+    _feasibility_args = args
+
+def _check_feasibility_worker(slot):
+    site, obs, kind, check_moon, check_env = _feasibility_args
+    return _check_feasibility_one(site, slot, obs, kind, check_moon,
+                                  check_env)
+
+def check_feasibility(site, slots, obs, kind='slot', check_moon=False,
+                      check_env=False, num_procs=1, vis=None):
+    """
+    Check every OB in `obs` against every night in `slots` (whole night
+    slots).  If `kind` is 'slot', the OB is checked with check_slot(),
+    and if it is 'visibility', with check_night_visibility_one().
+
+    Returns a boolean matrix of shape (len(slots), len(obs)), True where
+    the OB is feasible on the night, and a list with one dict per night
+    mapping the index of each rejected OB to the reason.
+
+    If `vis` is given, it has a calcpos.VisibilityIndex for each night
+    in `slots`, in which the visibility windows of the targets are
+    solved and kept, so that the scheduler can reuse them when it fills
+    the nights.  The other night tables (positions of the targets and
+    the moon) are only built for the checks, one night at a time.
+
+    If `num_procs` is greater than 1, the nights are shared out over
+    that many worker processes.  The OBs and the observer are pickled
+    once per worker, and each worker builds its own night tables (the
+    `vis` are not filled in).  The result does not depend on `num_procs`.
+    """
+    if kind not in ('slot', 'visibility'):
+        raise ValueError("kind should be 'slot' or 'visibility': '%s'" % (
+            kind))
+
+    args = (site, obs, kind, check_moon, check_env)
+    if (num_procs > 1) and (len(slots) > 1):
+        pool = multiprocessing.Pool(min(num_procs, len(slots)),
+                                    initializer=_init_feasibility_worker,
+                                    initargs=args)
+        try:
+            # results come back in the order of the slots
+            results = pool.map(_check_feasibility_worker, slots)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        if vis is None:
+            vis = [None] * len(slots)
+        results = [_check_feasibility_one(site, slot, obs, kind, check_moon,
+                                          check_env, vis=slot_vis)
+                   for slot, slot_vis in zip(slots, vis)]
+
+    matrix = np.zeros((len(slots), len(obs)), dtype=bool)
+    reasons = []
+    for i, (row, rejected) in enumerate(results):
+        matrix[i] = row
+        reasons.append(rejected)
+    return matrix, reasons
+
+def obs_to_slots(logger, slots, site, obs, check_moon=False, check_env=False,
+                 num_procs=1):
+    matrix, reasons = check_feasibility(site, slots, obs, kind='slot',
+                                        check_moon=check_moon,
+                                        check_env=check_env,
+                                        num_procs=num_procs)
+    debug = logger.isEnabledFor(logging.DEBUG)
     obmap = {}
-    for slot in slots:
+    for i, slot in enumerate(slots):
         key = str(slot)
-        obmap[key] = []
-        if slot.size() < minimum_slot_size:
+        obmap[key] = [ob for ob, ok in zip(obs, matrix[i]) if ok]
+        if not debug:
             continue
-        for ob in obs:
-            # this OB OK for this slot at this site?
-            res = check_slot(site, None, slot, ob,
-                             check_moon=check_moon, check_env=check_env)
-            if res.obs_ok:
-                obmap[key].append(ob)
-            else:
-                ob_id = "%s/%s" % (ob.program, ob.name)
-                logger.debug("OB %s (%s) no good for slot because: %s" % (
-                    ob, ob_id, res.reason))
+        for j, reason in sorted(reasons[i].items()):
+            ob = obs[j]
+            ob_id = "%s/%s" % (ob.program, ob.name)
+            logger.debug("OB %s (%s) no good for slot because: %s" % (
+                ob, ob_id, reason))
 
     return obmap
 
-def calc_slew_time(cur_alt_deg, cur_az_deg, to_alt_deg, to_az_deg):
+def calc_wrap_az(cur_az_deg, to_az_deg):
+    """Returns the azimuth (deg) within the cable wrap range
+    (az_wrap_min_deg to az_wrap_max_deg) at which the telescope, at
+    azimuth `cur_az_deg` of the range, points to azimuth `to_az_deg`.
+    The shorter way round is taken, unless it would leave the range.
+    A `cur_az_deg` outside the range (e.g. from 0 to 360 deg) is first
+    taken to the same direction within it.  Works on scalars or arrays.
+    """
+    cur_az_deg = _to_wrap_range(cur_az_deg)
+    az = cur_az_deg + np.mod(to_az_deg - cur_az_deg + 180.0, 360.0) - 180.0
+    return _to_wrap_range(az)
+
+def calc_tracked_az_wrap(site, target, az_wrap, t, night=None):
+    """Returns the telescope's azimuth within its cable wrap range after
+    tracking `target` from `az_wrap` (a tuple (seconds since the epoch,
+    azimuth)) until `t`, as a tuple (t, azimuth).  The azimuth may end
+    up outside the range if the target moves past the cable wrap limit.
+    """
+    t_wrap, az_wrap_deg = az_wrap
+    return (t, az_wrap_deg + _get_az_drift(site, night, target, t_wrap, t))
+
+def _to_wrap_range(az_deg):
+    # same direction within the cable wrap range; as the range spans
+    # more than 360 deg, one turn either way is enough
+    if isinstance(az_deg, np.ndarray):
+        az_deg = np.where(az_deg > az_wrap_max_deg, az_deg - 360.0, az_deg)
+        return np.where(az_deg < az_wrap_min_deg, az_deg + 360.0, az_deg)
+    if az_deg > az_wrap_max_deg:
+        return az_deg - 360.0
+    if az_deg < az_wrap_min_deg:
+        return az_deg + 360.0
+    return az_deg
 
-    delta_alt, delta_az = to_alt_deg - cur_alt_deg, to_az_deg - cur_az_deg
+def calc_slew_time(cur_alt_deg, cur_az_deg, to_alt_deg, to_az_deg):
+    """Slew time (sec) between two positions.  `cur_az_deg` is the
+    telescope's azimuth within its cable wrap range, and the azimuth is
+    slewed as calc_wrap_az() says: the shorter way round, or else the
+    long way to unwind the cable.  Works on scalars or arrays of
+    positions.
+    """
+    delta_alt = to_alt_deg - cur_alt_deg
+    delta_az = calc_wrap_az(cur_az_deg, to_az_deg) - _to_wrap_range(cur_az_deg)
 
     slew_sec = misc.calc_slew_time(delta_az, delta_alt)
     return slew_sec
@@ -146,34 +773,168 @@ def calc_slew_time(cur_alt_deg, cur_az_deg, to_alt_deg, to_az_deg):
 
 def check_schedule_invariant_one(site, schedule, ob):
 
-    res = Bunch.Bunch(ob=ob, obs_ok=False, reason="No good reason!")
+    res = Bunch.Bunch(ob=ob, obs_ok=False, reason=no_reason)
 
     # check if instrument will be installed
     if not (ob.inscfg.insname in schedule.data.instruments):
-        res.setvals(obs_ok=False, reason="Instrument '%s' not installed" % (
-            ob.inscfg.insname))
+        res.setvals(obs_ok=False, reason=Reason(R_INSTRUMENT,
+                                                 ob.inscfg.insname))
         return res
 
     # check if filter will be installed
     if not (ob.inscfg.filter in schedule.data.filters):
-        res.setvals(obs_ok=False, reason="Filter '%s' not installed [%s]" % (
-            ob.inscfg.filter, schedule.data.filters))
+        res.setvals(obs_ok=False, reason=Reason(R_FILTER, ob.inscfg.filter,
+                                                 schedule.data.filters))
         return res
 
     # check if this schedule can take this category
     if not ob.program.category in schedule.data.categories:
         res.setvals(obs_ok=False,
-                    reason="Slot cannot take category '%s'" % (
-            ob.program.category))
+                    reason=Reason(R_CATEGORY, ob.program.category))
         return res
 
     res.setvals(obs_ok=True)
     return res
 
 
-def check_schedule_invariant(site, schedule, oblist):
+class Vocabulary(object):
+    """
+    Assigns a bit to each name of a vocabulary (instrument names, filter
+    names, etc.), so that sets of names can be encoded as integer
+    bitmasks.
+    """
+
+    def __init__(self, names=None):
+        self.names = []
+        # name -> bit
+        self.bits = {}
+        if names is not None:
+            for name in names:
+                self.get_bit(name)
+
+    def get_bit(self, name):
+        """Returns the bit for `name`, adding it if necessary."""
+        try:
+            return self.bits[name]
+
+        except KeyError:
+            bit = len(self.names)
+            self.bits[name] = bit
+            self.names.append(name)
+            return bit
+
+    def encode(self, names):
+        """Returns the bitmask for the sequence `names`.  Names that are
+        not in the vocabulary are ignored.
+        """
+        mask = 0
+        for name in names:
+            bit = self.bits.get(name, None)
+            if bit is not None:
+                mask |= (1 << bit)
+        return mask
+
+    def get_lookup(self, mask):
+        """Returns a boolean array indexed by bit, True for the bits set
+        in `mask`.
+        """
+        return np.array([bool(mask & (1 << bit))
+                         for bit in range(len(self.names))], dtype=bool)
+
+
+class InvariantTable(object):
+    """
+    The instrument, filter and program category of a list of OBs,
+    encoded as bits of a Vocabulary each, so that
+    check_schedule_invariant() can check all OBs at once.
+    """
+
+    def __init__(self, oblist):
+        self.oblist = list(oblist)
+        # OB -> row
+        self.index = dict((ob, i) for i, ob in enumerate(self.oblist))
+
+        self.instruments = Vocabulary()
+        self.filters = Vocabulary()
+        self.categories = Vocabulary()
+
+        def column(vocab, fn):
+            return np.array([vocab.get_bit(fn(ob)) for ob in self.oblist],
+                            dtype=int)
+
+        self.instrument = column(self.instruments,
+                                 lambda ob: ob.inscfg.insname)
+        self.filter = column(self.filters, lambda ob: ob.inscfg.filter)
+        self.category = column(self.categories,
+                               lambda ob: ob.program.category)
+
+    def get_rows(self, oblist):
+        """Returns the rows of the OBs in `oblist` as an array."""
+        return np.array([self.index[ob] for ob in oblist], dtype=int)
+
+    def check(self, data, oblist):
+        """
+        Returns a boolean array with one element per OB in `oblist`,
+        True where the instrument, filter and category of the OB are
+        all allowed by the schedule `data`.
+        """
+        rows = self.get_rows(oblist)
+        ok = np.ones(len(rows), dtype=bool)
+        for vocab, column, names in ((self.instruments, self.instrument,
+                                      data.instruments),
+                                     (self.filters, self.filter,
+                                      data.filters),
+                                     (self.categories, self.category,
+                                      data.categories)):
+            if len(rows) > 0:
+                lookup = vocab.get_lookup(vocab.encode(names))
+                ok &= lookup[column[rows]]
+        return ok
+
+
+class InvariantResults(object):
+    """
+    Results of check_schedule_invariant() when done with an
+    InvariantTable.  The result for an OB (with the reason for its
+    rejection) is only worked out when looked up.
+    """
+
+    def __init__(self, site, schedule):
+        self.site = site
+        self.schedule = schedule
+        self._results = {}
+
+    def __getitem__(self, ob):
+        try:
+            return self._results[ob]
+
+        except KeyError:
+            res = check_schedule_invariant_one(self.site, self.schedule, ob)
+            self._results[ob] = res
+            return res
+
+
+def check_schedule_invariant(site, schedule, oblist, table=None):
+    """Check the OBs in `oblist` against the things that do not change
+    during the schedule (instruments, filters and categories).
+    If `table` (an InvariantTable covering all OBs in `oblist`) is
+    given, all OBs are checked at once, and the results are looked
+    up on demand.
+    """
+    if table is not None:
+        try:
+            mask = table.check(schedule.data, oblist)
+
+        except KeyError:
+            # some OB is not in the table--check them one by one
+            mask = None
+
+        if mask is not None:
+            good = [ob for ob, ok in zip(oblist, mask) if ok]
+            bad = [ob for ob, ok in zip(oblist, mask) if not ok]
+            return good, bad, InvariantResults(site, schedule)
+
     good, bad, results = [], [], {}
-    # TODO: chance for vectorization
     for ob in oblist:
         res = check_schedule_invariant_one(site, schedule, ob)
         results[ob] = res
@@ -185,23 +946,26 @@ def check_schedule_invariant(site, schedule, oblist):
     return good, bad, results
 
 
-def check_night_visibility_one(site, schedule, ob):
+def check_night_visibility_one(site, schedule, ob, night=None):
 
-    res = Bunch.Bunch(ob=ob, obs_ok=False, reason="No good reason!")
+    res = Bunch.Bunch(ob=ob, obs_ok=False, reason=no_reason)
 
     if schedule.data.dome != ob.telcfg.dome:
-        res.setvals(obs_ok=False, reason="Dome status OB(%s) != schedule(%s)" % (
-            ob.telcfg.dome, schedule.data.dome))
+        res.setvals(obs_ok=False, reason=Reason(R_DOME_SCHEDULE,
+                                                 ob.telcfg.dome,
+                                                 schedule.data.dome))
         return res
 
     if ob.telcfg.dome == 'closed':
-        res.setvals(obs_ok=True, reason="Dome is closed and this matches OB")
+        res.setvals(obs_ok=True, reason=Reason(R_DOME_CLOSED))
         return res
 
     min_el, max_el = ob.telcfg.get_el_minmax()
 
+    vis = _get_vis(site, night)
+
     # is this target visible during this night, and when?
-    (obs_ok, t_start, t_stop) = site.observable(ob.target,
+    (obs_ok, t_start, t_stop) = vis.observable(ob.target,
                                                 schedule.start_time,
                                                 schedule.stop_time,
                                                 min_el, max_el, ob.total_time,
@@ -210,7 +974,7 @@ def check_night_visibility_one(site, schedule, ob):
 
     if not obs_ok:
         res.setvals(obs_ok=False,
-                    reason="Time or visibility of target")
+                    reason=Reason(R_VISIBILITY))
         return res
 
     tgt_cal = ob.calib_tgtcfg
@@ -219,7 +983,7 @@ def check_night_visibility_one(site, schedule, ob):
         obj2 = (tgt_cal.ra, tgt_cal.dec, tgt_cal.equinox)
         if obj2 != obj1:
             # is calibration target visible during this night, and when?
-            (obs_ok2, t_start2, t_stop2) = site.observable(tgt_cal,
+            (obs_ok2, t_start2, t_stop2) = vis.observable(tgt_cal,
                                                            schedule.start_time,
                                                            schedule.stop_time,
                                                            min_el, max_el,
@@ -229,7 +993,7 @@ def check_night_visibility_one(site, schedule, ob):
 
             if not obs_ok2:
                 res.setvals(obs_ok=False,
-                            reason="Time or visibility of calibration target")
+                            reason=Reason(R_CALIB_VISIBILITY))
                 return res
 
             t_start = max(t_start, t_start2)
@@ -239,10 +1003,31 @@ def check_night_visibility_one(site, schedule, ob):
     res.setvals(obs_ok=obs_ok, start_time=t_start, stop_time=t_stop)
     return res
 
-def check_night_visibility(site, schedule, oblist):
+def precompute_night_visibility(night, oblist):
+    """Solve the visibility windows of the targets (and calibration
+    targets) of all OBs in `oblist` for the night at once.
+    """
+    targets, min_alts, max_alts = [], [], []
+    for ob in oblist:
+        if ob.telcfg.dome == 'closed':
+            continue
+        min_el, max_el = ob.telcfg.get_el_minmax()
+        min_alt = calcpos.calc_min_alt_deg(min_el, airmass=ob.envcfg.airmass)
+        for tgt in (ob.target, ob.calib_tgtcfg):
+            if tgt is not None:
+                targets.append(tgt)
+                min_alts.append(min_alt)
+                max_alts.append(max_el)
+
+    night.vis.precompute(targets, min_alts, max_alts)
+    night.slew.altaz.add_targets(targets)
+
+def check_night_visibility(site, schedule, oblist, night=None):
     good, bad, results = [], [], {}
+    if night is not None:
+        precompute_night_visibility(night, oblist)
     for ob in oblist:
-        res = check_night_visibility_one(site, schedule, ob)
+        res = check_night_visibility_one(site, schedule, ob, night=night)
         results[str(ob)] = res
         if res.obs_ok:
             good.append(ob)
@@ -251,81 +1036,215 @@ def check_night_visibility(site, schedule, oblist):
 
     return good, bad, results
 
-def check_moon_cond(site, start_time, stop_time, ob, res):
-    """Check whether the moon is at acceptable darkness for this OB
-    and an acceptable distance from the target.
+class MoonCalendar(object):
+    """
+    The moon conditions during a night, worked out once from the
+    night's calcpos.MoonTable: illumination, the intervals during which
+    the moon is down, and the classification of periods as dark or
+    gray.  A period is dark if the illumination at its start is at most
+    `pct_limit`, or if the moon is down (below `horizon_deg`) for all
+    of it.
     """
-    c1 = ob.target.calc(site, start_time)
-    c2 = ob.target.calc(site, stop_time)
-
-    # is this a dark night? check moon illumination
-    is_dark_night = c1.moon_pct <= dark_night_moon_pct_limit
-
-    desired_moon_sep = ob.envcfg.moon_sep
 
-    # if the moon is down for entire exposure, override illumination
-    # and consider this a dark night
-    horizon_deg = 0.0   # change as necessary
-    if (c1.moon_alt < horizon_deg) and (c2.moon_alt < horizon_deg):
-        #print("moon down, dark night")
-        is_dark_night = True
+    def __init__(self, moon, pct_limit=dark_night_moon_pct_limit,
+                 horizon_deg=moon_horizon_deg):
+        self.moon = moon
+        self.pct_limit = pct_limit
+        self.horizon_deg = horizon_deg
+
+        # find the horizon crossings of the (interpolated) moon altitude
+        t_djd, alt = moon.t_djd, moon.alt_deg - horizon_deg
+        below = alt < 0.0
+        idx = np.nonzero(below[:-1] != below[1:])[0]
+        t_cross = t_djd[idx] + ((t_djd[idx+1] - t_djd[idx]) *
+                                alt[idx] / (alt[idx] - alt[idx+1]))
+        # intervals (ephem dates) that the moon is down; the table
+        # values hold beyond its ends
+        self.down_start = list(t_cross[below[idx+1]])
+        self.down_end = list(t_cross[~below[idx+1]])
+        if below[0]:
+            self.down_start.insert(0, -np.inf)
+        if below[-1]:
+            self.down_end.append(np.inf)
+
+    def moon_pct(self, djd):
+        """Moon illumination (fraction) at ephem date(s) `djd`."""
+        return self.moon.moon_pct(djd)
+
+    def is_moon_down(self, djd_start, djd_stop):
+        """True if the moon is down for all of the period between ephem
+        dates `djd_start` and `djd_stop`.
+        """
+        i = bisect.bisect_right(self.down_start, djd_start) - 1
+        return ((i >= 0) and (djd_start > self.down_start[i]) and
+                (djd_stop < self.down_end[i]))
+
+    def is_dark(self, djd_start, djd_stop):
+        """True if the period between ephem dates `djd_start` and
+        `djd_stop` is dark.
+        """
+        return ((self.moon.moon_pct(djd_start) <= self.pct_limit) or
+                self.is_moon_down(djd_start, djd_stop))
+
+    def classify(self, djd_start, djd_stop):
+        """Returns 'dark' or 'gray' for the period between ephem dates
+        `djd_start` and `djd_stop`.
+        """
+        if self.is_dark(djd_start, djd_stop):
+            return 'dark'
+        return 'gray'
+
+
+def check_moon_cond(site, t_start, t_stop, ob, res, night=None):
+    """Check whether the moon is at acceptable darkness for this OB
+    and an acceptable distance from the target, between `t_start` and
+    `t_stop` (seconds since the epoch).
+    """
+    if night is not None:
+        # answer from the night's moon calendar and table
+        calendar = night.moon_calendar
+        moon = calendar.moon
+        djd = moon.get_sample_times_djd(calcpos.epoch_to_djd(t_start),
+                                        calcpos.epoch_to_djd(t_stop))
+        is_dark_night = calendar.is_dark(djd[0], djd[-1])
+    else:
+        c1 = ob.target.calc(site, calcpos.epoch_to_datetime(t_start))
+        c2 = ob.target.calc(site, calcpos.epoch_to_datetime(t_stop))
+        # is this a dark night? check moon illumination
+        is_dark_night = c1.moon_pct <= dark_night_moon_pct_limit
+
+        # if the moon is down for entire exposure, override illumination
+        # and consider this a dark night
+        if ((c1.moon_alt < moon_horizon_deg) and
+            (c2.moon_alt < moon_horizon_deg)):
+            #print("moon down, dark night")
+            is_dark_night = True
 
     # if observer specified a moon phase, check it now
     if ob.envcfg.moon == 'dark':
-        ## print "moon pct=%f moon alt=%f moon_sep=%f" % (
-        ##     c1.moon_pct, c1.moon_alt, c1.moon_sep)
         if not is_dark_night:
-            res.setvals(obs_ok=False,
-                        reason="Moon illumination=%f not acceptable (alt 1=%.2f 2=%.2f" % (
-                c1.moon_pct, c1.moon_alt, c2.moon_alt))
+            if night is not None:
+                moon_pct = moon.moon_pct(djd[0])
+                moon_alt1, moon_alt2 = moon.moon_alt(djd[[0, -1]])
+            else:
+                moon_pct = c1.moon_pct
+                moon_alt1, moon_alt2 = c1.moon_alt, c2.moon_alt
+            res.obs_ok = False
+            res.reason = Reason(R_MOON_ILLUMINATION, moon_pct,
+                                moon_alt1, moon_alt2)
             return False
 
+    desired_moon_sep = ob.envcfg.moon_sep
+    if desired_moon_sep is None:
+        # moon looks good!
+        return True
+
     # override the observer's desired separation if it is a dark night
-    limit_sep = min(30.0, desired_moon_sep)
-    if (desired_moon_sep is not None) and is_dark_night:
-        desired_moon_sep = min(desired_moon_sep, limit_sep)
+    if is_dark_night:
+        desired_moon_sep = min(desired_moon_sep, 30.0)
         if desired_moon_sep < ob.envcfg.moon_sep:
-            res.setvals(override="overrode moon separation (%.2f) -> %.2f deg" % (
-                ob.envcfg.moon_sep, desired_moon_sep))
-
-    # if observer specified a moon separation from target, check it now
-    # TODO: do we need to check this at the end of the exposure as well?
-    # If so, then we may need to do it in observable() method
-    if desired_moon_sep is not None:
-        if ((c1.moon_sep < desired_moon_sep) or
-            (c2.moon_sep < desired_moon_sep)):
-            res.setvals(obs_ok=False,
-                        reason="Moon-target separation (%f,%f < %f) not acceptable" % (
-                c1.moon_sep, c2.moon_sep, desired_moon_sep))
-            return False
+            res.override = "overrode moon separation (%.2f) -> %.2f deg" % (
+                ob.envcfg.moon_sep, desired_moon_sep)
+
+    # observer specified a moon separation from target, check it now
+    if night is not None:
+        # separation is checked for the whole exposure interval
+        moon_seps = moon.moon_sep(ob.target, djd)
+    else:
+        moon_seps = [c1.moon_sep, c2.moon_sep]
+    min_moon_sep = min(moon_seps)
+    if min_moon_sep < desired_moon_sep:
+        res.obs_ok = False
+        res.reason = Reason(R_MOON_SEPARATION, min_moon_sep,
+                            desired_moon_sep)
+        return False
 
     # moon looks good!
     return True
 
 
-def check_slot(site, prev_slot, slot, ob, check_moon=True, check_env=True):
-
-    res = Bunch.Bunch(ob=ob, obs_ok=False, reason="No good reason!")
+class SlotEvaluation(object):
+    """
+    Result of the evaluation of an OB against a slot by check_slot():
+    whether the OB can be observed in the slot (`obs_ok`), and if so,
+    when and with what preparation costs, else the `reason` why not.
+    There is one of these per OB per slot, so it has a fixed layout.
+    The times of the observation are in seconds since the epoch.
+    `az_wrap` is the telescope's azimuth within its cable wrap range
+    when it reaches the OB's target, as a tuple (seconds since the
+    epoch, azimuth); None with the dome closed.
+    """
+    __slots__ = ('ob', 'obs_ok', 'reason', 'override', 'prev_ob',
+                 'prep_sec', 'slew_sec', 'slew2_sec', 'filterchange',
+                 'filterchange_sec', 'calibration_sec', 'start_epoch',
+                 'stop_epoch', 'delay_sec', 'az_wrap')
+
+    def __init__(self, ob, obs_ok=False, reason=no_reason):
+        self.ob = ob
+        self.obs_ok = obs_ok
+        self.reason = reason
+        self.override = None
+        self.prev_ob = None
+        self.prep_sec = 0.0
+        self.slew_sec = 0.0
+        self.slew2_sec = 0.0
+        self.filterchange = False
+        self.filterchange_sec = 0.0
+        self.calibration_sec = 0.0
+        self.start_epoch = None
+        self.stop_epoch = None
+        self.delay_sec = 0.0
+        self.az_wrap = None
+
+    def set_result(self, obs_ok, prev_ob, prep_sec, slew_sec, slew2_sec,
+                   filterchange, filterchange_sec, calibration_sec,
+                   start_epoch, stop_epoch, delay_sec, az_wrap=None):
+        self.obs_ok = obs_ok
+        self.prev_ob = prev_ob
+        self.prep_sec = prep_sec
+        self.slew_sec = slew_sec
+        self.slew2_sec = slew2_sec
+        self.filterchange = filterchange
+        self.filterchange_sec = filterchange_sec
+        self.calibration_sec = calibration_sec
+        self.start_epoch = start_epoch
+        self.stop_epoch = stop_epoch
+        self.delay_sec = delay_sec
+        self.az_wrap = az_wrap
+
+    def get_values(self):
+        """Returns the fields as a dict."""
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return "SlotEvaluation(ob=%s, obs_ok=%s, reason=%s)" % (
+            self.ob, self.obs_ok, self.reason)
+
+
+def check_slot_gates(slot, ob, check_env=True, night=None):
+    """Cheap checks of `ob` against `slot` (slot length, time limits,
+    dome status and environment, and with a `night`, whether the target
+    is still within its elevation limits for long enough).  Returns a
+    result with the reason if the OB fails any of them, otherwise None.
+    See also OBTable.prefilter(), which does these checks vectorized.
+    """
+    res = SlotEvaluation(ob)
 
     # Check whether OB will fit in this slot
-    delta = (slot.stop_time - slot.start_time).total_seconds()
+    delta = slot.size()
     if ob.total_time > delta:
-        res.setvals(obs_ok=False,
-                    reason="Slot duration (%d) too short for OB (%d)" % (
-            delta, ob.total_time))
+        res.reason = Reason(R_SLOT_DURATION, delta, ob.total_time)
         return res
 
     # Check time limits on OB
     if (ob.envcfg.lower_time_limit is not None and
-        ob.envcfg.lower_time_limit > slot.stop_time):
-        res.setvals(obs_ok=False,
-                    reason="Slot end time is before OB lower time limit")
+        _to_epoch(ob.envcfg.lower_time_limit, None) > slot.stop_epoch):
+        res.reason = Reason(R_LOWER_TIME_LIMIT)
         return res
 
     if (ob.envcfg.upper_time_limit is not None and
-        ob.envcfg.upper_time_limit < slot.start_time):
-        res.setvals(obs_ok=False,
-                    reason="Slot start time is after OB upper time limit")
+        _to_epoch(ob.envcfg.upper_time_limit, None) < slot.start_epoch):
+        res.reason = Reason(R_UPPER_TIME_LIMIT)
         return res
 
     ## # check if instrument will be installed
@@ -347,6 +1266,139 @@ def check_slot(site, prev_slot, slot, ob, check_moon=True, check_env=True):
     ##         ob.program.category))
     ##     return res
 
+    # check dome status
+    if slot.data.dome != ob.telcfg.dome:
+        res.reason = Reason(R_DOME_SLOT, ob.telcfg.dome, slot.data.dome)
+        return res
+
+    if check_env and slot.data.dome != 'closed':
+        # check seeing on the slot is acceptable to this ob
+        if ((ob.envcfg.seeing is not None) and
+            (slot.data.seeing > ob.envcfg.seeing)):
+            res.reason = Reason(R_SEEING, slot.data.seeing,
+                                ob.envcfg.seeing)
+            return res
+
+        # check sky condition on the slot is acceptable to this ob
+        if ob.envcfg.transparency is not None:
+            if slot.data.transparency < ob.envcfg.transparency:
+                res.reason = Reason(R_TRANSPARENCY, slot.data.transparency,
+                                    ob.envcfg.transparency)
+                return res
+
+    # once the slot starts too late for the target's last window of
+    # visibility, there is no need to work out the preparation time
+    if (night is not None) and (slot.data.dome != 'closed'):
+        static = get_slot_static(ob, night=night)
+        if night.vis.is_past_windows(static.windows, slot.start_epoch,
+                                     ob.total_time):
+            res.reason = Reason(R_VISIBILITY)
+            return res
+
+    return None
+
+
+def get_slot_static(ob, night=None):
+    """Returns the parts of the evaluation of `ob` against a slot that
+    depend neither on the slot nor on the previous slot: elevation
+    limits, calibration time and the visibility windows of the target
+    (and separate calibration target) during the night.
+
+    With a `night`, the result is cached per OB for the night.  The
+    cache also keeps the last moon check of the OB, which is reused as
+    long as the OB would be observed at the same time.
+    """
+    if night is not None:
+        try:
+            return night.slot_static[ob]
+
+        except KeyError:
+            pass
+
+    min_el, max_el = ob.telcfg.get_el_minmax()
+    min_alt_deg = calcpos.calc_min_alt_deg(min_el, airmass=ob.envcfg.airmass)
+    static = Bunch.Bunch(min_el=min_el, max_el=max_el,
+                         min_alt_deg=min_alt_deg,
+                         calibration_sec=0.0, tgt_cal=None,
+                         windows=None, cal_windows=None, moon=None)
+
+    tgt_cal = ob.calib_tgtcfg
+    if tgt_cal is not None:
+        # TODO: take overheads into account?
+        c_i = ob.calib_inscfg
+        static.calibration_sec = c_i.exp_time * c_i.num_exp
+
+        # is calibration target the same as science target?
+        obj1 = (ob.target.ra, ob.target.dec, ob.target.equinox)
+        obj2 = (tgt_cal.ra, tgt_cal.dec, tgt_cal.equinox)
+        if obj2 != obj1:
+            static.tgt_cal = tgt_cal
+
+    if night is not None:
+        static.windows = night.vis.get_intervals(ob.target, min_alt_deg,
+                                                 max_el)
+        if static.tgt_cal is not None:
+            static.cal_windows = night.vis.get_intervals(static.tgt_cal,
+                                                         min_alt_deg, max_el)
+        night.slot_static[ob] = static
+
+    return static
+
+def _observable(site, night, target, windows, t_start, t_stop,
+                time_needed, ob, static):
+    # visibility of `target` during the period, answered from the
+    # cached windows where possible; times are seconds since the epoch
+    if night is not None:
+        res = night.vis.observable_windows(windows, t_start, t_stop,
+                                           time_needed)
+        if res is not None:
+            return res
+
+    vis = _get_vis(site, night)
+    obs_ok, time_rise, time_end = vis.observable(
+        target, calcpos.epoch_to_datetime(t_start),
+        calcpos.epoch_to_datetime(t_stop),
+        static.min_el, static.max_el, time_needed,
+        airmass=ob.envcfg.airmass, moon_sep=ob.envcfg.moon_sep)
+    if time_rise is None:
+        return (obs_ok, None, None)
+    return (obs_ok, _to_epoch(time_rise, None), _to_epoch(time_end, None))
+
+def _check_moon_cached(site, t_start, t_stop, ob, res, night, static):
+    # check_moon_cond(), reusing the OB's last result if it was for the
+    # same period
+    key = (t_start, t_stop)
+    if (static.moon is not None) and (static.moon[0] == key):
+        obs_ok, vals = static.moon[1:]
+
+    else:
+        mres = SlotEvaluation(ob)
+        obs_ok = check_moon_cond(site, t_start, t_stop, ob, mres,
+                                 night=night)
+        vals = (mres.reason, mres.override)
+        if night is not None:
+            static.moon = (key, obs_ok, vals)
+
+    res.reason, res.override = vals
+    return obs_ok
+
+def check_slot(site, prev_slot, slot, ob, check_moon=True, check_env=True,
+               night=None, prefiltered=False):
+    """Check whether `ob` can be scheduled in `slot` following
+    `prev_slot`.  If `prefiltered` is True, the OB is known to pass
+    check_slot_gates() already (e.g. from OBTable.prefilter()).
+
+    Only the slew and filter change costs depend on `prev_slot`; the
+    rest of the evaluation is cached per OB in the `night`, if given
+    (see get_slot_static()).
+    """
+    if not prefiltered:
+        res = check_slot_gates(slot, ob, check_env=check_env, night=night)
+        if res is not None:
+            return res
+
+    res = SlotEvaluation(ob)
+
     filterchange = False
     cur_filter = None
     filterchange_sec = 0.0
@@ -370,50 +1422,30 @@ def check_slot(site, prev_slot, slot, ob, check_moon=True, check_env=True):
     # for adding up total preparation time for new OB
     prep_sec = filterchange_sec
 
-    # check dome status
-    if slot.data.dome != ob.telcfg.dome:
-        res.setvals(obs_ok=False, reason="Dome status OB(%s) != slot(%s)" % (
-            ob.telcfg.dome, slot.data.dome))
-        return res
-
-    start_time = slot.start_time + timedelta(0, prep_sec)
+    # times are in seconds since the epoch
+    start_time = slot.start_epoch + prep_sec
 
     if slot.data.dome == 'closed':
         # <-- dome closed
 
-        stop_time = start_time + timedelta(0, ob.total_time)
+        stop_time = start_time + ob.total_time
 
         # Check whether OB will fit in this slot
-        if slot.stop_time < stop_time:
-            res.setvals(obs_ok=False, reason="Not enough time in slot")
+        if slot.stop_epoch < stop_time:
+            res.reason = Reason(R_SLOT_TIME)
             return res
 
-        res.setvals(obs_ok=True, prev_ob=prev_ob,
-                    prep_sec=prep_sec, slew_sec=0.0, slew2_sec=0.0,
-                    filterchange=filterchange,
-                    filterchange_sec=filterchange_sec,
-                    calibration_sec=0.0,
-                    start_time=start_time, stop_time=stop_time,
-                    delay_sec=0.0)
+        res.set_result(obs_ok=True, prev_ob=prev_ob,
+                       prep_sec=prep_sec, slew_sec=0.0, slew2_sec=0.0,
+                       filterchange=filterchange,
+                       filterchange_sec=filterchange_sec,
+                       calibration_sec=0.0,
+                       start_epoch=start_time, stop_epoch=stop_time,
+                       delay_sec=0.0)
         return res
 
     # <-- dome open, need to check visibility and other criteria
-
-    if check_env:
-        # check seeing on the slot is acceptable to this ob
-        if (slot.data.seeing > ob.envcfg.seeing):
-            res.setvals(obs_ok=False,
-                        reason="Seeing (%f > %f) not acceptable" % (
-                slot.data.seeing, ob.envcfg.seeing))
-            return res
-
-        # check sky condition on the slot is acceptable to this ob
-        if ob.envcfg.transparency is not None:
-            if slot.data.transparency < ob.envcfg.transparency:
-                res.setvals(obs_ok=False,
-                            reason="Transparency (%f < %f) not acceptable" % (
-                    slot.data.transparency, ob.envcfg.transparency))
-                return res
+    static = get_slot_static(ob, night=night)
 
     # Calculate cost of slew to this target
     # Assume that we want to do the calibration target first
@@ -433,58 +1465,61 @@ def check_slot(site, prev_slot, slot, ob, check_moon=True, check_env=True):
 
     else:
         # assume telescope is at previous target
-        c0 = prev_ob.target.calc(site, start_time)
-        cur_alt_deg, cur_az_deg = c0.alt_deg, c0.az_deg
-
-    c1 = target.calc(site, start_time)
-
-    slew_sec = calc_slew_time(cur_alt_deg, cur_az_deg, c1.alt_deg, c1.az_deg)
+        cur_alt_deg, cur_az_deg = _get_alt_az(site, night, prev_ob.target,
+                                              start_time)
+        if prev_slot.az_wrap is not None:
+            # the cable wrap is known from the end of the previous OB;
+            # the target has moved little since
+            az_wrap_deg = prev_slot.az_wrap[1]
+            cur_az_deg = az_wrap_deg + (np.mod(cur_az_deg - az_wrap_deg +
+                                               180.0, 360.0) - 180.0)
+
+    alt1_deg, az1_deg = _get_alt_az(site, night, target, start_time)
+
+    slew_sec = calc_slew_time(cur_alt_deg, cur_az_deg, alt1_deg, az1_deg)
+    # keep track of the cable wrap
+    t_wrap = start_time
+    az_wrap_deg = calc_wrap_az(cur_az_deg, az1_deg)
     #print("first slew time for new ob is %f sec" % (slew_sec))
 
     prep_sec += slew_sec
     # adjust on-target start time
-    start_time += timedelta(0, slew_sec)
-
-    min_el, max_el = ob.telcfg.get_el_minmax()
+    start_time += slew_sec
 
     # Is there a calibration target?  If so, then calculate in
     # calibration exposure and slew to main OB target
-    calibration_sec = 0.0
+    calibration_sec = static.calibration_sec
     slew2_sec = 0.0
-    tgt_cal = ob.calib_tgtcfg
-    if tgt_cal is not None:
-        # TODO: take overheads into account?
-        c_i = ob.calib_inscfg
-        calibration_sec = c_i.exp_time * c_i.num_exp
-
+    if ob.calib_tgtcfg is not None:
         prep_sec += calibration_sec
         # adjust on-target start time
-        start_time += timedelta(0, calibration_sec)
+        start_time += calibration_sec
 
         # is calibration target the same as science target?
-        obj1 = (ob.target.ra, ob.target.dec, ob.target.equinox)
-        obj2 = (tgt_cal.ra, tgt_cal.dec, tgt_cal.equinox)
-        if obj2 != obj1:
+        tgt_cal = static.tgt_cal
+        if tgt_cal is not None:
             # no!
             # find the time that calibration target begins to be visible
-            (obs_ok, t_start, t_stop) = site.observable(tgt_cal,
-                                                        start_time, slot.stop_time,
-                                                        min_el, max_el, calibration_sec,
-                                                        airmass=ob.envcfg.airmass,
-                                                        moon_sep=ob.envcfg.moon_sep)
+            (obs_ok, t_start, t_stop) = _observable(site, night, tgt_cal,
+                                                    static.cal_windows,
+                                                    start_time, slot.stop_epoch,
+                                                    calibration_sec, ob, static)
             if not obs_ok:
-                res.setvals(obs_ok=False,
-                    reason="Time or visibility of separate calibration target")
+                res.reason = Reason(R_SEP_CALIB_VISIBILITY)
                 return res
 
             # add slew time from calibration target to main target
-            c2 = ob.target.calc(site, start_time)
-            slew2_sec = calc_slew_time(c1.alt_deg, c1.az_deg, c2.alt_deg, c2.az_deg)
+            alt2_deg, az2_deg = _get_alt_az(site, night, ob.target,
+                                            start_time)
+            slew2_sec = calc_slew_time(alt1_deg, az_wrap_deg,
+                                       alt2_deg, az2_deg)
+            t_wrap = start_time
+            az_wrap_deg = calc_wrap_az(az_wrap_deg, az2_deg)
             #print("slew time from calib tgt to ob target is %f sec" % (slew2_sec))
 
             prep_sec += slew2_sec
             # adjust on-target start time
-            start_time += timedelta(0, slew2_sec)
+            start_time += slew2_sec
 
     # Check whether OB will fit in this slot
     ## delta = (slot.stop_time - start_time).total_seconds()
@@ -493,50 +1528,49 @@ def check_slot(site, prev_slot, slot, ob, check_moon=True, check_env=True):
 
     # find the time that this object begins to be visible
     # TODO: figure out the best place to split the slot
-    (obs_ok, t_start, t_stop) = site.observable(ob.target,
-                                                start_time, slot.stop_time,
-                                                min_el, max_el, ob.total_time,
-                                                airmass=ob.envcfg.airmass,
-                                                moon_sep=ob.envcfg.moon_sep)
+    (obs_ok, t_start, t_stop) = _observable(site, night, ob.target,
+                                            static.windows,
+                                            start_time, slot.stop_epoch,
+                                            ob.total_time, ob, static)
 
     if not obs_ok:
-        res.setvals(obs_ok=False,
-                    reason="Time or visibility of target")
+        res.reason = Reason(R_VISIBILITY)
         return res
 
     # calculate delay until we could actually start observing the object
     # in this slot
     if ob.envcfg.lower_time_limit is not None:
-        t_start = max(t_start, ob.envcfg.lower_time_limit)
+        t_start = max(t_start, _to_epoch(ob.envcfg.lower_time_limit, None))
 
-    delay_sec = (t_start - start_time).total_seconds()
+    delay_sec = t_start - start_time
 
-    stop_time = t_start + timedelta(0, ob.total_time)
+    stop_time = t_start + ob.total_time
 
     if ob.envcfg.upper_time_limit is not None:
-        t_stop = min(ob.envcfg.upper_time_limit, t_stop)
+        t_stop = min(_to_epoch(ob.envcfg.upper_time_limit, None), t_stop)
 
-    t_stop = min(t_stop, slot.stop_time)
+    t_stop = min(t_stop, slot.stop_epoch)
 
     if t_stop < stop_time:
-        res.setvals(obs_ok=False,
-                    reason="Not enough time in slot after all prep/delay")
+        res.reason = Reason(R_SLOT_TIME_PREP)
         return res
 
     # check moon constraints between start and stop time
     if check_moon:
-        obs_ok = check_moon_cond(site, t_start, stop_time, ob, res)
+        obs_ok = _check_moon_cached(site, t_start, stop_time, ob, res,
+                                    night, static)
     else:
         obs_ok = True
 
-    res.setvals(obs_ok=obs_ok, prev_ob=prev_ob,
-                prep_sec=prep_sec, slew_sec=slew_sec,
-                slew2_sec=slew2_sec,
-                filterchange=filterchange,
-                filterchange_sec=filterchange_sec,
-                calibration_sec=calibration_sec,
-                start_time=t_start, stop_time=stop_time,
-                delay_sec=delay_sec)
+    res.set_result(obs_ok=obs_ok, prev_ob=prev_ob,
+                   prep_sec=prep_sec, slew_sec=slew_sec,
+                   slew2_sec=slew2_sec,
+                   filterchange=filterchange,
+                   filterchange_sec=filterchange_sec,
+                   calibration_sec=calibration_sec,
+                   start_epoch=t_start, stop_epoch=stop_time,
+                   delay_sec=delay_sec,
+                   az_wrap=(t_wrap, float(az_wrap_deg)))
     return res
 
 
@@ -550,9 +1584,8 @@ def eval_schedule(schedule):
     for slot in schedule.slots:
         ob = slot.ob
         # TODO: fix up a more solid check for delays
-        if (ob == None) or ob.comment.startswith('Delay'):
-            delta = (slot.stop_time - slot.start_time).total_seconds()
-            time_waste_sec += delta
+        if (ob == None) or (derived_kind(ob) == D_DELAY):
+            time_waste_sec += slot.size()
             continue
         else:
             propID = str(ob.program)
@@ -0,0 +1,596 @@
+from __future__ import print_function
+import unittest
+import threading
+from datetime import timedelta
+import math
+import pytz
+
+import numpy as np
+import ephem
+
+from qplan import entity
+from qplan.util import calcpos
+
+
+        # RA           DEC          EQ
+vega = ("18:36:56.3", "+38:47:01", "2000")
+altair = ("19:51:29.74", "8:54:23.5", "2000")
+
+class TestCalcBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.targets = [entity.StaticTarget("vega", vega[0], vega[1]),
+                        entity.StaticTarget("altair", altair[0], altair[1])]
+        time1 = self.obs.get_date("2014-04-28 20:00")
+        self.dates = [time1 + timedelta(0, 1800*i) for i in range(20)]
+
+    def test_shape(self):
+        res = self.obs.calc_batch(self.targets, self.dates)
+        self.assertEqual(res.shape, (2, 20))
+        self.assertEqual(res.airmass.shape, (2, 20))
+        self.assertEqual(len(res.lt), 20)
+
+    def test_matches_calc(self):
+        res = self.obs.calc_batch(self.targets, self.dates)
+        for i, tgt in enumerate(self.targets):
+            for j, date in enumerate(self.dates):
+                c1 = self.obs.calc(tgt, date)
+                self.assertAlmostEqual(res.alt_deg[i, j], c1.alt_deg, 6)
+                self.assertAlmostEqual(res.az_deg[i, j], c1.az_deg, 6)
+                self.assertAlmostEqual(res.airmass[i, j], c1.airmass, 6)
+                self.assertAlmostEqual(res.ha[i, j], float(c1.ha), 6)
+                self.assertAlmostEqual(res.pang[i, j], float(c1.pang), 6)
+
+    def test_ssbody(self):
+        res = self.obs.calc_batch([calcpos.Moon], self.dates[:3])
+        c1 = self.obs.calc(calcpos.Moon, self.dates[1])
+        self.assertAlmostEqual(res.alt_deg[0, 1], c1.alt_deg, 6)
+
+
+class TestFixedTargetEngine(unittest.TestCase):
+    """Accuracy of the NumPy engine against pyephem."""
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        # a grid of targets over the sky visible from Mauna Kea
+        self.targets = []
+        for ra_deg in range(0, 360, 30):
+            for dec_deg in range(-60, 90, 15):
+                ra = ephem.hours(math.radians(ra_deg))
+                dec = ephem.degrees(math.radians(dec_deg))
+                name = "t%d%+d" % (ra_deg, dec_deg)
+                self.targets.append(entity.StaticTarget(name, str(ra),
+                                                        str(dec)))
+
+    def _compare(self, date_str):
+        time1 = self.obs.get_date(date_str)
+        dates = [time1 + timedelta(0, 600*i) for i in range(72)]
+        res1 = self.obs.calc_batch(self.targets, dates)
+        res2 = self.obs.calc_batch(self.targets, dates, engine='numpy')
+
+        d_alt = np.abs(res1.alt_deg - res2.alt_deg) * 3600.0
+        d_az = np.abs(np.mod(res1.az_deg - res2.az_deg + 180.0, 360.0) -
+                      180.0) * 3600.0
+        # altitude error within 2 arcsec above the horizon, and well
+        # under a minute of arc down to the refraction limit
+        self.assertTrue(d_alt[res1.alt_deg > 0.0].max() < 2.0)
+        self.assertTrue(d_alt[res1.alt_deg > -2.0].max() < 60.0)
+        # azimuth is ill-defined near the zenith
+        m = (res1.alt_deg > 0.0) & (res1.alt_deg < 85.0)
+        self.assertTrue(d_az[m].max() < 5.0)
+        # derived quantities follow
+        d_am = np.abs(res1.airmass - res2.airmass)
+        self.assertTrue(d_am[res1.alt_deg > 15.0].max() < 1.0e-4)
+
+    def test_spring(self):
+        self._compare("2014-04-28 17:00")
+
+    def test_autumn(self):
+        self._compare("2016-11-02 17:00")
+
+    def test_future(self):
+        self._compare("2030-01-15 17:00")
+
+    def test_hour_angle(self):
+        time1 = self.obs.get_date("2016-11-02 22:00")
+        engine = calcpos.FixedTargetEngine(self.obs, self.targets[:5], time1)
+        djd = self.obs._date_to_djd(time1)
+        site = self.obs.get_site(date=time1)
+        lst = engine.calc_lst(np.array([djd]))[0]
+        self.assertTrue(abs(lst - float(site.sidereal_time())) < 1.0e-9)
+
+    def test_ssbody_fallback(self):
+        time1 = self.obs.get_date("2016-11-02 22:00")
+        targets = [calcpos.Moon, self.targets[0]]
+        res1 = self.obs.calc_batch(targets, [time1])
+        res2 = self.obs.calc_batch(targets, [time1], engine='numpy')
+        self.assertEqual(res1.alt[0, 0], res2.alt[0, 0])
+        self.assertTrue(abs(res1.alt_deg[1, 0] - res2.alt_deg[1, 0]) < 0.001)
+
+
+class TestCalculationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.tgt = entity.StaticTarget("vega", vega[0], vega[1])
+        self.time1 = self.obs.get_date("2014-04-29 04:00")
+
+    def test_hit(self):
+        cache = self.obs.calc_cache
+        c1 = self.obs.calc(self.tgt, self.time1)
+        c2 = self.obs.calc(self.tgt, self.time1.astimezone(pytz.utc))
+        self.assertTrue(c1 is c2)
+        stats = cache.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_lazy(self):
+        c1 = self.obs.calc(self.tgt, self.time1)
+        self.assertTrue(c1._alt is None)
+        alt = c1.alt_deg
+        self.assertTrue(c1._alt is not None)
+        self.assertTrue(alt > 15.0)
+
+    def test_quantum(self):
+        cache = self.obs.calc_cache
+        cache.configure(quantum_sec=10.0)
+        c1 = self.obs.calc(self.tgt, self.time1 + timedelta(0, 2))
+        c2 = self.obs.calc(self.tgt, self.time1 - timedelta(0, 2))
+        self.assertTrue(c1 is c2)
+        self.assertEqual(c1.ut, self.time1)
+
+    def test_eviction(self):
+        cache = self.obs.calc_cache
+        cache.configure(maxsize=5)
+        for i in range(10):
+            self.obs.calc(self.tgt, self.time1 + timedelta(0, i))
+        self.assertEqual(cache.get_stats()['size'], 5)
+        # most recent entry is still cached
+        self.obs.calc(self.tgt, self.time1 + timedelta(0, 9))
+        self.assertEqual(cache.get_stats()['hits'], 1)
+
+
+class TestObserverThreads(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.targets = [entity.StaticTarget("vega", vega[0], vega[1]),
+                        entity.StaticTarget("altair", altair[0], altair[1])]
+        time1 = self.obs.get_date("2014-04-28 20:00")
+        self.dates = [time1 + timedelta(0, 60*i) for i in range(200)]
+
+    def _calc_all(self, offset):
+        res = []
+        for i in range(len(self.dates)):
+            date = self.dates[(i + offset) % len(self.dates)]
+            for tgt in self.targets:
+                c = self.obs.calc(tgt, date)
+                res.append((date, tgt.name, c.alt, c.az, c.moon_alt))
+        return sorted(res)
+
+    def test_concurrent_calc(self):
+        expected = self._calc_all(0)
+        self.obs.calc_cache.clear()
+        results = {}
+
+        def calc(i):
+            results[i] = self._calc_all(i * 37)
+
+        threads = [threading.Thread(target=calc, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(4):
+            self.assertEqual(results[i], expected)
+
+    def test_site_not_disturbed(self):
+        djd = float(self.obs.site.date)
+        self.obs.calc(self.targets[0], self.dates[5]).alt
+        self.obs.moon_phase(self.dates[5])
+        self.obs.moon_rise(self.dates[5])
+        self.assertEqual(float(self.obs.site.date), djd)
+
+
+class TestElevationWindowSolver(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.targets = [entity.StaticTarget("vega", vega[0], vega[1]),
+                        entity.StaticTarget("altair", altair[0], altair[1]),
+                        # passes within half a degree of the zenith
+                        entity.StaticTarget("zenith", "18:00:00",
+                                            "+20:20:00")]
+        self.night_start = self.obs.get_date("2014-04-28 19:00")
+        self.night_stop = self.obs.get_date("2014-04-29 12:00")
+        self.solver = calcpos.ElevationWindowSolver(self.obs,
+                                                    self.night_start,
+                                                    self.night_stop)
+
+    def test_airmass2alt(self):
+        for am in (1.05, 1.2, 1.5, 2.0, 3.0):
+            alt_deg = calcpos.airmass2alt(am)
+            self.assertAlmostEqual(calcpos.alt2airmass(alt_deg), am, 9)
+        self.assertEqual(calcpos.airmass2alt(1.0), 90.0)
+        self.assertEqual(calcpos.airmass2alt(50.0), 0.0)
+
+    def test_matches_ephem(self):
+        results = self.solver.solve(self.targets, 30.0)
+        site = self.obs.get_site(date=self.obs.date, horizon_deg=30.0)
+        for tgt, (rises, sets) in zip(self.targets, results):
+            self.assertEqual(len(rises), 1)
+            site.date = self.solver.djd_start
+            t_rise = float(site.next_rising(tgt.body._body))
+            t_set = float(site.next_setting(tgt.body._body))
+            self.assertTrue(abs(rises[0] - t_rise) * 86400.0 < 1.0)
+            self.assertTrue(abs(sets[0] - t_set) * 86400.0 < 1.0)
+
+    def test_zenith_avoidance(self):
+        rises1, sets1 = self.solver.solve(self.targets[2:], 30.0)[0]
+        rises2, sets2 = self.solver.solve(self.targets[2:], 30.0, 89.0)[0]
+        self.assertEqual(len(rises1), 1)
+        # window is split around the transit
+        self.assertEqual(len(rises2), 2)
+        self.assertAlmostEqual(rises1[0], rises2[0], 6)
+        self.assertAlmostEqual(sets1[0], sets2[1], 6)
+        site = self.obs.get_site(date=self.obs.date)
+        body = self.targets[2].body._body
+        for djd in (sets2[0], rises2[1]):
+            site.date = djd
+            body.compute(site)
+            self.assertAlmostEqual(math.degrees(body.alt), 89.0, 3)
+        site.date = 0.5 * (sets2[0] + rises2[1])
+        body.compute(site)
+        self.assertTrue(math.degrees(body.alt) > 89.0)
+
+    def test_observable_max_el(self):
+        tgt = self.targets[2]
+        time1 = self.obs.get_date("2014-04-29 02:00")
+        time2 = self.obs.get_date("2014-04-29 06:00")
+        res1 = self.obs.observable(tgt, time1, time2, 15.0, 90.0, 3600)
+        res2 = self.obs.observable(tgt, time1, time2, 15.0, 89.0, 3600)
+        self.assertTrue(res1[0])
+        self.assertEqual(res1[2], time2)
+        self.assertTrue(res2[2] < time2)
+
+    def test_observable_split_window(self):
+        # the window before the transit is too short, the one after it
+        # is long enough
+        tgt = self.targets[2]
+        rises, sets = self.solver.solve([tgt], 15.0, 89.0)[0]
+        self.assertEqual(len(rises), 2)
+        djd1 = sets[0] - 600.0 / 86400.0
+        djd2 = rises[1] + 7200.0 / 86400.0
+        time1 = self.obs.date_to_local(ephem.Date(djd1).datetime())
+        time2 = self.obs.date_to_local(ephem.Date(djd2).datetime())
+        res = self.obs.observable(tgt, time1, time2, 15.0, 89.0, 3600)
+        self.assertTrue(res[0])
+        self.assertTrue(abs(self.obs._date_to_djd(res[1]) - rises[1]) *
+                        86400.0 < 1.0)
+        self.assertEqual(res[2], time2)
+        # too long for either window
+        res = self.obs.observable(tgt, time1, time2, 15.0, 89.0, 7300)
+        self.assertFalse(res[0])
+
+        vis = self.obs.get_visibility_index(self.night_start,
+                                            self.night_stop)
+        windows = vis.get_intervals(tgt, 15.0, 89.0)
+        t1, t2 = calcpos.djd_to_epoch(djd1), calcpos.djd_to_epoch(djd2)
+        can_obs, t_rise, t_end = vis.observable_windows(windows, t1, t2, 3600)
+        self.assertTrue(can_obs)
+        self.assertAlmostEqual(t_rise, calcpos.djd_to_epoch(rises[1]), 3)
+        self.assertEqual(t_end, t2)
+
+    def test_ssbody(self):
+        rises, sets = self.solver.solve([calcpos.Moon], 10.0)[0]
+        self.assertEqual(len(rises), 1)
+        site = self.obs.get_site(date=self.obs.date)
+        moon = ephem.Moon()
+        for djd in (rises[0], sets[0]):
+            if self.solver.djd_start < djd < self.solver.djd_stop:
+                site.date = djd
+                moon.compute(site)
+                self.assertAlmostEqual(math.degrees(moon.alt), 10.0, 3)
+
+
+class TestTargetTrack(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.tgt = entity.StaticTarget("vega", vega[0], vega[1])
+        self.time1 = self.obs.get_date("2014-04-28 19:00")
+        self.time2 = self.obs.get_date("2014-04-29 06:00")
+
+    def test_matches_calc(self):
+        track = self.obs.get_target_info(self.tgt, time_start=self.time1,
+                                         time_stop=self.time2)
+        self.assertTrue(len(track) > 100)
+        for i in range(0, len(track), 10):
+            c1 = self.obs.calc(self.tgt, track.ut[i])
+            self.assertEqual(track.lt[i], c1.lt)
+            self.assertTrue(abs(track.alt_deg[i] - c1.alt_deg) < 0.01)
+            self.assertTrue(abs(track.airmass[i] - c1.airmass) < 0.001)
+            self.assertTrue(abs(track.moon_alt[i] - c1.moon_alt) < 0.01)
+            self.assertTrue(abs(track.ha[i] - float(c1.ha)) < 0.001)
+
+    def test_slice(self):
+        track = self.obs.get_target_info(self.tgt, time_start=self.time1,
+                                         time_stop=self.time2)
+        track2 = track[:20]
+        self.assertEqual(len(track2), 20)
+        self.assertEqual(len(track2.airmass), 20)
+        self.assertEqual(track2.ut, track.ut[:20])
+
+    def test_table(self):
+        text = self.obs.get_target_info_table(self.tgt, time_start=self.time1,
+                                              time_stop=self.time2)
+        lines = text.split('\n')
+        self.assertTrue(lines[0].startswith('Date       Local'))
+        self.assertTrue(len(lines) > 100)
+
+
+class TestVisibilityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.tgt = entity.StaticTarget("vega", vega[0], vega[1])
+        night_start = self.obs.get_date("2014-04-28 19:00")
+        night_stop = self.obs.get_date("2014-04-29 12:00")
+        self.vis = self.obs.get_visibility_index(night_start, night_stop)
+
+    def _compare(self, t1, t2, time_needed, airmass=None):
+        time1 = self.obs.get_date(t1)
+        time2 = self.obs.get_date(t2)
+        res1 = self.obs.observable(self.tgt, time1, time2, 15.0, 85.0,
+                                   time_needed, airmass=airmass)
+        res2 = self.vis.observable(self.tgt, time1, time2, 15.0, 85.0,
+                                   time_needed, airmass=airmass)
+        self.assertEqual(res1[0], res2[0])
+        if res1[0]:
+            self.assertTrue(abs((res1[1] - res2[1]).total_seconds()) < 1.0)
+            self.assertTrue(abs((res1[2] - res2[2]).total_seconds()) < 1.0)
+
+    def test_rising(self):
+        self._compare("2014-04-28 22:00", "2014-04-28 23:00", 60*15)
+        self._compare("2014-04-28 22:00", "2014-04-28 23:00", 60*16)
+
+    def test_up(self):
+        self._compare("2014-04-29 04:00", "2014-04-29 05:00", 59.9*60)
+        self._compare("2014-04-28 23:30", "2014-04-29 05:00", 3600,
+                      airmass=1.5)
+
+    def test_setting(self):
+        self._compare("2014-04-29 10:00", "2014-04-29 11:00", 60*14)
+        self._compare("2014-04-29 10:00", "2014-04-29 11:00", 60*15)
+        self._compare("2014-04-29 11:00", "2014-04-29 12:00", 60*1)
+
+    def test_intervals_shared(self):
+        tgt2 = entity.StaticTarget("vega2", vega[0], vega[1])
+        ivals1 = self.vis.get_intervals(self.tgt, 15.0)
+        ivals2 = self.vis.get_intervals(tgt2, 15.0)
+        self.assertTrue(ivals1 is ivals2)
+        self.assertEqual(len(ivals1[0]), 1)
+
+    def test_precompute(self):
+        tgt2 = entity.StaticTarget("altair", altair[0], altair[1])
+        self.vis.precompute([self.tgt, tgt2], [15.0, 30.0], 89.0)
+        self.assertEqual(len(self.vis._intervals), 2)
+        ivals = self.vis.get_intervals(tgt2, 30.0, 89.0)
+        self.assertEqual(len(self.vis._intervals), 2)
+        self.assertEqual(ivals, self.vis.solver.solve([tgt2], 30.0, 89.0)[0])
+
+
+class TestAltAzTable(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.targets = [entity.StaticTarget("vega", vega[0], vega[1]),
+                        entity.StaticTarget("altair", altair[0], altair[1]),
+                        calcpos.Moon]
+        night_start = self.obs.get_date("2014-05-10 19:00")
+        night_stop = self.obs.get_date("2014-05-11 06:00")
+        self.altaz = self.obs.get_altaz_table(night_start, night_stop)
+
+    def test_matches_calc(self):
+        self.altaz.add_targets(self.targets)
+        for hr in (0.0, 1.3, 5.55, 10.9, 11.0):
+            time1 = self.altaz.time_start + timedelta(0, 3600*hr)
+            for tgt in self.targets:
+                c = self.obs.calc(tgt, time1)
+                if c.alt_deg < 0.0:
+                    # refraction models differ below the horizon
+                    continue
+                alt, az = self.altaz.calc(tgt, time1)
+                self.assertTrue(abs(alt - c.alt_deg) < 0.02)
+                d_az = (az - c.az_deg + 180.0) % 360.0 - 180.0
+                self.assertTrue(abs(d_az) < 0.05)
+
+    def test_outside(self):
+        time1 = self.altaz.time_stop + timedelta(0, 60)
+        self.assertEqual(self.altaz.calc(self.targets[0], time1), None)
+
+    def test_index(self):
+        idx = self.altaz.get_index(self.targets[1:])
+        self.assertEqual(list(idx), [0, 1])
+        tgt2 = entity.StaticTarget("vega2", vega[0], vega[1])
+        idx = self.altaz.get_index([tgt2, self.targets[1]])
+        self.assertEqual(list(idx), [2, 0])
+
+    def test_add_one_at_a_time(self):
+        targets = [entity.StaticTarget("t%d" % i, "%02d:00:00" % i,
+                                       "+%02d:00:00" % (i * 3))
+                   for i in range(20)]
+        altaz = self.obs.get_altaz_table(self.altaz.time_start,
+                                         self.altaz.time_stop)
+        for tgt in targets:
+            altaz.add_targets([tgt])
+        # the table grows by doubling
+        self.assertEqual(len(altaz.alt_deg), 32)
+
+        self.altaz.add_targets(targets)
+        djd = self.altaz.t_djd[[0, 100, -1]]
+        for tgt in targets:
+            alt1, az1 = altaz.alt_az(altaz.get_index([tgt])[0], djd)
+            alt2, az2 = self.altaz.alt_az(self.altaz.get_index([tgt])[0],
+                                          djd)
+            self.assertTrue(np.allclose(alt1, alt2))
+            self.assertTrue(np.allclose(az1, az2))
+
+
+class TestMoonTable(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.targets = [entity.StaticTarget("vega", vega[0], vega[1]),
+                        entity.StaticTarget("altair", altair[0], altair[1])]
+        night_start = self.obs.get_date("2014-05-10 19:00")
+        night_stop = self.obs.get_date("2014-05-11 06:00")
+        self.moon = self.obs.get_moon_table(night_start, night_stop)
+        self.dates = [night_start + timedelta(0, 1234*i) for i in range(32)]
+
+    def test_matches_calc(self):
+        djd = np.array([self.obs._date_to_djd(d) for d in self.dates])
+        moon_alt = self.moon.moon_alt(djd)
+        moon_pct = self.moon.moon_pct(djd)
+        for tgt in self.targets:
+            moon_sep = self.moon.moon_sep(tgt, djd)
+            for i, date in enumerate(self.dates):
+                c1 = self.obs.calc(tgt, date)
+                self.assertTrue(abs(moon_alt[i] - c1.moon_alt) < 0.05)
+                self.assertTrue(abs(moon_pct[i] - c1.moon_pct) < 0.001)
+                self.assertTrue(abs(moon_sep[i] - c1.moon_sep) < 0.05)
+
+    def test_sample_times(self):
+        djd = self.moon.get_sample_times(self.dates[1], self.dates[4])
+        self.assertEqual(djd[0], self.obs._date_to_djd(self.dates[1]))
+        self.assertEqual(djd[-1], self.obs._date_to_djd(self.dates[4]))
+        self.assertTrue(np.all(np.diff(djd) >= 0.0))
+        # 1234*3 sec is covered by at least 12 grid points of 5 min
+        self.assertTrue(len(djd) >= 14)
+
+
+class TestAlmanac(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.dates = [self.obs.get_date("2014-04-%02d %02d:17" % (d, h))
+                      for d in range(1, 5) for h in (0, 7, 13, 19, 23)]
+
+    def _direct(self, date, horizon, rising):
+        site = self.obs.get_site(date=date)
+        site.horizon = horizon
+        if rising:
+            r_date = site.next_rising(ephem.Sun())
+        else:
+            r_date = site.next_setting(ephem.Sun())
+        return self.obs.date_to_local(r_date.datetime())
+
+    def test_matches_ephem(self):
+        for date in self.dates:
+            for name, (attr, rising) in calcpos.Almanac.event_defs.items():
+                horizon = getattr(self.obs, attr)
+                t1 = getattr(self.obs, name)(date)
+                t2 = self._direct(date, horizon, rising)
+                self.assertTrue(abs((t1 - t2).total_seconds()) < 1.0)
+
+    def test_no_side_effects(self):
+        djd = float(self.obs.site.date)
+        horizon = float(self.obs.site.horizon)
+        self.obs.sun_set_rise_times(self.dates[0])
+        self.assertEqual(float(self.obs.site.date), djd)
+        self.assertEqual(float(self.obs.site.horizon), horizon)
+
+    def test_threads(self):
+        expected = [self.obs.sun_set_rise_times(date) for date in self.dates]
+        # start over with an empty almanac
+        self.obs.almanac = calcpos.Almanac(self.obs)
+        results = {}
+
+        def calc(i):
+            results[i] = [self.obs.sun_set_rise_times(date)
+                          for date in self.dates]
+
+        threads = [threading.Thread(target=calc, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(4):
+            self.assertEqual(results[i], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
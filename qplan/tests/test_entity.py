@@ -0,0 +1,157 @@
+from __future__ import print_function
+import unittest
+import random
+from datetime import timedelta
+
+from qplan import entity
+from qplan.util import site
+
+
+class TestSlot(unittest.TestCase):
+
+    def setUp(self):
+        self.obs = site.get_site('subaru')
+        self.start = self.obs.get_date("2016-11-20 19:00")
+
+    def test_times(self):
+        slot = entity.Slot(self.start, 600.5)
+        self.assertEqual(slot.start_time, self.start)
+        self.assertEqual(slot.stop_time, self.start + timedelta(0, 600.5))
+        self.assertEqual(slot.size(), 600.5)
+
+        # made from seconds since the epoch, in the same timezone
+        slot2 = entity.Slot(slot.start_epoch + 60, 30, tz=slot.tz)
+        self.assertEqual(slot2.start_time, self.start + timedelta(0, 60))
+        self.assertEqual(slot2.start_time.utcoffset(),
+                         self.start.utcoffset())
+
+    def test_split(self):
+        slot = entity.Slot(self.start, 3600)
+        for start in (self.start + timedelta(0, 600),
+                      slot.start_epoch + 600):
+            slot_b, slot_c, slot_d = slot.split(start, 1200)
+            self.assertEqual(slot_b.start_time, self.start)
+            self.assertEqual(slot_b.size(), 600)
+            self.assertEqual(slot_c.start_time,
+                             self.start + timedelta(0, 600))
+            self.assertEqual(slot_c.size(), 1200)
+            self.assertEqual(slot_d.stop_time, slot.stop_time)
+            self.assertEqual(slot_d.size(), 1800)
+
+        self.assertRaises(entity.SlotError, slot.split,
+                          slot.start_epoch + 3000, 1200)
+
+
+class TestSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.obs = site.get_site('subaru')
+        self.start = self.obs.get_date("2016-11-20 19:00")
+        self.stop = self.obs.get_date("2016-11-21 05:00")
+
+    def _slot(self, offset_min, len_min):
+        return entity.Slot(self.start + timedelta(0, offset_min * 60),
+                           len_min * 60)
+
+    def _previous(self, schedule, slot):
+        # reference: linear scan
+        prev = None
+        for slot_i in schedule.slots:
+            if slot_i.start_time > slot.start_time:
+                break
+            prev = slot_i
+        return prev
+
+    def test_insert(self):
+        schedule = entity.Schedule(self.start, self.stop)
+        # out of order, with gaps
+        for offset in (60, 0, 300, 120, 30):
+            schedule.insert_slot(self._slot(offset, 20))
+        starts = [slot.start_time for slot in schedule.slots]
+        self.assertEqual(starts, sorted(starts))
+        self.assertEqual(schedule.num_slots(), 5)
+        self.assertEqual(schedule.get_waste(), (600 - 5 * 20) * 60.0)
+
+        for offset in (-10, 0, 10, 30, 45, 120, 299, 300, 500):
+            slot = self._slot(offset, 1)
+            self.assertTrue(schedule.get_previous(slot) is
+                            self._previous(schedule, slot))
+            nxt = schedule.get_next(slot)
+            later = [slot_i for slot_i in schedule.slots
+                     if slot_i.start_time > slot.start_time]
+            if len(later) == 0:
+                self.assertTrue(nxt is None)
+            else:
+                self.assertTrue(nxt is later[0])
+
+    def test_overlap(self):
+        schedule = entity.Schedule(self.start, self.stop)
+        schedule.insert_slot(self._slot(0, 20))
+        self.assertRaises(AssertionError, schedule.insert_slot,
+                          self._slot(10, 20))
+
+    def test_insert_bundle(self):
+        schedule = entity.Schedule(self.start, self.stop)
+        schedule.insert_slot(self._slot(0, 10))
+        schedule.insert_slot(self._slot(100, 10))
+        bundle = [self._slot(10, 1), self._slot(11, 5), self._slot(16, 30)]
+        schedule.insert_bundle(bundle)
+        self.assertEqual(schedule.slots[1:4], bundle)
+        self.assertEqual(schedule.get_previous(self._slot(50, 1)),
+                         bundle[-1])
+        self.assertEqual(schedule.get_waste(), (600 - 56) * 60.0)
+
+        # slots of a bundle must not overlap each other
+        bundle = [self._slot(200, 10), self._slot(205, 10)]
+        self.assertRaises(AssertionError, schedule.insert_bundle, bundle)
+
+    def test_many_slots(self):
+        # enough slots to be kept in several chunks
+        schedule = entity.Schedule(self.start, self.stop)
+        offsets = list(range(0, 600, 3))
+        random.Random(2).shuffle(offsets)
+        for offset in offsets:
+            schedule.insert_slot(self._slot(offset, 2))
+        self.assertEqual(schedule.num_slots(), len(offsets))
+        starts = [slot.start_time for slot in schedule.slots]
+        self.assertEqual(starts, sorted(starts))
+
+        for offset in (-1, 0, 1, 100, 299, 300, 301, 597, 598, 700):
+            slot = self._slot(offset, 1)
+            self.assertTrue(schedule.get_previous(slot) is
+                            self._previous(schedule, slot))
+
+    def test_copy(self):
+        schedule = entity.Schedule(self.start, self.stop)
+        for offset in range(0, 300, 3):
+            schedule.insert_slot(self._slot(offset, 2))
+        slots = schedule.slots
+
+        snapshot = schedule.copy()
+        self.assertEqual(snapshot.slots, slots)
+        self.assertEqual(snapshot.get_waste(), schedule.get_waste())
+
+        # changes to either one are not seen by the other
+        schedule.insert_slot(self._slot(400, 10))
+        snapshot.insert_slot(self._slot(2, 1))
+        snapshot.insert_slot(self._slot(500, 10))
+        self.assertEqual(schedule.num_slots(), len(slots) + 1)
+        self.assertEqual(snapshot.num_slots(), len(slots) + 2)
+        self.assertEqual(schedule.slots[:-1], slots)
+        self.assertEqual(snapshot.slots[0], slots[0])
+        self.assertEqual(snapshot.slots[2:-1], slots[1:])
+        self.assertEqual(schedule.get_next(self._slot(300, 1)).start_time,
+                         self.start + timedelta(0, 400 * 60))
+        self.assertEqual(snapshot.get_next(self._slot(300, 1)).start_time,
+                         self.start + timedelta(0, 500 * 60))
+
+        # snapshots of snapshots
+        snapshot2 = snapshot.copy()
+        snapshot2.insert_slot(self._slot(550, 10))
+        self.assertEqual(snapshot.num_slots(), len(slots) + 2)
+        self.assertEqual(snapshot2.num_slots(), len(slots) + 3)
+        self.assertEqual(schedule.num_slots(), len(slots) + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
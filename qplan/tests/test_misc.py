@@ -150,6 +150,22 @@ class TestEntity01(unittest.TestCase):
     ##         print "%s  %s  %f" % (c1.lt.strftime("%H:%M"),
     ##                               c1.ut.strftime("%H:%M"), c1.airmass)
 
+    def test_body_interned(self):
+        tgt1 = entity.StaticTarget("vega", vega[0], vega[1])
+        tgt2 = entity.StaticTarget("alpha Lyr", vega[0], vega[1])
+        tgt3 = entity.StaticTarget("altair", altair[0], altair[1])
+        self.assert_(tgt1._body is None)
+        self.assert_(tgt1.body is tgt2.body)
+        self.assert_(tgt1.body is not tgt3.body)
+
+    def test_target_pickle(self):
+        import pickle
+        tgt1 = entity.StaticTarget("vega", vega[0], vega[1])
+        body = tgt1.body
+        tgt2 = pickle.loads(pickle.dumps(tgt1))
+        self.assert_(tgt2._body is None)
+        self.assert_(tgt2.body is body)
+
     def test_slot_split(self):
         time1 = self.obs.get_date("2010-10-18 21:00")
         time2 = self.obs.get_date("2010-10-18 21:30")
@@ -0,0 +1,565 @@
+from __future__ import print_function
+import unittest
+from datetime import timedelta, datetime
+import random
+import pytz
+import numpy as np
+
+from ginga.misc import Bunch
+
+from qplan import entity, qsim
+from qplan.util import calcpos
+
+
+class TestOBTable(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.time1 = self.obs.get_date("2016-11-02 19:00")
+        rnd = random.Random(1)
+
+        pgm = entity.Program('S16B-001', rank=5.0, category='open',
+                             hours=10.0)
+        self.oblist = []
+        for i in range(200):
+            tgt = entity.HSCTarget(name='t%d' % i, ra="%02d:00:00" % (i % 24),
+                                   dec="+%02d:00:00" % (i % 60))
+            telcfg = entity.TelescopeConfiguration(focus='P_OPT2',
+                                                   dome=rnd.choice(['open',
+                                                                    'closed']))
+            inscfg = entity.HSCConfiguration(filter=rnd.choice(['g', 'r']))
+            lower = rnd.choice([None, self.time1 + timedelta(0, 3600*5)])
+            upper = rnd.choice([None, self.time1 + timedelta(0, 3600*2)])
+            envcfg = entity.EnvironmentConfiguration(
+                seeing=rnd.choice([None, 0.8, 1.2]),
+                transparency=rnd.choice([None, 0.5, 0.9]),
+                lower_time_limit=lower, upper_time_limit=upper)
+            ob = entity.OB(program=pgm, target=tgt, telcfg=telcfg,
+                           inscfg=inscfg, envcfg=envcfg,
+                           total_time=rnd.choice([600, 3600, 7200]))
+            self.oblist.append(ob)
+
+    def _make_slot(self, offset_hr, dur_hr, dome):
+        slot = entity.Slot(self.time1 + timedelta(0, 3600*offset_hr),
+                           3600*dur_hr)
+        slot.data = Bunch.Bunch(dome=dome, seeing=1.0, transparency=0.7,
+                                cur_filter='g', cur_az=-90.0, cur_el=89.0)
+        return slot
+
+    def test_prefilter(self):
+        table = qsim.OBTable(self.oblist)
+        oblist = self.oblist[10:150]
+        for offset, dur in ((0, 1), (1, 1.5), (3, 4), (6, 0.5)):
+            for dome in ('open', 'closed'):
+                slot = self._make_slot(offset, dur, dome)
+                mask = table.prefilter(slot, oblist)
+                self.assertEqual(len(mask), len(oblist))
+                for ob, ok in zip(oblist, mask):
+                    res = qsim.check_slot_gates(slot, ob)
+                    self.assertEqual(ok, res is None)
+
+    def test_prefilter_elevation(self):
+        night = qsim.prepare_night(self.obs, self.time1,
+                                   self.time1 + timedelta(0, 3600*11),
+                                   oblist=self.oblist)
+        table = night.obtable
+        num_past = 0
+        for offset, dur in ((0, 1), (3, 4), (8, 3), (10, 1)):
+            slot = self._make_slot(offset, dur, 'open')
+            mask = table.prefilter(slot, self.oblist, check_env=False)
+            for ob, ok in zip(self.oblist, mask):
+                res = qsim.check_slot_gates(slot, ob, check_env=False,
+                                            night=night)
+                self.assertEqual(ok, res is None)
+                if (res is not None) and (res.reason.code == qsim.R_VISIBILITY):
+                    num_past += 1
+        # some targets have set for good by the later slots
+        self.assertTrue(num_past > 0)
+
+
+class TestOBPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pgms = [entity.Program('S16B-%03d' % i, rank=float(i),
+                                    hours=10.0, category='open')
+                     for i in range(1, 4)]
+        self.oblist = [entity.OB(program=self.pgms[i % 3], target=None,
+                                 telcfg=None, inscfg=None, envcfg=None,
+                                 total_time=600, name='ob%d' % i)
+                       for i in range(12)]
+
+    def test_order(self):
+        pool = qsim.OBPool(self.oblist)
+        self.assertEqual(len(pool), len(self.oblist))
+        self.assertEqual(list(pool), self.oblist)
+        # adding an OB again does not move it
+        pool.add(self.oblist[0])
+        self.assertEqual(list(pool), self.oblist)
+
+    def test_remove(self):
+        pool = qsim.OBPool(self.oblist)
+        pool.remove(self.oblist[4])
+        pool.discard(self.oblist[7])
+        pool.discard(self.oblist[7])
+        expected = [ob for i, ob in enumerate(self.oblist)
+                    if i not in (4, 7)]
+        self.assertEqual(list(pool), expected)
+        self.assertFalse(self.oblist[4] in pool)
+        self.assertTrue(self.oblist[5] in pool)
+        self.assertRaises(KeyError, pool.remove, self.oblist[4])
+        # the pool has its own copy of the OBs
+        self.assertEqual(len(self.oblist), 12)
+
+        # removed OBs are added at the end
+        pool.add(self.oblist[4])
+        self.assertEqual(list(pool), expected + [self.oblist[4]])
+
+    def test_empty(self):
+        pool1, pool2 = qsim.OBPool(), qsim.OBPool()
+        pool1.add(self.oblist[0])
+        self.assertEqual(list(pool1), self.oblist[:1])
+        self.assertEqual(len(pool2), 0)
+
+    def test_programs(self):
+        pool = qsim.OBPool(self.oblist)
+        pool.remove(self.oblist[3])
+        pgmname = str(self.pgms[0])
+        self.assertEqual(pool.get_program(pgmname),
+                         [self.oblist[i] for i in (0, 6, 9)])
+        self.assertEqual(pool.count(pgmname), 3)
+        self.assertEqual(pool.get_program('S16B-999'), [])
+        self.assertEqual(pool.count('S16B-999'), 0)
+
+    def test_copy(self):
+        pool = qsim.OBPool(self.oblist)
+        pool2 = pool.copy()
+        pool2.remove(self.oblist[0])
+        self.assertEqual(len(pool), len(self.oblist))
+        self.assertEqual(pool.count(str(self.pgms[0])), 4)
+        self.assertEqual(pool2.count(str(self.pgms[0])), 3)
+
+
+class TestDerivedOB(unittest.TestCase):
+
+    def setUp(self):
+        pgm = entity.Program('S16B-001', rank=5.0, hours=10.0,
+                             category='open')
+        tgt = entity.HSCTarget(name='t1', ra="01:00:00", dec="+10:00:00")
+        calib_tgt = entity.HSCTarget(name='std1', ra="02:00:00",
+                                     dec="+20:00:00")
+        self.ob = entity.OB(program=pgm, target=tgt,
+                            telcfg=entity.TelescopeConfiguration(
+                                focus='P_OPT2'),
+                            inscfg=entity.HSCConfiguration(filter='r'),
+                            envcfg=entity.EnvironmentConfiguration(),
+                            total_time=1800, name='ob1', comment='deep',
+                            calib_tgtcfg=calib_tgt,
+                            calib_inscfg=entity.HSCConfiguration(
+                                filter='r', exp_time=10))
+
+    def _make_ob(self, kind, total_time):
+        # the full OB for a derived OB of `kind`
+        if kind == qsim.D_LONGSLEW:
+            return qsim.longslew_ob(self.ob, self.ob, total_time)
+        return full_ob_fns[kind](self.ob, total_time)
+
+    def test_attributes(self):
+        for kind in derived_kinds:
+            dob = qsim.DerivedOB(kind, self.ob, 120.0)
+            ob = self._make_ob(kind, 120.0)
+            self.assertTrue(dob.derived and ob.derived)
+            self.assertEqual(dob.comment, ob.comment)
+            self.assertEqual(dob.total_time, ob.total_time)
+            # not charged to the program
+            self.assertEqual(dob.acct_time, 0.0)
+            self.assertTrue(dob.program is ob.program)
+            self.assertTrue(dob.target is ob.target)
+            self.assertTrue(dob.telcfg is ob.telcfg)
+            self.assertTrue(dob.envcfg is ob.envcfg)
+            self.assertEqual(dob.inscfg.filter, ob.inscfg.filter)
+            self.assertEqual(dob.inscfg.exp_time, ob.inscfg.exp_time)
+            self.assertTrue(dob.orig_ob is self.ob)
+
+    def test_kind(self):
+        for kind in derived_kinds:
+            dob = qsim.DerivedOB(kind, self.ob, 120.0)
+            self.assertEqual(qsim.derived_kind(dob), kind)
+            self.assertEqual(qsim.derived_kind(self._make_ob(kind, 120.0)),
+                             kind)
+        self.assertEqual(qsim.derived_kind(self.ob), None)
+
+    def test_calibration30_inscfg(self):
+        count = entity.OB.count
+        night = Bunch.Bunch(calibration30_inscfgs={})
+        inscfg1 = qsim.calibration30_inscfg(self.ob, night=night)
+        inscfg2 = qsim.calibration30_inscfg(self.ob, night=night)
+        self.assertEqual(inscfg1.exp_time, 30.0)
+        # shared on the night, and made without making a full OB
+        self.assertTrue(inscfg1 is inscfg2)
+        self.assertEqual(entity.OB.count, count)
+
+        dob = qsim.DerivedOB(qsim.D_CALIBRATION30, self.ob, 60.0,
+                             inscfg=inscfg1)
+        self.assertTrue(dob.inscfg is inscfg1)
+        dob = qsim.DerivedOB(qsim.D_CALIBRATION30, self.ob, 60.0)
+        self.assertEqual(dob.inscfg.exp_time, 30.0)
+        self.assertEqual(dob.inscfg.filter, self.ob.inscfg.filter)
+
+    def test_pickle(self):
+        import pickle
+        dob = qsim.DerivedOB(qsim.D_DELAY, self.ob, 300.0)
+        dob2 = pickle.loads(pickle.dumps(dob))
+        self.assertEqual(dob2.kind, qsim.D_DELAY)
+        self.assertEqual(dob2.total_time, 300.0)
+        self.assertEqual(dob2.comment, dob.comment)
+
+derived_kinds = list(range(len(qsim.derived_defs)))
+
+# kind -> function making the full derived OB (except for D_LONGSLEW)
+full_ob_fns = {qsim.D_SETUP: qsim.setup_ob,
+               qsim.D_FILTERCHANGE: qsim.filterchange_ob,
+               qsim.D_DELAY: qsim.delay_ob,
+               qsim.D_CALIBRATION: qsim.calibration_ob,
+               qsim.D_CALIBRATION30: qsim.calibration30_ob,
+               qsim.D_TEARDOWN: qsim.teardown_ob}
+
+
+class TestReason(unittest.TestCase):
+
+    def test_format(self):
+        reason = qsim.Reason(qsim.R_SEEING, 1.2, 0.8)
+        self.assertEqual(reason.code, qsim.R_SEEING)
+        self.assertEqual(reason.args, (1.2, 0.8))
+        self.assertEqual(reason.name, 'seeing')
+        self.assertEqual(str(reason),
+                         "Seeing (1.200000 > 0.800000) not acceptable")
+        self.assertEqual(str(qsim.Reason(qsim.R_VISIBILITY)),
+                         "Time or visibility of target")
+
+    def test_pickle(self):
+        import pickle
+        reason = qsim.Reason(qsim.R_DOME_SLOT, 'open', 'closed')
+        reason2 = pickle.loads(pickle.dumps(reason))
+        self.assertEqual(reason, reason2)
+        self.assertEqual(str(reason), str(reason2))
+
+    def test_defs(self):
+        for code in range(len(qsim.reason_defs)):
+            self.assertTrue(code in qsim.reason_defs)
+
+
+class TestInvariantTable(unittest.TestCase):
+
+    def setUp(self):
+        hst = pytz.timezone('US/Hawaii')
+        self.time1 = hst.localize(datetime(2016, 11, 2, 19, 0))
+        self.time2 = hst.localize(datetime(2016, 11, 3, 6, 0))
+        rnd = random.Random(2)
+        pgms = [entity.Program('S16B-%03d' % i, rank=5.0, hours=10.0,
+                               category=rnd.choice(['open', 'intensive',
+                                                    'filler']))
+                for i in range(5)]
+        self.oblist = []
+        for i in range(100):
+            tgt = entity.HSCTarget(name='t%d' % i, ra="%02d:00:00" % (i % 24),
+                                   dec="+10:00:00")
+            telcfg = entity.TelescopeConfiguration(focus='P_OPT2')
+            if rnd.random() < 0.2:
+                inscfg = entity.FOCASConfiguration(filter=rnd.choice(['b',
+                                                                      'v']))
+            else:
+                inscfg = entity.HSCConfiguration(filter=rnd.choice(['g', 'r',
+                                                                    'i', None]))
+            envcfg = entity.EnvironmentConfiguration()
+            ob = entity.OB(program=rnd.choice(pgms), target=tgt,
+                           telcfg=telcfg, inscfg=inscfg, envcfg=envcfg,
+                           total_time=600)
+            self.oblist.append(ob)
+
+    def test_check(self):
+        table = qsim.InvariantTable(self.oblist)
+        for instruments, filters, categories in (
+                (['HSC'], ['g', 'r'], ['open']),
+                (['HSC', 'FOCAS'], ['g', 'b', 'z'], ['open', 'filler']),
+                (['SPCAM'], ['g'], ['open', 'intensive', 'filler'])):
+            data = Bunch.Bunch(instruments=instruments, filters=filters,
+                               categories=categories)
+            schedule = entity.Schedule(self.time1, self.time2, data=data)
+            good1, bad1, res1 = qsim.check_schedule_invariant(None, schedule,
+                                                              self.oblist)
+            good2, bad2, res2 = qsim.check_schedule_invariant(None, schedule,
+                                                              self.oblist,
+                                                              table=table)
+            self.assertEqual(good1, good2)
+            self.assertEqual(bad1, bad2)
+            for ob in bad2:
+                self.assertEqual(res1[ob].reason, res2[ob].reason)
+
+    def test_vocabulary(self):
+        vocab1 = qsim.Vocabulary(['g', 'r'])
+        self.assertEqual(vocab1.encode(['r', 'z']), 2)
+        vocab2, vocab3 = qsim.Vocabulary(), qsim.Vocabulary()
+        self.assertEqual(vocab2.get_bit('i'), 0)
+        self.assertEqual(vocab3.names, [])
+
+
+class TestFeasibility(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        pgm = entity.Program('S16B-001', rank=5.0, category='open',
+                             hours=10.0)
+        self.oblist = []
+        for i in range(12):
+            tgt = entity.HSCTarget(name='t%d' % i, ra="%02d:00:00" % (i*2),
+                                   dec="+20:00:00")
+            telcfg = entity.TelescopeConfiguration(focus='P_OPT2')
+            inscfg = entity.HSCConfiguration(filter='g')
+            envcfg = entity.EnvironmentConfiguration(airmass=1.3,
+                                                     moon_sep=30.0)
+            ob = entity.OB(program=pgm, target=tgt, telcfg=telcfg,
+                           inscfg=inscfg, envcfg=envcfg, total_time=3600)
+            self.oblist.append(ob)
+
+        self.slots = []
+        for day in (2, 20):
+            start = self.obs.get_date("2016-11-%02d 19:00" % day)
+            data = Bunch.Bunch(dome='open', seeing=1.0, transparency=0.7,
+                               cur_filter='g', cur_az=-90.0, cur_el=89.0)
+            self.slots.append(entity.Slot(start, 3600*10, data=data))
+
+    def test_observer_pickle(self):
+        import pickle
+        obs2 = pickle.loads(pickle.dumps(self.obs))
+        time1 = self.obs.get_date("2016-11-02 22:00")
+        c1 = self.obs.calc(self.oblist[0].target, time1)
+        c2 = obs2.calc(self.oblist[0].target, time1)
+        self.assertEqual(c1.alt, c2.alt)
+
+    def test_parallel(self):
+        for kind in ('slot', 'visibility'):
+            m1, r1 = qsim.check_feasibility(self.obs, self.slots, self.oblist,
+                                            kind=kind)
+            m2, r2 = qsim.check_feasibility(self.obs, self.slots, self.oblist,
+                                            kind=kind, num_procs=2)
+            self.assertEqual(m1.shape, (2, 12))
+            self.assertTrue((m1 == m2).all())
+            self.assertEqual(r1, r2)
+            # some, but not all targets are visible
+            self.assertTrue(0 < m1.sum() < 24)
+
+    def test_shared_vis(self):
+        vis = [self.obs.get_visibility_index(slot.start_time, slot.stop_time)
+               for slot in self.slots]
+        m1, r1 = qsim.check_feasibility(self.obs, self.slots, self.oblist)
+        m2, r2 = qsim.check_feasibility(self.obs, self.slots, self.oblist,
+                                        vis=vis)
+        self.assertTrue((m1 == m2).all())
+        self.assertEqual(r1, r2)
+        # the windows were solved in the indexes, and are reused
+        for night_vis in vis:
+            self.assertTrue(len(night_vis._intervals) > 0)
+        ob = self.oblist[0]
+        min_el, max_el = ob.telcfg.get_el_minmax()
+        min_alt_deg = calcpos.calc_min_alt_deg(min_el,
+                                               airmass=ob.envcfg.airmass)
+        windows = vis[0].get_intervals(ob.target, min_alt_deg, max_el)
+        night = qsim.prepare_night(self.obs, self.slots[0].start_time,
+                                   self.slots[0].stop_time, vis=vis[0])
+        self.assertTrue(qsim.get_slot_static(ob, night=night).windows
+                        is windows)
+
+    def test_slot_static(self):
+        start = self.slots[0].start_time
+        stop = self.slots[0].stop_time
+        night = qsim.prepare_night(self.obs, start, stop)
+        prev_slot = None
+        for offset in (0, 0, 2, 5, 8, 9.5):
+            slot = entity.Slot(start + timedelta(0, 3600*offset),
+                               3600*(10 - offset), data=self.slots[0].data)
+            for ob in self.oblist:
+                # cached evaluation against one without the cache
+                res1 = qsim.check_slot(self.obs, prev_slot, slot, ob,
+                                       night=night)
+                night2 = qsim.prepare_night(self.obs, start, stop)
+                res2 = qsim.check_slot(self.obs, prev_slot, slot, ob,
+                                       night=night2)
+                self.assertEqual(res1.get_values(), res2.get_values())
+            prev_slot = entity.Slot(slot.start_time, 600,
+                                    data=self.slots[0].data)
+            prev_slot.ob = self.oblist[int(offset)]
+        self.assertEqual(len(night.slot_static), len(self.oblist))
+
+
+class TestMoonCalendar(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+
+    def test_is_dark(self):
+        rnd = random.Random(3)
+        # around first quarter, full and new moon
+        for day in (5, 14, 29):
+            time1 = self.obs.get_date("2016-11-%02d 18:00" % day)
+            time2 = time1 + timedelta(0, 3600*13)
+            moon = self.obs.get_moon_table(time1, time2)
+            calendar = qsim.MoonCalendar(moon)
+            for i in range(200):
+                djd1 = rnd.uniform(moon.djd_start, moon.djd_stop)
+                djd2 = djd1 + rnd.uniform(0.0, 0.2)
+                # compare with the moon altitude at the ends
+                alt1, alt2 = moon.moon_alt([djd1, djd2])
+                is_dark = ((moon.moon_pct(djd1) <=
+                            qsim.dark_night_moon_pct_limit) or
+                           ((alt1 < 0.0) and (alt2 < 0.0)))
+                self.assertEqual(calendar.is_dark(djd1, djd2), is_dark)
+                self.assertEqual(calendar.classify(djd1, djd2),
+                                 'dark' if is_dark else 'gray')
+
+    def test_moon_down(self):
+        time1 = self.obs.get_date("2016-11-05 18:00")
+        time2 = time1 + timedelta(0, 3600*13)
+        moon = self.obs.get_moon_table(time1, time2)
+        calendar = qsim.MoonCalendar(moon)
+        # first quarter moon sets around midnight
+        self.assertEqual(len(calendar.down_start), 1)
+        self.assertEqual(calendar.down_end[-1], float('inf'))
+        alt = moon.moon_alt(calendar.down_start[0])
+        self.assertTrue(abs(alt) < 0.01)
+
+
+class TestSlewCostTable(unittest.TestCase):
+
+    def setUp(self):
+        self.hst = pytz.timezone('US/Hawaii')
+        self.obs = entity.Observer('subaru',
+                                   longitude='-155:28:48.900',
+                                   latitude='+19:49:42.600',
+                                   elevation=4163,
+                                   pressure=615,
+                                   temperature=0,
+                                   timezone=self.hst)
+        self.time1 = self.obs.get_date("2016-11-02 19:00")
+        self.time2 = self.obs.get_date("2016-11-03 06:00")
+        self.targets = [entity.HSCTarget(name='t%d' % i,
+                                         ra="%02d:00:00" % (i * 3),
+                                         dec="+%02d:00:00" % (i * 10))
+                        for i in range(8)]
+
+    def test_azimuth_wrap(self):
+        self.assertEqual(qsim.calc_slew_time(60.0, 350.0, 60.0, 10.0),
+                         qsim.calc_slew_time(60.0, 10.0, 60.0, 350.0))
+        self.assertEqual(qsim.calc_slew_time(60.0, 350.0, 60.0, 10.0),
+                         qsim.calc_slew_time(60.0, 0.0, 60.0, 20.0))
+        self.assertEqual(qsim.calc_slew_time(60.0, -90.0, 60.0, 270.0), 0.0)
+
+    def test_cable_wrap(self):
+        # the shorter way round would go past the cable wrap limit
+        self.assertEqual(qsim.calc_wrap_az(260.0, 280.0), -80.0)
+        self.assertEqual(qsim.calc_wrap_az(-260.0, 80.0), 80.0)
+        self.assertEqual(qsim.calc_wrap_az(-100.0, 250.0), -110.0)
+        # 340 deg the long way round, at 0.5 deg/sec
+        self.assertEqual(qsim.calc_slew_time(60.0, 260.0, 60.0, 280.0),
+                         680.0)
+        self.assertEqual(qsim.calc_slew_time(60.0, -100.0, 60.0, 280.0),
+                         qsim.calc_slew_time(60.0, 0.0, 60.0, 20.0))
+        az = qsim.calc_wrap_az(np.array([260.0, -260.0, 350.0]),
+                               np.array([280.0, 80.0, 10.0]))
+        self.assertEqual(list(az), [-80.0, 80.0, 10.0])
+
+    def test_tracked_az_wrap(self):
+        night = qsim.prepare_night(self.obs, self.time1, self.time2)
+        t1 = calcpos.datetime_to_epoch(self.time1)
+        for tgt in self.targets:
+            az1 = night.slew.get_alt_az(tgt, t1)[1]
+            for t2 in (t1 + 600.0, t1 + 7200.0):
+                az2 = night.slew.get_alt_az(tgt, t2)[1]
+                for turns in (-1, 0):
+                    az_wrap = (t1, az1 + 360.0 * turns)
+                    t, az = qsim.calc_tracked_az_wrap(self.obs, tgt, az_wrap,
+                                                      t2, night=night)
+                    self.assertEqual(t, t2)
+                    self.assertAlmostEqual(az % 360.0, az2, 6)
+                    # the telescope stays on the same turn of the cable
+                    self.assertTrue(abs(az - az_wrap[1]) < 180.0)
+
+    def test_check_slot_wrap(self):
+        night = qsim.prepare_night(self.obs, self.time1, self.time2)
+        data = Bunch.Bunch(dome='open', seeing=1.0, transparency=0.7,
+                           cur_filter='g', cur_az=-90.0, cur_el=89.0)
+        obs = [entity.OB(program=None, target=tgt,
+                         telcfg=entity.TelescopeConfiguration(focus='P_OPT2'),
+                         inscfg=entity.HSCConfiguration(filter='g'),
+                         envcfg=entity.EnvironmentConfiguration(),
+                         total_time=600)
+               for tgt in self.targets]
+        prev_slot = entity.Slot(self.time1, 600, data=data)
+        prev_slot.ob = obs[0]
+        slot = entity.Slot(prev_slot.stop_time, 3600*4, data=data)
+        t = slot.start_epoch
+        alt0, az0 = night.slew.get_alt_az(obs[0].target, t)
+        for az_wrap_deg in (az0, az0 - 360.0):
+            if not (qsim.az_wrap_min_deg <= az_wrap_deg <=
+                    qsim.az_wrap_max_deg):
+                continue
+            prev_slot.az_wrap = (t, az_wrap_deg)
+            for ob in obs[1:]:
+                res = qsim.check_slot(self.obs, prev_slot, slot, ob,
+                                      check_moon=False, night=night)
+                if not res.obs_ok:
+                    continue
+                alt1, az1 = night.slew.get_alt_az(ob.target, t)
+                self.assertAlmostEqual(res.slew_sec,
+                                       qsim.calc_slew_time(alt0, az_wrap_deg,
+                                                           alt1, az1), 6)
+                self.assertEqual(res.az_wrap[0], t)
+                self.assertAlmostEqual(res.az_wrap[1],
+                                       qsim.calc_wrap_az(az_wrap_deg, az1), 6)
+
+    def test_slew_times(self):
+        night = qsim.prepare_night(self.obs, self.time1, self.time2)
+        slew = night.slew
+        times = [self.time1 + timedelta(0, 1800*i)
+                 for i in range(len(self.targets))]
+        # the table works in seconds since the epoch
+        t_secs = [calcpos.datetime_to_epoch(time1) for time1 in times]
+        from_tgt = self.targets[0]
+        slew_secs = slew.get_slew_times(from_tgt, self.targets, t_secs)
+        for tgt, time1, t_sec, slew_sec in zip(self.targets, times, t_secs,
+                                               slew_secs):
+            self.assertAlmostEqual(slew.get_slew_time(from_tgt, tgt, t_sec),
+                                   slew_sec)
+            # compare with positions calculated directly
+            c1 = from_tgt.calc(self.obs, time1)
+            c2 = tgt.calc(self.obs, time1)
+            slew_sec2 = qsim.calc_slew_time(c1.alt_deg, c1.az_deg,
+                                            c2.alt_deg, c2.az_deg)
+            self.assertTrue(abs(slew_sec - slew_sec2) < 1.0)
+
+        self.assertRaises(ValueError, slew.get_slew_times, from_tgt,
+                          self.targets,
+                          calcpos.datetime_to_epoch(self.time2) + 60)
+
+if __name__ == "__main__":
+    unittest.main()
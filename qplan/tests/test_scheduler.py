@@ -0,0 +1,218 @@
+from __future__ import print_function
+import unittest
+import logging
+import random
+from datetime import timedelta
+from collections import Counter
+
+from ginga.misc import Bunch
+
+from qplan import entity, qsim, Scheduler
+from qplan.util import site, qsort
+
+
+class TestEvalSlot(unittest.TestCase):
+
+    def setUp(self):
+        logger = logging.getLogger('test_scheduler')
+        self.obs = site.get_site('subaru')
+        self.sdlr = Scheduler.Scheduler(logger, self.obs)
+        self.rnd = random.Random(5)
+
+        self.pgms = [entity.Program('S16B-%03d' % i, rank=float(i),
+                                    hours=10.0, category='open')
+                     for i in range(1, 8)]
+        self.start = self.obs.get_date("2016-11-20 19:00")
+        self.stop = self.obs.get_date("2016-11-21 05:00")
+        self.data = Bunch.Bunch(dome='open', seeing=1.0, transparency=0.7,
+                                cur_filter='g', cur_az=-90.0, cur_el=89.0)
+
+    def _make_obs(self, programs, priorities, num=60, targets=None):
+        rnd = self.rnd
+        oblist = []
+        for i in range(num):
+            if targets is None:
+                tgt = entity.HSCTarget(name='t%d' % i,
+                                       ra="%02d:%02d:00" % (rnd.randint(0, 23),
+                                                            rnd.randint(0, 59)),
+                                       dec="+%02d:00:00" % rnd.randint(0, 60))
+            else:
+                tgt = targets[i % len(targets)]
+            telcfg = entity.TelescopeConfiguration(focus='P_OPT2')
+            inscfg = entity.HSCConfiguration(filter=rnd.choice(['g', 'r']))
+            envcfg = entity.EnvironmentConfiguration(airmass=2.0)
+            ob = entity.OB(program=rnd.choice(programs), target=tgt,
+                           telcfg=telcfg, inscfg=inscfg, envcfg=envcfg,
+                           total_time=rnd.choice([600, 1800]),
+                           priority=rnd.choice(priorities), name='ob%d' % i)
+            oblist.append(ob)
+        return oblist
+
+    def _make_slot(self, offset):
+        return entity.Slot(self.start + timedelta(0, 3600*offset),
+                           3600*(10 - offset), data=self.data)
+
+    def _evaluate_all(self, slot, oblist, night):
+        # evaluate all OBs, and rank the good ones by their scores
+        results = []
+        for i, ob in enumerate(oblist):
+            res = qsim.check_slot(self.obs, None, slot, ob, night=night)
+            if res.obs_ok:
+                results.append((self.sdlr.score_result(res), i, res))
+        return [res for score, i, res in sorted(results)]
+
+    def _compare_cmp_res(self, oblist):
+        # the order is the one of the comparator, where it is transitive
+        night = qsim.prepare_night(self.obs, self.start, self.stop,
+                                   oblist=oblist)
+        for offset in (0, 4):
+            slot = self._make_slot(offset)
+            good, bad = self.sdlr.eval_slot(None, slot, self.obs, oblist,
+                                            night=night)
+            ranked = list(good)
+            expected = qsort.qsort(self._evaluate_all(slot, oblist, night),
+                                   cmp_fn=self.sdlr.cmp_res)
+            self.assertTrue(len(ranked) > 0)
+            self.assertEqual([res.ob.name for res in ranked],
+                             [res.ob.name for res in expected])
+
+    def test_same_program(self):
+        self._compare_cmp_res(self._make_obs(self.pgms[4:5],
+                                             [0.5, 1.0, 2.5, 7.0]))
+
+    def test_equal_priority(self):
+        self._compare_cmp_res(self._make_obs(self.pgms, [1.0]))
+
+    def test_bounded(self):
+        oblist = self._make_obs(self.pgms, [1.0, 2.0])
+        night = qsim.prepare_night(self.obs, self.start, self.stop,
+                                   oblist=oblist)
+        for offset in (0, 3, 7):
+            slot = self._make_slot(offset)
+            good, bad = self.sdlr.eval_slot(None, slot, self.obs,
+                                            oblist, night=night)
+            best = next(good)
+
+            expected = self._evaluate_all(slot, oblist, night)
+            self.assertTrue(best.ob is expected[0].ob)
+            # the bound cut off the evaluation early: some OBs were
+            # never evaluated
+            self.assertTrue(len(bad) + 1 < len(oblist))
+
+            # the rest come out in the same order
+            ranked = [best] + list(good)
+            self.assertEqual([res.ob.name for res in ranked],
+                             [res.ob.name for res in expected])
+            self.assertEqual(len(bad) + len(ranked), len(oblist))
+
+    def test_priority_within_program(self):
+        # in a pool of several programs, the OBs of each program still
+        # come out in the order of cmp_res(), which only weighs their
+        # priorities against each other
+        oblist = self._make_obs(self.pgms[2:6], [0.5, 1.0, 2.5, 7.0])
+        night = qsim.prepare_night(self.obs, self.start, self.stop,
+                                   oblist=oblist)
+        for offset in (0, 4):
+            slot = self._make_slot(offset)
+            good, bad = self.sdlr.eval_slot(None, slot, self.obs, oblist,
+                                            night=night)
+            ranked = list(good)
+            results = self._evaluate_all(slot, oblist, night)
+            for pgm in self.pgms[2:6]:
+                expected = qsort.qsort([res for res in results
+                                        if res.ob.program == pgm],
+                                       cmp_fn=self.sdlr.cmp_res)
+                self.assertTrue(len(expected) > 1)
+                self.assertEqual([res.ob.name for res in ranked
+                                  if res.ob.program == pgm],
+                                 [res.ob.name for res in expected])
+
+    def test_empty(self):
+        slot = self._make_slot(0)
+        good, bad = self.sdlr.eval_slot(None, slot, self.obs, [])
+        self.assertEqual(list(good), [])
+        self.assertEqual(bad, [])
+
+    def test_bounds(self):
+        oblist = self._make_obs(self.pgms, [1.0, 2.0])
+        bounds = self.sdlr.score_bounds(oblist)
+        slot = self._make_slot(0)
+        for ob, bound in zip(oblist, bounds):
+            res = qsim.check_slot(self.obs, None, slot, ob)
+            if res.obs_ok:
+                self.assertTrue(self.sdlr.score_result(res) >= bound)
+
+    def test_score_results(self):
+        oblist = self._make_obs(self.pgms, [1.0, 2.0])
+        slot = self._make_slot(0)
+        results = [qsim.check_slot(self.obs, None, slot, ob)
+                   for ob in oblist]
+        results = [res for res in results if res.obs_ok]
+        scores = self.sdlr.score_results(results)
+        self.assertEqual(list(scores),
+                         [self.sdlr.score_result(res) for res in results])
+
+
+class TestFillNight(unittest.TestCase):
+
+    def setUp(self):
+        logger = logging.getLogger('test_scheduler')
+        self.obs = site.get_site('subaru')
+        self.sdlr = Scheduler.Scheduler(logger, self.obs)
+
+        self.hi = entity.Program('S16B-009', rank=9.0, hours=10.0,
+                                 category='open')
+        self.lo = entity.Program('S16B-001', rank=1.0, hours=10.0,
+                                 category='open')
+        self.tgt = entity.HSCTarget(name='t0', ra="03:00:00",
+                                    dec="+20:00:00")
+        # the moon sets at about 00:30 on this night
+        self.start = self.obs.get_date("2016-11-07 19:00")
+        self.stop = self.obs.get_date("2016-11-08 05:00")
+        self.data = Bunch.Bunch(filters=['g'], instruments=['HSC'],
+                                categories=['open'], dome='open',
+                                seeing=1.0, transparency=0.8,
+                                cur_filter='g', cur_az=-90.0, cur_el=89.0)
+
+    def _make_ob(self, program, name, moon='any'):
+        envcfg = entity.EnvironmentConfiguration(moon=moon)
+        return entity.OB(program=program, target=self.tgt,
+                         telcfg=entity.TelescopeConfiguration(
+                             focus='P_OPT2'),
+                         inscfg=entity.HSCConfiguration(filter='g'),
+                         envcfg=envcfg, total_time=1800, acct_time=1800,
+                         name=name)
+
+    def test_dropped_when_evaluated(self):
+        # an OB is only dropped for the night when it is evaluated for
+        # a slot and cannot be observed in it
+        oblist = [self._make_ob(self.hi, 'ob%d' % i) for i in range(12)]
+        dark = self._make_ob(self.lo, 'dark', moon='dark')
+        oblist.append(dark)
+
+        # while the moon is up, the dark OB cannot be observed...
+        slot = entity.Slot(self.start, 3600*10, data=self.data)
+        res = qsim.check_slot(self.obs, None, slot, dark)
+        self.assertFalse(res.obs_ok)
+        self.assertEqual(res.reason.code, qsim.R_MOON_ILLUMINATION)
+
+        # ...but the OBs of the higher ranked program win those slots
+        # without it being evaluated, so it is still there after the
+        # moon sets
+        schedule = entity.Schedule(self.start, self.stop, data=self.data)
+        props = dict((str(pgm), Bunch.Bunch(pgm=pgm, obs=[], obcount=0,
+                                            sched_time=0.0,
+                                            total_time=36000.0))
+                     for pgm in (self.hi, self.lo))
+        rejections = Counter()
+        self.sdlr.fill_night_schedule(schedule, self.obs, oblist, props,
+                                      rejections=rejections)
+        scheduled = [slot for slot in schedule.slots if slot.ob is dark]
+        self.assertEqual(len(scheduled), 1)
+        moon_alt = self.tgt.calc(self.obs, scheduled[0].start_time).moon_alt
+        self.assertTrue(moon_alt < 0.0)
+        self.assertEqual(rejections[qsim.R_MOON_ILLUMINATION], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
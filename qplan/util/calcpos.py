@@ -3,6 +3,10 @@
 #
 from __future__ import print_function
 import math
+import bisect
+import threading
+import weakref
+from collections import OrderedDict
 
 # third-party imports
 import numpy as np
@@ -23,18 +27,131 @@ def alt2airmass(alt_deg):
     xp = 1.0 / math.sin(math.radians(alt_deg + 244.0/(165.0 + 47*alt_deg**1.1)))
     return xp
 
-am_inv = []
-for alt in range(0, 91):
-    alt_deg = float(alt)
-    am = alt2airmass(alt_deg)
-    am_inv.append((am, alt_deg))
+am_horizon = alt2airmass(0.0)
+am_zenith = alt2airmass(90.0)
 
 def airmass2alt(am):
-    # TODO: horribly inefficient lookup--FIX!
-    for (x, alt_deg) in am_inv:
-        if x <= am:
-            return alt_deg
-    return 90.0
+    """Inverse of alt2airmass(): returns the altitude (deg) at which the
+    airmass is `am`.  Airmasses beyond that of the horizon give 0 and
+    those below that of the zenith give 90.  `am` can be a scalar or
+    an array.
+    """
+    if np.ndim(am) > 0:
+        return np.array([airmass2alt(x) for x in np.ravel(am)]).reshape(
+            np.shape(am))
+    if am >= am_horizon:
+        return 0.0
+    if am <= am_zenith:
+        return 90.0
+    # alt2airmass() decreases monotonically from the horizon to the
+    # zenith, so bisect (52 halvings of 90 deg reach the precision of
+    # a double)
+    lo, hi = 0.0, 90.0
+    for i in range(52):
+        mid = 0.5*(lo + hi)
+        if alt2airmass(mid) > am:
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+# Julian date of the ephem (Dublin Julian Date) epoch
+djd_epoch_jd = 2415020.0
+
+epoch_utc = datetime(1970, 1, 1, tzinfo=pytz.utc)
+# ephem (Dublin Julian) date of the epoch
+epoch_djd = float(ephem.Date(epoch_utc.replace(tzinfo=None)))
+
+def datetime_to_epoch(date):
+    """Convert a timezone-aware datetime into seconds since the epoch
+    (UTC), as a float.
+    """
+    return (date - epoch_utc).total_seconds()
+
+def epoch_to_datetime(secs, tz=pytz.utc):
+    """Convert seconds since the epoch into a datetime in timezone `tz`.
+    """
+    return datetime.fromtimestamp(secs, tz)
+
+def epoch_to_djd(secs):
+    """Convert seconds since the epoch into an ephem date (float).
+    `secs` can be a scalar or a NumPy array.
+    """
+    return epoch_djd + secs / 86400.0
+
+def djd_to_epoch(djd):
+    """Convert ephem date(s) into seconds since the epoch."""
+    return (djd - epoch_djd) * 86400.0
+
+# rotation rate of the earth w.r.t. the equinox (radians/day)
+sidereal_rate = math.radians(360.98564736629)
+
+
+def calc_min_alt_deg(el_min_deg, airmass=None):
+    """Returns the minimum altitude (deg) that satisfies both the minimum
+    elevation `el_min_deg` and the maximum `airmass` (if given).
+    """
+    if airmass != None:
+        # compute desired altitude from airmass
+        alt_deg = airmass2alt(airmass)
+        return max(alt_deg, el_min_deg)
+    return el_min_deg
+
+def _get_body(target):
+    # targets from the entity module wrap a Body or SSBody
+    return getattr(target, 'body', target)
+
+def calc_gmst_array(jd):
+    """Compute Greenwich Mean Sidereal Time (radians) for an array of
+    Julian dates.
+    """
+    T = (jd - 2451545.0)/36525.0
+    gmstdeg = 280.46061837+(360.98564736629*(jd-2451545.0))+(0.000387933*T*T)-(T*T*T/38710000.0)
+    return np.radians(gmstdeg)
+
+def calc_parallactic_array(dec, ha, lat, az):
+    """Compute parallactic angle (radians) for arrays of values."""
+    cos_dec = np.cos(dec)
+    sinp = -1.0*np.sin(az)*np.cos(lat)/np.where(cos_dec != 0.0, cos_dec, 1.0)
+    cosp = -1.0*np.cos(az)*np.cos(ha)-np.sin(az)*np.sin(ha)*np.sin(lat)
+    if lat > 0.0:
+        pole = np.pi
+    else:
+        pole = 0.0
+    return np.where(cos_dec != 0.0, np.arctan2(sinp, cosp), pole)
+
+def _unrefract_array(pr, tr, alt):
+    # refraction (radians) to subtract from apparent altitude `alt` to
+    # give true altitude; same model as libastro (used by pyephem)
+    alt_deg = np.degrees(alt)
+    r_lt15 = ((0.1594 + 0.0196*alt_deg + 0.00002*alt_deg**2) * pr /
+              ((1.0 + 0.505*alt_deg + 0.0845*alt_deg**2) * (273.0 + tr)))
+    r_lt15 = np.radians(r_lt15)
+    r_ge15 = 7.888888e-5*pr/((273.0 + tr) * np.tan(np.maximum(alt,
+                                                              np.radians(14.0))))
+    # blend the two models between 14.5 and 15.5 deg
+    w = np.clip(alt_deg - 14.5, 0.0, 1.0)
+    return (1.0 - w) * r_lt15 + w * r_ge15
+
+def calc_refraction_array(pr, tr, alt):
+    """Compute the refraction (radians) to add to the true altitudes
+    `alt` (radians), for pressure `pr` (mbar) and temperature `tr` (C).
+    """
+    if pr <= 0.0:
+        return np.zeros_like(alt)
+    # invert _unrefract_array() by fixed point iteration
+    app_alt = alt
+    for i in range(4):
+        app_alt = alt + _unrefract_array(pr, tr, app_alt)
+    # no refraction far below the horizon
+    return np.where(alt > np.radians(-3.0), app_alt - alt, 0.0)
+
+def calc_airmass_array(alt):
+    """Compute airmass for an array of altitudes (radians)."""
+    alt = np.maximum(alt, float(ephem.degrees('03:00:00')))
+    sz = 1.0/np.sin(alt) - 1.0
+    xp = 1.0 + sz*(0.9981833 - sz*(0.002875 + 0.0008083*sz))
+    return xp
 
 #### Classes ####
 
@@ -62,6 +179,11 @@ class Observer(object):
         self.tz_local = timezone
         self.tz_utc = pytz.timezone('UTC')
         self.site = self.get_site(date=date)
+        # per-thread sites used for calculations (see get_site_context())
+        self._local = threading.local()
+
+        # memoizes results of calc()
+        self.calc_cache = CalculationCache()
 
         # used for sunset, sunrise calculations
         self.horizon6 = -1.0 * ephem.degrees('06:00:00.0')
@@ -72,6 +194,21 @@ class Observer(object):
         self.sun.compute(self.site)
         self.moon.compute(self.site)
 
+        # caches sunset, sunrise and twilight times
+        self.almanac = Almanac(self)
+
+    # for pickling (e.g. to send the observer to other processes):
+    # only the definition is kept, sites and caches are rebuilt
+
+    def __getstate__(self):
+        return dict(name=self.name, timezone=self.timezone,
+                    longitude=self.longitude, latitude=self.latitude,
+                    elevation=self.elevation, pressure=self.pressure,
+                    temperature=self.temperature, date=self.date)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
     def get_site(self, date=None, horizon_deg=None):
         site = ephem.Observer()
         site.lon = self.longitude
@@ -89,6 +226,25 @@ class Observer(object):
         site.date = ephem.Date(self.date_to_utc(date))
         return site
 
+    def get_site_context(self, date=None):
+        """Returns an ephem site private to the calling thread, with the
+        default horizon and its date set to `date` (if given).
+        Calculations should be done against this instead of self.site,
+        so that several threads can use the observer at once.
+        """
+        try:
+            site = self._local.site
+        except AttributeError:
+            site = self.get_site(date=self.date)
+            self._local.site = site
+
+        site.horizon = self.horizon
+        if date is not None:
+            if not isinstance(date, ephem.Date):
+                date = ephem.Date(self.date_to_utc(date))
+            site.date = date
+        return site
+
     def date_to_utc(self, date):
         """Convert a datetime to UTC.
         NOTE: If the datetime object is not timezone aware, it is
@@ -146,6 +302,72 @@ class Observer(object):
     def calc(self, body, time_start):
         return body.calc(self, time_start)
 
+    def calc_batch(self, targets, dates, engine='ephem'):
+        """Compute positions for many targets at many times in one call.
+
+        `targets` is a sequence of targets (anything that can be passed
+        to calc()) and `dates` is a sequence of datetimes or ephem dates.
+        If `engine` is 'numpy', fixed targets are calculated with a
+        FixedTargetEngine instead of pyephem.
+        Returns a BatchCalculationResult whose arrays are shaped
+        (len(targets), len(dates)).
+        """
+        t_djd = np.array([self._date_to_djd(date) for date in dates],
+                         dtype=np.float64)
+        bodies = [_get_body(target) for target in targets]
+
+        shape = (len(bodies), len(t_djd))
+        ra = np.zeros(shape)
+        dec = np.zeros(shape)
+        alt = np.zeros(shape)
+        az = np.zeros(shape)
+
+        if engine == 'numpy':
+            # fixed targets are calculated vectorized
+            idx = [i for i, body in enumerate(bodies)
+                   if isinstance(body, Body)]
+            if len(idx) > 0 and len(t_djd) > 0:
+                fixed = FixedTargetEngine(self, [bodies[i] for i in idx],
+                                          t_djd[len(t_djd) // 2])
+                alt[idx], az[idx] = fixed.calc_alt_az(t_djd)
+                ra[idx] = fixed.ra[:, np.newaxis]
+                dec[idx] = fixed.dec[:, np.newaxis]
+            # the rest (solar system bodies) go through pyephem
+            bodies = [body if not isinstance(body, Body) else None
+                      for body in bodies]
+
+        elif engine != 'ephem':
+            raise ValueError("engine should be 'ephem' or 'numpy': '%s'" % (
+                engine))
+
+        # use a private site so that the shared one is not disturbed
+        site = self.get_site(date=self.date)
+        for j, djd in enumerate(t_djd):
+            site.date = djd
+            for i, body in enumerate(bodies):
+                if body is None:
+                    continue
+                with body.lock:
+                    body._body.compute(site)
+                    ra[i, j] = body._body.ra
+                    dec[i, j] = body._body.dec
+                    alt[i, j] = body._body.alt
+                    az[i, j] = body._body.az
+
+        return BatchCalculationResult(self, targets, t_djd, ra, dec,
+                                      alt, az)
+
+    def _date_to_djd(self, date):
+        """Convert a datetime (or ephem date) into an ephem (Dublin
+        Julian) date, as a float.
+        """
+        if isinstance(date, datetime):
+            if date.tzinfo is None:
+                date = self.date_to_utc(date)
+            # same as the conversion of epoch times, so that they agree
+            return epoch_to_djd(datetime_to_epoch(date))
+        return float(ephem.Date(date))
+
     def get_date(self, date_str, timezone=None):
         """Get a datetime object, converted from a date string.
         The timezone is assumed to be that of the observer, unless
@@ -189,82 +411,77 @@ class Observer(object):
         and `el_max` during that period, and whether it meets the minimum
         airmass.
         """
-        # set observer's horizon to elevation for el_min or to achieve
-        # desired airmass
-        if airmass != None:
-            # compute desired altitude from airmass
-            alt_deg = airmass2alt(airmass)
-            min_alt_deg = max(alt_deg, el_min_deg)
-        else:
-            min_alt_deg = el_min_deg
-
-        site = self.get_site(date=time_start, horizon_deg=min_alt_deg)
-
-        d1 = self.calc(target, time_start)
+        # minimum altitude for el_min or to achieve desired airmass
+        min_alt_deg = calc_min_alt_deg(el_min_deg, airmass=airmass)
+
+        solver = ElevationWindowSolver(self, time_start, time_stop)
+        rises, sets = solver.solve([target], min_alt_deg, el_max_deg)[0]
+
+        return self._observable_window(rises, sets, solver.djd_start,
+                                       solver.djd_stop, time_needed)
+
+    def _find_window(self, rises, sets, djd_start, djd_stop, time_needed):
+        # find the first window (from a list of sorted `rises` and `sets`)
+        # that is long enough within the period, or else the first one
+        # that ends after the start of the period; times are ephem dates.
+        # A target passing near the zenith (above the maximum elevation)
+        # has its night split into several windows, so later ones are
+        # looked at too.
+        i = bisect.bisect_right(sets, djd_start)
+        first = (False, None, None)
+        for j in range(i, len(sets)):
+            if rises[j] >= djd_stop:
+                break
+            time_rise = max(rises[j], djd_start)
+            # last observable time is setting or end of period,
+            # whichever comes first
+            time_end = min(sets[j], djd_stop)
+            # calculate duration in seconds
+            duration = (time_end - time_rise) * 86400.0
+            # object is observable as long as the duration that it is
+            # up is as long or longer than the time needed
+            if duration > time_needed:
+                return (True, time_rise, time_end)
+            if first[1] is None:
+                first = (False, time_rise, time_end)
+
+        return first
+
+    def _observable_window(self, rises, sets, djd_start, djd_stop,
+                           time_needed):
+        can_obs, time_rise, time_end = self._find_window(rises, sets,
+                                                         djd_start, djd_stop,
+                                                         time_needed)
+        if time_rise is None:
+            return (False, None, None)
 
-        # TODO: worry about el_max_deg
-
-        # important: ephem only deals with UTC!!
-        time_start_utc = ephem.Date(self.date_to_utc(time_start))
-        time_stop_utc = ephem.Date(self.date_to_utc(time_stop))
-        #print "period (UT): %s to %s" % (time_start_utc, time_stop_utc)
+        # convert times back to datetime's
+        time_rise = self.date_to_local(ephem.Date(time_rise).datetime())
+        time_end = self.date_to_local(ephem.Date(time_end).datetime())
 
-        if d1.alt_deg >= min_alt_deg:
-            # body is above desired altitude at start of period
-            # so calculate next setting
-            time_rise = time_start_utc
-            time_set = site.next_setting(target.body._body,
-                                         start=time_start_utc)
-            #print "body already up: set=%s" % (time_set)
+        return (can_obs, time_rise, time_end)
 
-        else:
-            # body is below desired altitude at start of period
-            try:
-                time_rise = site.next_rising(target.body._body,
-                                             start=time_start_utc)
-                time_set = site.next_setting(target.body._body,
-                                             start=time_start_utc)
-            except ephem.NeverUpError:
-                return (False, None, None)
-
-            #print "body not up: rise=%s set=%s" % (time_rise, time_set)
-            ## if time_rise < time_set:
-            ##     print "body still rising, below threshold"
-            ##     # <-- body is still rising, just not high enough yet
-            ## else:
-            ##     # <-- body is setting
-            ##     print "body setting, below threshold"
-            ##     # calculate rise time backward from end of period
-            ##     #time_rise = site.previous_rising(target.body, start=time_stop_utc)
-            ##     pass
-
-        if time_rise < time_start_utc:
-            diff = time_rise - time_start_utc
-            ## raise AssertionError("time rise (%s) < time start (%s)" % (
-            ##         time_rise, time_start))
-            print(("WARNING: time rise (%s) < time start (%s)" % (
-                    time_rise, time_start)))
-            time_rise = time_start_utc
-
-        # last observable time is setting or end of period,
-        # whichever comes first
-        time_end = min(time_set, time_stop_utc)
-        # calculate duration in seconds (subtracting two ephem Date
-        # objects seems to give a fraction in days)
-        duration = (time_end - time_rise) * 86400.0
-        # object is observable as long as the duration that it is
-        # up is as long or longer than the time needed
-        diff = duration - float(time_needed)
-        #can_obs = diff > -0.001
-        can_obs = duration > time_needed
-        #print "can_obs=%s duration=%f needed=%f diff=%f" % (
-        #    can_obs, duration, time_needed, diff)
+    def get_visibility_index(self, time_start, time_stop):
+        """Returns a VisibilityIndex for the period between `time_start`
+        and `time_stop` (typically a night).
+        """
+        return VisibilityIndex(self, time_start, time_stop)
 
-        # convert times back to datetime's
-        time_rise = self.date_to_local(time_rise.datetime())
-        time_end = self.date_to_local(time_end.datetime())
+    def get_moon_table(self, time_start, time_stop, time_interval=5):
+        """Returns a MoonTable for the period between `time_start`
+        and `time_stop` (typically a night), sampled every
+        `time_interval` minutes.
+        """
+        return MoonTable(self, time_start, time_stop,
+                         time_interval=time_interval)
 
-        return (can_obs, time_rise, time_end)
+    def get_altaz_table(self, time_start, time_stop, time_interval=2):
+        """Returns an AltAzTable for the period between `time_start`
+        and `time_stop` (typically a night), sampled every
+        `time_interval` minutes.
+        """
+        return AltAzTable(self, time_start, time_stop,
+                          time_interval=time_interval)
 
     def distance(self, tgt1, tgt2, time_start):
         c1 = self.calc(tgt1, time_start)
@@ -274,84 +491,51 @@ class Observer(object):
         d_az = c1.az_deg - c2.az_deg
         return (d_alt, d_az)
 
-    def _set_site_date(self, date):
-        if not isinstance(date, ephem.Date):
-            if date is None:
-                date = self.date
-            date = self.date_to_utc(date)
-
-            date = ephem.Date(date)
-        self.site.date = date
+    def _next_sun_event(self, name, date):
+        # answered from the almanac, without touching self.site
+        if date is None:
+            date = self.date
+        r_date = self.almanac.next_event(name, self._date_to_djd(date))
+        r_date = self.date_to_local(r_date.datetime())
+        return r_date
 
     def sunset(self, date=None):
         """Returns sunset in observer's time."""
-        self.site.horizon = self.horizon
-        self._set_site_date(date)
-        r_date = self.site.next_setting(self.sun)
-        r_date = self.date_to_local(r_date.datetime())
-        return r_date
+        return self._next_sun_event('sunset', date)
 
     def sunrise(self, date=None):
         """Returns sunrise in observer's time."""
-        self.site.horizon = self.horizon
-        self._set_site_date(date)
-        r_date = self.site.next_rising(self.sun)
-        r_date = self.date_to_local(r_date.datetime())
-        return r_date
+        return self._next_sun_event('sunrise', date)
 
     def evening_twilight_6(self, date=None):
         """Returns evening 6 degree civil twilight(civil dusk) in observer's time.
         """
-        self.site.horizon = self.horizon6
-        self._set_site_date(date)
-        r_date = self.site.next_setting(self.sun)
-        r_date = self.date_to_local(r_date.datetime())
-        return r_date
+        return self._next_sun_event('evening_twilight_6', date)
 
     def evening_twilight_12(self, date=None):
         """Returns evening 12 degree (nautical) twilight in observer's time.
         """
-        self.site.horizon = self.horizon12
-        self._set_site_date(date)
-        r_date = self.site.next_setting(self.sun)
-        r_date = self.date_to_local(r_date.datetime())
-        return r_date
+        return self._next_sun_event('evening_twilight_12', date)
 
     def evening_twilight_18(self, date=None):
         """Returns evening 18 degree (civil) twilight in observer's time.
         """
-        self.site.horizon = self.horizon18
-        self._set_site_date(date)
-        r_date = self.site.next_setting(self.sun)
-        r_date = self.date_to_local(r_date.datetime())
-        return r_date
+        return self._next_sun_event('evening_twilight_18', date)
 
     def morning_twilight_6(self, date=None):
         """Returns morning 6 degree civil twilight(civil dawn) in observer's time.
         """
-        self.site.horizon = self.horizon6
-        self._set_site_date(date)
-        r_date = self.site.next_rising(self.sun)
-        r_date = self.date_to_local(r_date.datetime())
-        return r_date
+        return self._next_sun_event('morning_twilight_6', date)
 
     def morning_twilight_12(self, date=None):
         """Returns morning 12 degree (nautical) twilight in observer's time.
         """
-        self.site.horizon = self.horizon12
-        self._set_site_date(date)
-        r_date = self.site.next_rising(self.sun)
-        r_date = self.date_to_local(r_date.datetime())
-        return r_date
+        return self._next_sun_event('morning_twilight_12', date)
 
     def morning_twilight_18(self, date=None):
         """Returns morning 18 degree (civil) twilight in observer's time.
         """
-        self.site.horizon = self.horizon18
-        self._set_site_date(date)
-        r_date = self.site.next_rising(self.sun)
-        r_date = self.date_to_local(r_date.datetime())
-        return r_date
+        return self._next_sun_event('morning_twilight_18', date)
 
     def sun_set_rise_times(self, date=None):
         """Sunset, sunrise and twilight times. Returns a tuple with
@@ -367,8 +551,10 @@ class Observer(object):
 
     def moon_rise(self, date=None):
         """Returns moon rise time in observer's time."""
-        self._set_site_date(date)
-        moonrise = self.site.next_rising(self.moon)
+        if date is None:
+            date = self.date
+        site = self.get_site_context(date)
+        moonrise = site.next_rising(ephem.Moon())
         moonrise = self.date_to_local(moonrise.datetime())
         ## if moonrise < self.sunset():
         ##     moonrise = None
@@ -376,8 +562,10 @@ class Observer(object):
 
     def moon_set(self, date=None):
         """Returns moon set time in observer's time."""
-        self._set_site_date(date)
-        moonset = self.site.next_setting(self.moon)
+        if date is None:
+            date = self.date
+        site = self.get_site_context(date)
+        moonset = site.next_setting(ephem.Moon())
         moonset = self.date_to_local(moonset.datetime())
         ## if moonset > self.sunrise():
         ##     moonset = None
@@ -385,9 +573,10 @@ class Observer(object):
 
     def moon_phase(self, date=None):
         """Returns moon percentage of illumination."""
-        self._set_site_date(date)
-        self.moon.compute(self.site)
-        return self.moon.moon_phase
+        if date is None:
+            date = self.date
+        moon = ephem.Moon(self.get_site_context(date))
+        return moon.moon_phase
 
     def night_center(self, date=None):
         """Returns night center in observer's time."""
@@ -438,39 +627,32 @@ class Observer(object):
         t_range = _set_data_range(self.date_to_utc(time_start),
                                   self.date_to_utc(time_stop),
                                   time_interval * ephem.minute)
-        #print('computing airmass history...')
-        history = []
-
-        # TODO: this should probably return a generator
-        for ut in t_range:
-            # ugh
-            tup = ephem.Date(ut).tuple()
-            args = tup[:-1] + (int(tup[-1]),)
-            ut_with_tz = self.tz_utc.localize(datetime(*args))
-            info = target.calc(self, ut_with_tz)
-            history.append(info)
-        #print(('computed airmass history', self.history))
-        return history
+
+        # target and moon in one batch
+        res = self.calc_batch([target, Moon], t_range, engine='numpy')
+        return TargetTrack(self, target, res.t_djd, res.alt[0], res.az[0],
+                           res.airmass[0], np.degrees(res.alt[1]),
+                           res.lmst, res.ha[0], res.pang[0])
 
     def get_target_info_table(self, target, time_start=None, time_stop=None):
         """Prints a table of hourly airmass data"""
-        history = self.get_target_info(target, time_start=time_start,
-                                       time_stop=time_stop)
+        track = self.get_target_info(target, time_start=time_start,
+                                     time_stop=time_stop)
         text = ''
         format = '%-16s  %-5s  %-5s  %-5s  %-5s  %-5s %-5s\n'
         header = ('Date       Local', 'UTC', 'LMST', 'HA', 'PA', 'AM', 'Moon')
         hstr = format % header
         text += hstr
         text += '_'*len(hstr) + '\n'
-        for info in history:
-            s_lt = info.lt.strftime('%d%b%Y  %H:%M')
-            s_utc = info.ut.strftime('%H:%M')
-            s_ha = ':'.join(str(ephem.hours(info.ha)).split(':')[:2])
-            s_lmst = ':'.join(str(ephem.hours(info.lmst)).split(':')[:2])
-            #s_pa = round(info.pang*180.0/np.pi, 1)
-            s_pa = round(info.pang, 1)
-            s_am = round(info.airmass, 2)
-            s_ma = round(info.moon_alt, 1)
+        for i, (lt, ut) in enumerate(zip(track.lt, track.ut)):
+            s_lt = lt.strftime('%d%b%Y  %H:%M')
+            s_utc = ut.strftime('%H:%M')
+            s_ha = ':'.join(str(ephem.hours(track.ha[i])).split(':')[:2])
+            s_lmst = ':'.join(str(ephem.hours(track.lmst[i])).split(':')[:2])
+            #s_pa = round(track.pang[i]*180.0/np.pi, 1)
+            s_pa = round(track.pang[i], 1)
+            s_am = round(track.airmass[i], 2)
+            s_ma = round(track.moon_alt[i], 1)
             if s_ma < 0:
                 s_ma = ''
             s_data = format % (s_lt, s_utc, s_lmst, s_ha, s_pa, s_am, s_ma)
@@ -493,11 +675,40 @@ class Body(object):
         self.dec = dec
         self.equinox = equinox
 
+        # for sharing calculations between bodies at the same position
+        self.key = (ra, dec, equinox)
+        # serializes calculations on the (mutable) ephem body
+        self.lock = threading.RLock()
+
         xeph_line = "%s,f|A,%s,%s,0.0,%s" % (name[:20], ra, dec, equinox)
         self._body = ephem.readdb(xeph_line)
 
     def calc(self, observer, date):
-        return CalculationResult(self._body, observer, date)
+        return observer.calc_cache.get(self, observer, date)
+
+
+# interned bodies, by position
+_bodies = weakref.WeakValueDictionary()
+_bodies_lock = threading.Lock()
+
+def get_body(name, ra, dec, equinox):
+    """Returns a Body for the position (`ra`, `dec`, `equinox`).
+    Bodies are interned: all callers asking for the same position share
+    one Body (which keeps the `name` of the first caller), and with it
+    all calculations cached for that position.
+    """
+    try:
+        eq_key = float(equinox)
+    except (TypeError, ValueError):
+        eq_key = equinox
+    key = (ra, dec, eq_key)
+    with _bodies_lock:
+        body = _bodies.get(key, None)
+        if body is None:
+            body = Body(name, ra, dec, equinox)
+            body.key = key
+            _bodies[key] = body
+        return body
 
 
 class SSBody(object):
@@ -506,36 +717,113 @@ class SSBody(object):
         super(SSBody, self).__init__()
 
         self.name = name
+        self.key = name
         self._body = body
+        # serializes calculations on the (mutable) ephem body
+        self.lock = threading.RLock()
 
     def calc(self, observer, date):
-        return CalculationResult(self._body, observer, date)
+        return observer.calc_cache.get(self, observer, date)
+
+
+class CalculationCache(object):
+    """
+    Bounded LRU cache of CalculationResults, keyed on the body and the
+    UTC time of the calculation.
+
+    If `quantum_sec` is nonzero, times are rounded to that many seconds
+    and the calculation is done for the rounded time, so that requests
+    for nearly identical times share one result.
+    """
+
+    def __init__(self, maxsize=20000, quantum_sec=0.0):
+        self.maxsize = maxsize
+        self.quantum_sec = quantum_sec
+
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self._cache = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+    def configure(self, maxsize=None, quantum_sec=None):
+        """Change the size or time quantum of the cache.  This clears
+        the cache.
+        """
+        with self.lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if quantum_sec is not None:
+                self.quantum_sec = quantum_sec
+            self.clear()
+
+    def get_stats(self):
+        """Returns a dict of cache statistics."""
+        with self.lock:
+            total = self.hits + self.misses
+            hit_rate = 0.0
+            if total > 0:
+                hit_rate = float(self.hits) / total
+            return dict(hits=self.hits, misses=self.misses,
+                        size=len(self._cache), maxsize=self.maxsize,
+                        quantum_sec=self.quantum_sec, hit_rate=hit_rate)
+
+    def get(self, body, observer, date):
+        """Returns the CalculationResult for `body` (a Body or SSBody)
+        at `date` (a datetime) as seen by `observer`.
+        """
+        if date.tzinfo is None:
+            # naive dates are treated as UTC by CalculationResult
+            date = pytz.utc.localize(date)
+        secs = (date - epoch_utc).total_seconds()
+        if self.quantum_sec > 0.0:
+            secs = round(secs / self.quantum_sec) * self.quantum_sec
+            date = epoch_utc + timedelta(0, secs)
+
+        key = (body.key, secs)
+        with self.lock:
+            try:
+                res = self._cache.pop(key)
+                self.hits += 1
+
+            except KeyError:
+                res = CalculationResult(body._body, observer, date,
+                                        lock=body.lock)
+                self.misses += 1
+                if len(self._cache) >= self.maxsize:
+                    # evict least recently used
+                    self._cache.popitem(last=False)
+
+            self._cache[key] = res
+        return res
 
 
 class CalculationResult(object):
 
-    def __init__(self, body, observer, date):
+    def __init__(self, body, observer, date, lock=None):
         """
         `date` is a datetime.datetime object converted to observer's
-        time.
+        time.  `lock`, if given, is held while computing `body`.
         """
+        self.observer = observer
         self.site = observer.site
         self.body = body
+        if lock is None:
+            lock = threading.RLock()
+        self.lock = lock
         self.date = observer.date_to_local(date)
         self.date_utc = observer.date_to_utc(self.date)
 
-        # Can/should this calculation be postponed?
-        self.site.date = ephem.Date(self.date_utc)
-        self.body.compute(self.site)
-
         self.lt = self.date
-        self.ra = self.body.ra
-        self.dec = self.body.dec
-        self.alt = float(self.body.alt)
-        self.az = float(self.body.az)
-        # TODO: deprecate
-        self.alt_deg = math.degrees(self.alt)
-        self.az_deg = math.degrees(self.az)
+
+        # position is calculated on first access (see _calc_position())
+        self._ra = None
+        self._dec = None
+        self._alt = None
+        self._az = None
 
         # properties
         self._ut = None
@@ -548,6 +836,47 @@ class CalculationResult(object):
         self._moon_pct = None
         self._moon_sep = None
 
+    def _calc_position(self):
+        site = self.observer.get_site_context(ephem.Date(self.date_utc))
+        with self.lock:
+            self.body.compute(site)
+
+            ra, dec = self.body.ra, self.body.dec
+            alt, az = float(self.body.alt), float(self.body.az)
+        self._ra, self._dec, self._alt, self._az = ra, dec, alt, az
+
+    @property
+    def ra(self):
+        if self._ra is None:
+            self._calc_position()
+        return self._ra
+
+    @property
+    def dec(self):
+        if self._dec is None:
+            self._calc_position()
+        return self._dec
+
+    @property
+    def alt(self):
+        if self._alt is None:
+            self._calc_position()
+        return self._alt
+
+    @property
+    def az(self):
+        if self._az is None:
+            self._calc_position()
+        return self._az
+
+    # TODO: deprecate
+    @property
+    def alt_deg(self):
+        return math.degrees(self.alt)
+
+    @property
+    def az_deg(self):
+        return math.degrees(self.az)
 
     @property
     def ut(self):
@@ -595,7 +924,7 @@ class CalculationResult(object):
     @property
     def moon_alt(self):
         if self._moon_alt is None:
-            moon_alt, moon_pct, moon_sep = self.calc_moon(self.site, self.body)
+            moon_alt, moon_pct, moon_sep = self.calc_moon(self.observer.get_site_context(), self.body)
             self._moon_alt = moon_alt
             self._moon_pct = moon_pct
             self._moon_sep = moon_sep
@@ -604,7 +933,7 @@ class CalculationResult(object):
     @property
     def moon_pct(self):
         if self._moon_pct is None:
-            moon_alt, moon_pct, moon_sep = self.calc_moon(self.site, self.body)
+            moon_alt, moon_pct, moon_sep = self.calc_moon(self.observer.get_site_context(), self.body)
             self._moon_alt = moon_alt
             self._moon_pct = moon_pct
             self._moon_sep = moon_sep
@@ -613,7 +942,7 @@ class CalculationResult(object):
     @property
     def moon_sep(self):
         if self._moon_sep is None:
-            moon_alt, moon_pct, moon_sep = self.calc_moon(self.site, self.body)
+            moon_alt, moon_pct, moon_sep = self.calc_moon(self.observer.get_site_context(), self.body)
             self._moon_alt = moon_alt
             self._moon_pct = moon_pct
             self._moon_sep = moon_sep
@@ -671,8 +1000,9 @@ class CalculationResult(object):
         moon_alt = math.degrees(float(moon.alt))
         # moon.phase is % of moon that is illuminated
         moon_pct = moon.moon_phase
-        # calculate distance from target
-        moon_sep = ephem.separation(moon, body)
+        # calculate distance from target (use our own position, since
+        # the body may have been computed for another time since)
+        moon_sep = ephem.separation((self.ra, self.dec), (moon.ra, moon.dec))
         moon_sep = math.degrees(float(moon_sep))
         return (moon_alt, moon_pct, moon_sep)
 
@@ -686,6 +1016,876 @@ class CalculationResult(object):
         return (delta_alt, delta_az)
 
 
+class Almanac(object):
+    """
+    Sunset, sunrise and twilight times for an observer.
+
+    Events are computed a (UTC) day at a time, all kinds of event in one
+    pass, and cached.  The almanac uses its own site and sun, so it does
+    not disturb the observer's state and can be used from several threads
+    at once.
+    """
+
+    # event name -> (name of observer's horizon attribute, rising?)
+    event_defs = dict(sunset=('horizon', False),
+                      sunrise=('horizon', True),
+                      evening_twilight_6=('horizon6', False),
+                      evening_twilight_12=('horizon12', False),
+                      evening_twilight_18=('horizon18', False),
+                      morning_twilight_6=('horizon6', True),
+                      morning_twilight_12=('horizon12', True),
+                      morning_twilight_18=('horizon18', True))
+
+    def __init__(self, observer):
+        self.observer = observer
+
+        self.lock = threading.RLock()
+        self._site = observer.get_site()
+        self._sun = ephem.Sun()
+        # days (integral ephem dates) that have been computed
+        self._days = set()
+        # event name -> sorted list of event times (ephem dates)
+        self._events = dict([(name, []) for name in self.event_defs])
+
+    def precompute(self, time_start, time_stop):
+        """Compute and cache all events between `time_start` and
+        `time_stop`.
+        """
+        djd_start = self.observer._date_to_djd(time_start)
+        djd_stop = self.observer._date_to_djd(time_stop)
+        with self.lock:
+            for day in range(int(math.floor(djd_start)),
+                             int(math.floor(djd_stop)) + 2):
+                self._calc_day(day)
+
+    def _calc_day(self, day):
+        if day in self._days:
+            return
+        site, sun = self._site, self._sun
+        for name, (horizon_attr, rising) in self.event_defs.items():
+            site.horizon = getattr(self.observer, horizon_attr)
+            if rising:
+                next_event = site.next_rising
+            else:
+                next_event = site.next_setting
+
+            events = self._events[name]
+            start = float(day)
+            while True:
+                try:
+                    event = float(next_event(sun, start=start))
+                except (ephem.NeverUpError, ephem.AlwaysUpError):
+                    break
+                if event >= day + 1:
+                    break
+                i = bisect.bisect_left(events, event)
+                events.insert(i, event)
+                start = event + ephem.second
+        self._days.add(day)
+
+    def next_event(self, name, djd):
+        """Returns the time (ephem date) of the first event `name`
+        (e.g. 'sunset') after ephem date `djd`.
+        """
+        day = int(math.floor(djd))
+        with self.lock:
+            events = self._events[name]
+            for i in range(3):
+                self._calc_day(day + i)
+                j = bisect.bisect_right(events, djd)
+                if j < len(events) and events[j] < day + i + 1:
+                    return ephem.Date(events[j])
+
+        raise ValueError("No %s within 3 days of %s" % (name, ephem.Date(djd)))
+
+
+class FixedTargetEngine(object):
+    """
+    Vectorized calculation of the positions of fixed (RA/DEC) targets.
+
+    The apparent place of each target is computed with pyephem once, at
+    `time_ref` (precession, nutation and aberration hardly change over a
+    night), and then local sidereal time, hour angle, altitude (with
+    refraction) and azimuth are computed with NumPy for whole arrays of
+    times.  Intended for times within a day or so of `time_ref`.
+    """
+
+    def __init__(self, observer, targets, time_ref):
+        self.observer = observer
+        self.targets = targets
+        self.djd_ref = observer._date_to_djd(time_ref)
+
+        site = observer.get_site(date=observer.date)
+        site.date = self.djd_ref
+        self.lat = float(site.lat)
+        self.lon = float(site.lon)
+        self.pressure = float(site.pressure)
+        self.temperature = float(site.temp)
+
+        ra, dec = np.zeros(len(targets)), np.zeros(len(targets))
+        for i, target in enumerate(targets):
+            body = _get_body(target)
+            with body.lock:
+                body._body.compute(site)
+                ra[i], dec[i] = body._body.ra, body._body.dec
+        self.ra, self.dec = ra, dec
+
+        # calibrate our (mean) sidereal time against the apparent
+        # sidereal time of pyephem at the reference time
+        lst_ref = self._calc_lmst(np.array([self.djd_ref]))[0]
+        self.lst_offset = float(site.sidereal_time()) - lst_ref
+
+    def _calc_lmst(self, t_djd):
+        jd = np.asarray(t_djd) + djd_epoch_jd
+        return calc_gmst_array(jd) + self.lon
+
+    def calc_lst(self, t_djd):
+        """Local apparent sidereal time (radians) at ephem dates `t_djd`.
+        """
+        return np.mod(self._calc_lmst(t_djd) + self.lst_offset, 2*np.pi)
+
+    def calc_ha(self, t_djd, idx=None):
+        """Hour angles (radians) of the targets at ephem dates `t_djd`.
+        Returns an array of shape (num_targets, num_times).  If `idx` is
+        given, returns the hour angles of targets `idx` at the times
+        `t_djd` instead, pairwise (with broadcasting).
+        """
+        if idx is None:
+            ha = self.calc_lst(t_djd)[np.newaxis, :] - self.ra[:, np.newaxis]
+        else:
+            ha = self.calc_lst(t_djd) - self.ra[idx]
+        return np.mod(ha + np.pi, 2*np.pi) - np.pi
+
+    def calc_alt_az(self, t_djd, idx=None):
+        """Apparent (refracted) altitudes and azimuths (radians) of the
+        targets at ephem dates `t_djd`.  Returns two arrays of shape
+        (num_targets, num_times), or if `idx` is given, of targets `idx`
+        at the times `t_djd` pairwise (see calc_ha()).
+        """
+        ha = self.calc_ha(t_djd, idx=idx)
+        if idx is None:
+            dec = self.dec[:, np.newaxis]
+        else:
+            dec = self.dec[idx]
+        sin_lat, cos_lat = math.sin(self.lat), math.cos(self.lat)
+
+        sin_alt = sin_lat*np.sin(dec) + cos_lat*np.cos(dec)*np.cos(ha)
+        alt = np.arcsin(np.clip(sin_alt, -1.0, 1.0))
+        az = np.arctan2(-np.cos(dec)*np.sin(ha),
+                        np.sin(dec)*cos_lat - np.cos(dec)*np.cos(ha)*sin_lat)
+        az = np.mod(az, 2*np.pi)
+
+        alt = alt + calc_refraction_array(self.pressure, self.temperature,
+                                          alt)
+        return alt, az
+
+    def calc_transits(self, djd_start, djd_stop, lower=False):
+        """Times (ephem dates) of upper (or `lower`) transit of each
+        target between `djd_start` and `djd_stop`.  Returns an array of
+        shape (num_targets, num_transits); transits that do not fall
+        into the period are clipped to its ends.
+        """
+        ha_start = self.calc_ha(np.array([djd_start]))[:, 0]
+        if lower:
+            ha_start = ha_start + np.pi
+        # time until hour angle next comes around to zero
+        dt = np.mod(-ha_start, 2*np.pi) / sidereal_rate
+        period = 2*np.pi / sidereal_rate
+        num = int(math.ceil((djd_stop - djd_start) / period)) + 1
+        t_djd = (djd_start + dt[:, np.newaxis] +
+                 period * np.arange(num)[np.newaxis, :])
+        return np.clip(t_djd, djd_start, djd_stop)
+
+
+class ElevationWindowSolver(object):
+    """
+    Vectorized solver for the windows of time during which targets are
+    between a minimum and maximum altitude, in a fixed period (typically
+    a night).
+
+    Altitudes of all targets are sampled on a common time grid, to which
+    the times of upper and lower transit of each fixed target are added,
+    so that altitude is monotonic between samples and no crossing of the
+    altitude limits can be missed.  Each crossing is then located by
+    bisection with the NumPy engine, and finally corrected to the
+    altitude computed by pyephem.
+    """
+
+    def __init__(self, observer, time_start, time_stop, time_interval=10,
+                 tolerance=0.1):
+        self.observer = observer
+        self.djd_start = observer._date_to_djd(time_start)
+        self.djd_stop = observer._date_to_djd(time_stop)
+        # grid interval (minutes) and precision of crossings (seconds)
+        self.time_interval = time_interval
+        self.tolerance = tolerance
+
+        num = int(math.ceil((self.djd_stop - self.djd_start) * 1440.0 /
+                            time_interval))
+        self.t_djd = np.linspace(self.djd_start, self.djd_stop,
+                                 max(num, 1) + 1)
+
+        # use a private site so that the shared one is not disturbed
+        self._site = observer.get_site(date=time_start)
+        self.lock = threading.RLock()
+
+    def solve(self, targets, min_alt_deg, max_alt_deg=90.0):
+        """
+        Find the windows during which each of `targets` is between
+        `min_alt_deg` and `max_alt_deg` (scalars, or sequences with one
+        value per target).  A `max_alt_deg` below 90 gives windows that
+        avoid the zenith.
+
+        Returns a list with one tuple of two sorted lists (rise times,
+        set times) of ephem dates (as floats) per target.
+        """
+        num = len(targets)
+        min_alt = np.radians(np.broadcast_to(np.asarray(min_alt_deg,
+                                                        dtype=float), (num,)))
+        max_alt = np.radians(np.broadcast_to(np.asarray(max_alt_deg,
+                                                        dtype=float), (num,)))
+        bodies = [_get_body(target) for target in targets]
+        fixed = [i for i, body in enumerate(bodies) if isinstance(body, Body)]
+        others = [i for i, body in enumerate(bodies)
+                  if not isinstance(body, Body)]
+
+        results = [None] * num
+        with self.lock:
+            if len(fixed) > 0:
+                windows = self._solve_fixed([bodies[i] for i in fixed],
+                                            min_alt[fixed], max_alt[fixed])
+                for i, window in zip(fixed, windows):
+                    results[i] = window
+
+            for i in others:
+                # solar system bodies move: sample them with pyephem
+                body = bodies[i]
+                t_djd = self.t_djd[np.newaxis, :]
+                alt = self._calc_alt_ephem([body], [0] * t_djd.shape[1],
+                                           t_djd[0])[np.newaxis, :]
+
+                def alt_fn(idx, t_djd):
+                    return self._calc_alt_ephem([body], idx, t_djd)
+
+                results[i] = self._find_windows(t_djd, alt, min_alt[[i]],
+                                                max_alt[[i]], alt_fn,
+                                                alt_fn)[0]
+        return results
+
+    def _solve_fixed(self, bodies, min_alt, max_alt):
+        djd_ref = 0.5 * (self.djd_start + self.djd_stop)
+        engine = FixedTargetEngine(self.observer, bodies, ephem.Date(djd_ref))
+
+        # sample times per target: the grid plus transits
+        num = len(bodies)
+        t_djd = np.hstack((np.broadcast_to(self.t_djd, (num, len(self.t_djd))),
+                           engine.calc_transits(self.djd_start, self.djd_stop),
+                           engine.calc_transits(self.djd_start, self.djd_stop,
+                                                lower=True)))
+        t_djd.sort(axis=1)
+        alt, az = engine.calc_alt_az(t_djd, idx=np.arange(num)[:, np.newaxis])
+
+        def alt_fn(idx, t_djd):
+            return engine.calc_alt_az(t_djd, idx=idx)[0]
+
+        def alt_fn_exact(idx, t_djd):
+            return self._calc_alt_ephem(bodies, idx, t_djd)
+
+        return self._find_windows(t_djd, alt, min_alt, max_alt, alt_fn,
+                                  alt_fn_exact)
+
+    def _calc_alt_ephem(self, bodies, idx, t_djd):
+        site = self._site
+        alt = np.zeros(len(t_djd))
+        for k, (i, djd) in enumerate(zip(idx, t_djd)):
+            body = bodies[i]
+            site.date = djd
+            with body.lock:
+                body._body.compute(site)
+                alt[k] = body._body.alt
+        return alt
+
+    def _find_crossings(self, t_djd, ok, limit, is_min, alt_fn,
+                        alt_fn_exact):
+        # locate the times at which `ok` (alt above or below `limit`)
+        # changes, for all targets at once
+        rows, cols = np.nonzero(ok[:, :-1] != ok[:, 1:])
+        if len(rows) == 0:
+            return rows, np.zeros(0), np.zeros(0, dtype=bool)
+        lo, hi = t_djd[rows, cols], t_djd[rows, cols + 1]
+        ok_lo = ok[rows, cols]
+        limit = limit[rows]
+
+        def is_ok(alt):
+            if is_min:
+                return alt >= limit
+            return alt <= limit
+
+        width = (hi - lo).max() * 86400.0
+        num_iter = max(int(math.ceil(math.log(max(width, self.tolerance) /
+                                              self.tolerance, 2))), 0)
+        for i in range(num_iter):
+            mid = 0.5 * (lo + hi)
+            same = is_ok(alt_fn(rows, mid)) == ok_lo
+            lo = np.where(same, mid, lo)
+            hi = np.where(same, hi, mid)
+        t_cross = 0.5 * (lo + hi)
+
+        if alt_fn_exact is not alt_fn:
+            # one Newton step to the altitude computed by pyephem; the
+            # difference to the NumPy engine is a few arcsec at most
+            # (limited to a minute, where altitude hardly changes)
+            dt = 30.0 / 86400.0
+            rate = (alt_fn(rows, t_cross + dt) -
+                    alt_fn(rows, t_cross - dt)) / (2 * dt)
+            err = limit - alt_fn_exact(rows, t_cross)
+            corr = err / np.where(rate != 0.0, rate, np.inf)
+            t_cross = t_cross + np.clip(corr, -2 * dt, 2 * dt)
+
+        return rows, t_cross, ~ok_lo
+
+    def _find_windows(self, t_djd, alt, min_alt, max_alt, alt_fn,
+                      alt_fn_exact):
+        ok_min = alt >= min_alt[:, np.newaxis]
+        ok_max = alt <= max_alt[:, np.newaxis]
+
+        # (time, limit, new state) for each crossing of each target
+        events = [[] for i in range(len(alt))]
+        for n, (ok, limit, is_min) in enumerate(((ok_min, min_alt, True),
+                                                 (ok_max, max_alt, False))):
+            rows, t_cross, state = self._find_crossings(t_djd, ok, limit,
+                                                        is_min, alt_fn,
+                                                        alt_fn_exact)
+            for i, t, st in zip(rows, t_cross, state):
+                events[i].append((t, n, st))
+
+        results = []
+        for i in range(len(alt)):
+            state = [ok_min[i, 0], ok_max[i, 0]]
+            inside = state[0] and state[1]
+            rises, sets = [], []
+            if inside:
+                rises.append(self.djd_start)
+            for t, n, st in sorted(events[i]):
+                state[n] = st
+                now_inside = state[0] and state[1]
+                if now_inside and not inside:
+                    rises.append(max(float(t), self.djd_start))
+                elif inside and not now_inside:
+                    sets.append(min(float(t), self.djd_stop))
+                inside = now_inside
+            if inside:
+                sets.append(self.djd_stop)
+            results.append((rises, sets))
+
+        return results
+
+
+class BatchCalculationResult(object):
+    """
+    Result of Observer.calc_batch().  Values are stored as dense NumPy
+    arrays of shape (num_targets, num_times), in the same units as the
+    corresponding CalculationResult attributes.
+    """
+
+    def __init__(self, observer, targets, t_djd, ra, dec, alt, az):
+        self.observer = observer
+        self.targets = targets
+        # ephem (Dublin Julian) dates, UTC
+        self.t_djd = t_djd
+        self.ra = ra
+        self.dec = dec
+        self.alt = alt
+        self.az = az
+
+        # properties
+        self._lt = None
+        self._lmst = None
+        self._ha = None
+        self._pang = None
+        self._am = None
+
+    @property
+    def shape(self):
+        return self.alt.shape
+
+    @property
+    def alt_deg(self):
+        return np.degrees(self.alt)
+
+    @property
+    def az_deg(self):
+        return np.degrees(self.az)
+
+    @property
+    def lt(self):
+        """List of times as datetimes in the observer's time zone."""
+        if self._lt is None:
+            self._lt = [self.observer.date_to_local(ephem.Date(djd).datetime())
+                        for djd in self.t_djd]
+        return self._lt
+
+    @property
+    def lmst(self):
+        if self._lmst is None:
+            jd = self.t_djd + djd_epoch_jd
+            lon = float(self.observer.site.long)
+            self._lmst = np.mod(calc_gmst_array(jd) + lon, 2*np.pi)
+        return self._lmst
+
+    @property
+    def ha(self):
+        if self._ha is None:
+            self._ha = self.lmst[np.newaxis, :] - self.ra
+        return self._ha
+
+    @property
+    def pang(self):
+        if self._pang is None:
+            lat = float(self.observer.site.lat)
+            self._pang = calc_parallactic_array(self.dec, self.ha, lat,
+                                                self.az)
+        return self._pang
+
+    @property
+    def airmass(self):
+        if self._am is None:
+            self._am = calc_airmass_array(self.alt)
+        return self._am
+
+
+class TargetTrack(object):
+    """
+    Values for one target over a series of times, as returned by
+    Observer.get_target_info().  Values are stored as contiguous NumPy
+    arrays with one element per time, in the same units as the
+    corresponding CalculationResult attributes.  Slicing a track gives
+    a track over the selected times.
+    """
+
+    def __init__(self, observer, target, t_djd, alt, az, airmass,
+                 moon_alt, lmst, ha, pang):
+        self.observer = observer
+        self.target = target
+        # ephem (Dublin Julian) dates, UTC
+        self.t_djd = t_djd
+        self.alt = alt
+        self.az = az
+        self.airmass = airmass
+        self.moon_alt = moon_alt
+        self.lmst = lmst
+        self.ha = ha
+        self.pang = pang
+
+        # properties
+        self._ut = None
+        self._lt = None
+
+    def __len__(self):
+        return len(self.t_djd)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("TargetTrack only supports slicing")
+        return TargetTrack(self.observer, self.target, self.t_djd[key],
+                           self.alt[key], self.az[key], self.airmass[key],
+                           self.moon_alt[key], self.lmst[key], self.ha[key],
+                           self.pang[key])
+
+    @property
+    def alt_deg(self):
+        return np.degrees(self.alt)
+
+    @property
+    def az_deg(self):
+        return np.degrees(self.az)
+
+    @property
+    def ut(self):
+        """List of times as datetimes in UTC."""
+        if self._ut is None:
+            self._ut = [self.observer.tz_utc.localize(ephem.Date(djd).datetime())
+                        for djd in self.t_djd]
+        return self._ut
+
+    @property
+    def lt(self):
+        """List of times as datetimes in the observer's time zone."""
+        if self._lt is None:
+            self._lt = [ut.astimezone(self.observer.tz_local)
+                        for ut in self.ut]
+        return self._lt
+
+
+class VisibilityIndex(object):
+    """
+    Index of the windows during which targets are within a range of
+    altitudes, for a fixed period of time (typically a night).
+
+    The windows for a (target, altitude range) combination are computed
+    once, by an ElevationWindowSolver, and observable() queries are then
+    answered by looking up the window covering the query period.  Use
+    precompute() to solve for many targets at once.
+    """
+
+    def __init__(self, observer, time_start, time_stop):
+        self.observer = observer
+        self.time_start = time_start
+        self.time_stop = time_stop
+        self.djd_start = observer._date_to_djd(time_start)
+        self.djd_stop = observer._date_to_djd(time_stop)
+
+        self.solver = ElevationWindowSolver(observer, time_start, time_stop)
+        # (body key, min altitude, max altitude) -> ([rise times], [set times])
+        self._intervals = {}
+        self.lock = threading.RLock()
+
+    def precompute(self, targets, min_alt_degs, max_alt_degs=90.0):
+        """Compute the windows for all `targets` at once.  The altitude
+        limits are scalars or sequences with one value per target.
+        """
+        num = len(targets)
+        min_alt_degs = np.broadcast_to(np.asarray(min_alt_degs, dtype=float),
+                                       (num,))
+        max_alt_degs = np.broadcast_to(np.asarray(max_alt_degs, dtype=float),
+                                       (num,))
+        with self.lock:
+            todo = OrderedDict()
+            for target, min_alt_deg, max_alt_deg in zip(targets,
+                                                        min_alt_degs,
+                                                        max_alt_degs):
+                key = (_get_body(target).key, float(min_alt_deg),
+                       float(max_alt_deg))
+                if key not in self._intervals:
+                    todo[key] = target
+            if len(todo) == 0:
+                return
+
+            keys = list(todo.keys())
+            windows = self.solver.solve(list(todo.values()),
+                                        [key[1] for key in keys],
+                                        [key[2] for key in keys])
+            self._intervals.update(zip(keys, windows))
+
+    def get_intervals(self, target, min_alt_deg, max_alt_deg=90.0):
+        """Returns a tuple of two sorted lists (rise times, set times)
+        of ephem dates for the windows that `target` is between
+        `min_alt_deg` and `max_alt_deg` during the indexed period.
+        """
+        key = (_get_body(target).key, float(min_alt_deg), float(max_alt_deg))
+        with self.lock:
+            try:
+                return self._intervals[key]
+
+            except KeyError:
+                self.precompute([target], min_alt_deg, max_alt_deg)
+                return self._intervals[key]
+
+    def observable(self, target, time_start, time_stop,
+                   el_min_deg, el_max_deg, time_needed,
+                   airmass=None, moon_sep=None):
+        """
+        Same as Observer.observable(), but answered from the index.
+        Periods that are not completely within the indexed period are
+        passed on to the observer.
+        """
+        djd_start = self.observer._date_to_djd(time_start)
+        djd_stop = self.observer._date_to_djd(time_stop)
+        if (djd_start < self.djd_start) or (djd_stop > self.djd_stop):
+            return self.observer.observable(target, time_start, time_stop,
+                                            el_min_deg, el_max_deg,
+                                            time_needed, airmass=airmass,
+                                            moon_sep=moon_sep)
+
+        min_alt_deg = calc_min_alt_deg(el_min_deg, airmass=airmass)
+        rises, sets = self.get_intervals(target, min_alt_deg, el_max_deg)
+
+        return self.observer._observable_window(rises, sets, djd_start,
+                                                djd_stop, time_needed)
+
+    def observable_windows(self, windows, t_start, t_stop, time_needed):
+        """
+        Same as observable(), but for `windows` previously returned by
+        get_intervals(), and with times in seconds since the epoch
+        (also for the times returned).  Returns None if the period is
+        not completely within the indexed period.
+        """
+        djd_start = epoch_to_djd(t_start)
+        djd_stop = epoch_to_djd(t_stop)
+        if (djd_start < self.djd_start) or (djd_stop > self.djd_stop):
+            return None
+
+        rises, sets = windows
+        can_obs, time_rise, time_end = self.observer._find_window(
+            rises, sets, djd_start, djd_stop, time_needed)
+        if time_rise is None:
+            return (False, None, None)
+        # times clipped to the period are returned as given, so that
+        # they do not pick up rounding errors of the conversions
+        if time_rise > djd_start:
+            t_start = djd_to_epoch(time_rise)
+        if time_end < djd_stop:
+            t_stop = djd_to_epoch(time_end)
+        return (can_obs, t_start, t_stop)
+
+    def is_past_windows(self, windows, t_start, time_needed):
+        """
+        Returns True if none of the `windows` previously returned by
+        get_intervals() leaves `time_needed` seconds after `t_start`
+        (seconds since the epoch), i.e. the target cannot be observed
+        for that long anymore during the indexed period.
+        """
+        djd_start = epoch_to_djd(t_start)
+        if (djd_start < self.djd_start) or (djd_start > self.djd_stop):
+            return False
+
+        sets = windows[1]
+        if len(sets) == 0:
+            return True
+        return (sets[-1] - djd_start) * 86400.0 <= time_needed
+
+
+class AltAzTable(object):
+    """
+    Table of the altitudes and azimuths of targets, computed once on a
+    time grid for a fixed period (typically a night).
+
+    Targets are added to the table as they are needed, or in batches
+    with add_targets().  Positions of fixed targets are computed
+    vectorized with a FixedTargetEngine, those of solar system bodies
+    with pyephem.  Values for times in between the grid points are
+    interpolated.
+    """
+
+    def __init__(self, observer, time_start, time_stop, time_interval=2):
+        self.observer = observer
+        self.time_start = time_start
+        self.time_stop = time_stop
+        self.djd_start = observer._date_to_djd(time_start)
+        self.djd_stop = observer._date_to_djd(time_stop)
+
+        self.t_ival = time_interval * ephem.minute
+        num = int(math.ceil((self.djd_stop - self.djd_start) / self.t_ival))
+        self.t_djd = self.djd_start + np.arange(max(num, 1) + 1) * self.t_ival
+
+        # use a private site so that the shared one is not disturbed
+        self._site = observer.get_site(date=time_start)
+        # body key -> row of the table
+        self._index = {}
+        # altitude and (unwrapped) azimuth (deg), one row per target;
+        # there is room for more rows than are in use (see _reserve())
+        self.alt_deg = np.zeros((0, len(self.t_djd)))
+        self.az_deg = np.zeros((0, len(self.t_djd)))
+        self.lock = threading.RLock()
+
+    def _reserve(self, num_rows):
+        # make room for `num_rows` targets, at least doubling the size of
+        # the table, so that adding targets a few at a time does not
+        # copy it every time
+        size = len(self.alt_deg)
+        if num_rows <= size:
+            return
+        size = max(num_rows, 2 * size)
+        for name in ('alt_deg', 'az_deg'):
+            old = getattr(self, name)
+            new = np.zeros((size, len(self.t_djd)))
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add_targets(self, targets):
+        """Compute the positions of all `targets` not yet in the table."""
+        with self.lock:
+            todo = OrderedDict()
+            for target in targets:
+                body = _get_body(target)
+                if body.key not in self._index:
+                    todo[body.key] = body
+            if len(todo) == 0:
+                return
+
+            bodies = list(todo.values())
+            alt = np.zeros((len(bodies), len(self.t_djd)))
+            az = np.zeros((len(bodies), len(self.t_djd)))
+
+            fixed = [i for i, body in enumerate(bodies)
+                     if isinstance(body, Body)]
+            if len(fixed) > 0:
+                djd_ref = 0.5 * (self.djd_start + self.djd_stop)
+                engine = FixedTargetEngine(self.observer,
+                                           [bodies[i] for i in fixed],
+                                           ephem.Date(djd_ref))
+                alt[fixed], az[fixed] = engine.calc_alt_az(self.t_djd)
+
+            for i, body in enumerate(bodies):
+                if isinstance(body, Body):
+                    continue
+                # solar system bodies move: sample them with pyephem
+                for k, djd in enumerate(self.t_djd):
+                    self._site.date = djd
+                    with body.lock:
+                        body._body.compute(self._site)
+                        alt[i, k] = body._body.alt
+                        az[i, k] = body._body.az
+
+            num = len(self._index)
+            self._reserve(num + len(bodies))
+            self.alt_deg[num:num + len(bodies)] = np.degrees(alt)
+            # unwrap azimuth so that it can be interpolated across north
+            self.az_deg[num:num + len(bodies)] = np.degrees(np.unwrap(az,
+                                                                      axis=1))
+            self._index.update(zip(todo.keys(),
+                                   range(num, num + len(bodies))))
+
+    def get_index(self, targets):
+        """Returns an array with the rows of the table for `targets`,
+        adding the targets that are not in the table yet.
+        """
+        keys = [_get_body(target).key for target in targets]
+        with self.lock:
+            try:
+                return np.array([self._index[key] for key in keys],
+                                dtype=int)
+
+            except KeyError:
+                self.add_targets(targets)
+                return np.array([self._index[key] for key in keys],
+                                dtype=int)
+
+    def covers(self, djd):
+        """True if ephem date(s) `djd` are all within the table period."""
+        djd = np.asarray(djd)
+        return bool(np.all((djd >= self.djd_start) & (djd <= self.djd_stop)))
+
+    def alt_az(self, idx, djd, unwrap=False):
+        """Altitudes and azimuths (deg) of the targets in rows `idx` of
+        the table at ephem dates `djd`, pairwise (with broadcasting).
+        Azimuths are in the range [0, 360), unless `unwrap` is True:
+        then they change continuously in time for each target.
+        """
+        pos = np.clip((np.asarray(djd) - self.djd_start) / self.t_ival,
+                      0.0, len(self.t_djd) - 1)
+        i = np.minimum(pos.astype(int), len(self.t_djd) - 2)
+        w = pos - i
+        alt = self.alt_deg[idx, i] * (1.0 - w) + self.alt_deg[idx, i + 1] * w
+        az = self.az_deg[idx, i] * (1.0 - w) + self.az_deg[idx, i + 1] * w
+        if unwrap:
+            return alt, az
+        return alt, np.mod(az, 360.0)
+
+    def calc(self, target, time):
+        """Returns the altitude and azimuth (deg) of `target` at `time`
+        (a datetime), or None if `time` is outside the table period.
+        """
+        return self.calc_djd(target, self.observer._date_to_djd(time))
+
+    def calc_djd(self, target, djd):
+        """Same as calc(), for the ephem date `djd`."""
+        if (djd < self.djd_start) or (djd > self.djd_stop):
+            return None
+        alt, az = self.alt_az(self.get_index([target])[0], djd)
+        return float(alt), float(az)
+
+
+class MoonTable(object):
+    """
+    Table of the moon's position, altitude and illumination, computed
+    once on a fine time grid for a fixed period (typically a night).
+
+    Values for times in between the grid points are interpolated, and
+    the separation of targets from the moon is computed vectorized from
+    the table.
+    """
+
+    def __init__(self, observer, time_start, time_stop, time_interval=5):
+        self.observer = observer
+        self.time_start = time_start
+        self.time_stop = time_stop
+        self.djd_start = observer._date_to_djd(time_start)
+        self.djd_stop = observer._date_to_djd(time_stop)
+
+        t_ival = time_interval * ephem.minute
+        num = int(math.ceil((self.djd_stop - self.djd_start) / t_ival)) + 1
+        self.t_djd = self.djd_start + np.arange(num + 1) * t_ival
+
+        # use a private site and moon so that shared ones are not disturbed
+        self._site = observer.get_site(date=time_start)
+        moon = ephem.Moon()
+        ra, dec = np.zeros(len(self.t_djd)), np.zeros(len(self.t_djd))
+        alt, pct = np.zeros(len(self.t_djd)), np.zeros(len(self.t_djd))
+        for i, djd in enumerate(self.t_djd):
+            self._site.date = djd
+            moon.compute(self._site)
+            ra[i], dec[i] = moon.ra, moon.dec
+            alt[i], pct[i] = moon.alt, moon.moon_phase
+
+        # unwrap RA so that it can be interpolated across 0h
+        self.ra = np.unwrap(ra)
+        self.dec = dec
+        self.alt_deg = np.degrees(alt)
+        self.pct = pct
+
+        # body key -> (ra, dec) of targets at the middle of the period
+        self._targets = {}
+        self.lock = threading.RLock()
+
+    def moon_alt(self, djd):
+        """Moon altitude (deg) at ephem date(s) `djd`."""
+        return np.interp(djd, self.t_djd, self.alt_deg)
+
+    def moon_pct(self, djd):
+        """Moon illumination (fraction) at ephem date(s) `djd`."""
+        return np.interp(djd, self.t_djd, self.pct)
+
+    def moon_radec(self, djd):
+        """Moon apparent RA and DEC (radians) at ephem date(s) `djd`."""
+        ra = np.mod(np.interp(djd, self.t_djd, self.ra), 2*np.pi)
+        dec = np.interp(djd, self.t_djd, self.dec)
+        return ra, dec
+
+    def get_target_radec(self, target):
+        """Apparent RA and DEC (radians) of `target`.  Fixed targets
+        hardly move in one night, so this is computed once, for the
+        middle of the period.
+        """
+        body = _get_body(target)
+        with self.lock:
+            try:
+                return self._targets[body.key]
+
+            except KeyError:
+                self._site.date = (self.djd_start + self.djd_stop) / 2.0
+                with body.lock:
+                    body._body.compute(self._site)
+                    radec = (float(body._body.ra), float(body._body.dec))
+                self._targets[body.key] = radec
+                return radec
+
+    def moon_sep(self, target, djd):
+        """Separation (deg) of `target` from the moon at ephem date(s)
+        `djd`.
+        """
+        ra, dec = self.get_target_radec(target)
+        m_ra, m_dec = self.moon_radec(djd)
+        hav = (np.sin((m_dec - dec) / 2.0)**2 +
+               np.cos(dec) * np.cos(m_dec) * np.sin((m_ra - ra) / 2.0)**2)
+        return np.degrees(2.0 * np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0))))
+
+    def get_sample_times(self, time_start, time_stop):
+        """Returns an array of ephem dates covering the interval from
+        `time_start` to `time_stop`: the end points and every table grid
+        point in between.
+        """
+        return self.get_sample_times_djd(self.observer._date_to_djd(time_start),
+                                         self.observer._date_to_djd(time_stop))
+
+    def get_sample_times_djd(self, djd1, djd2):
+        """Same as get_sample_times(), for the interval between ephem
+        dates `djd1` and `djd2`.
+        """
+        i, j = np.searchsorted(self.t_djd, [djd1, djd2], side='right')
+        return np.concatenate(([djd1], self.t_djd[i:j], [djd2]))
+
+
 Moon = SSBody('Moon', ephem.Moon())
 Sun = SSBody('Sun', ephem.Sun())
 Mercury = SSBody('Mercury', ephem.Mercury())